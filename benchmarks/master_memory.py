@@ -0,0 +1,117 @@
+"""
+Benchmark the master's footprint: the conformed master schema against the legacy one, in memory and on disk.
+
+The legacy master is what the app loaded before master_schema: hex string ids, object string columns and float dollar amounts,
+written with a plain DataFrame.to_parquet(). Both are built from the same synthetic master, read back from Parquet bytes,
+and checked to hold the same values. Memory is measured with DataFrame.memory_usage(deep=True), per 100k rows.
+
+Usage:
+    python benchmarks/master_memory.py [--sizes 10000 100000 1000000]
+"""
+
+import os
+import sys
+import time
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambdas", "update_master"))
+import master_schema as schema
+
+PER_ROWS = 100_000
+
+ISSUERS = ["amex", "chase", "discover", "wells_fargo", "capital_one"]
+CATEGORIES = [f"Category {i}" for i in range(40)]
+
+def master(num_rows, seed=0):
+    """A synthetic legacy master: a few thousand merchants, about 80% of rows categorized and 5% with notes."""
+
+    rng = np.random.default_rng(seed)
+    days = pd.date_range("2015-01-01", periods=10 * 365, freq="D")
+
+    category = pd.Series(np.array(CATEGORIES, dtype=object)[rng.integers(0, len(CATEGORIES), num_rows)])
+    category[rng.random(num_rows) < 0.2] = None
+
+    notes = pd.Series([None] * num_rows, dtype=object)
+    has_notes = rng.random(num_rows) < 0.05
+    notes[has_notes] = [f"note {i}" for i in range(has_notes.sum())]
+
+    return pd.DataFrame({
+        "transaction_id": [hashlib.sha256(str(i).encode("utf-8")).hexdigest() for i in range(num_rows)],
+        "transaction_date": pd.Series(days[rng.integers(0, len(days), num_rows)]).sort_values(ascending=False, ignore_index=True),
+        "description": [f"MERCHANT {i} STORE #{i % 97}" for i in rng.integers(0, 5_000, num_rows)],
+        "amount": rng.integers(-50_000, 500_000, num_rows) / 100,
+        "statement_issuer": np.array(ISSUERS, dtype=object)[rng.integers(0, len(ISSUERS), num_rows)],
+        "category": category,
+        "notes": notes,
+    })
+
+def legacy_write(df):
+    out_buffer = BytesIO()
+    df.to_parquet(out_buffer, index=False, compression="snappy")
+    return out_buffer.getvalue()
+
+def legacy_read(data):
+    # string columns as Python objects, as pd.read_parquet() returned them before pandas 3
+    df = pq.read_table(BytesIO(data)).to_pandas()
+    return df.astype({col: object for col in df.columns if pd.api.types.is_string_dtype(df[col].dtype)})
+
+def values(series):
+    """Python values of a column, with None for missing values whatever the dtype."""
+    return series.astype(object).where(series.notna(), None).tolist()
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+def mib(num_bytes, num_rows):
+    """MiB per PER_ROWS rows."""
+    return num_bytes / 2**20 * PER_ROWS / num_rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    print(f"MiB per {PER_ROWS:,} rows, read times in seconds")
+    print(f"{'rows':>10} {'legacy mem':>11} {'schema mem':>11} {'ratio':>6} {'legacy disk':>12} {'schema disk':>12} {'legacy read':>12} {'schema read':>12}")
+
+    for num_rows in args.sizes:
+        df = master(num_rows)
+
+        legacy_data = legacy_write(df)
+        schema_data = schema.write(df)
+
+        legacy, legacy_s = timed(legacy_read, legacy_data)
+        conformed, schema_s = timed(schema.read, schema_data)
+
+        # the conformed master holds the same values, with amounts in cents
+        expected = legacy.assign(amount=schema.to_cents(legacy["amount"]))
+        for col in schema.MASTER_DTYPES:
+            if values(conformed[col]) != values(expected[col]):
+                raise AssertionError(f"{col} differs from the legacy master at {num_rows} rows")
+
+        legacy_mem = legacy.memory_usage(deep=True).sum()
+        schema_mem = conformed.memory_usage(deep=True).sum()
+
+        print(
+            f"{num_rows:>10} {mib(legacy_mem, num_rows):>11.1f} {mib(schema_mem, num_rows):>11.1f} {legacy_mem / schema_mem:>5.1f}x"
+            f" {mib(len(legacy_data), num_rows):>12.2f} {mib(len(schema_data), num_rows):>12.2f}"
+            f" {legacy_s:>12.3f} {schema_s:>12.3f}"
+        )
+
+    # per column, for the last size
+    print(f"\nper column at {num_rows:,} rows, MiB per {PER_ROWS:,} rows")
+    legacy_columns = legacy.memory_usage(deep=True, index=False)
+    schema_columns = conformed.memory_usage(deep=True, index=False)
+    for col in schema.MASTER_DTYPES:
+        print(f"  {col:<18} {str(legacy[col].dtype):>16} {mib(legacy_columns[col], num_rows):>7.1f}   {str(conformed[col].dtype):>16} {mib(schema_columns[col], num_rows):>7.1f}")
+
+if __name__ == "__main__":
+    main()
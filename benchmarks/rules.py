@@ -0,0 +1,138 @@
+"""
+Benchmark auto-categorization rules: RuleSet.apply() on thousands of rules and a batch of 100k rows.
+
+Rules are a synthetic rules.json in the mix users write: mostly contains rules on merchant names, then regex rules,
+a few contains rules narrowed by a regex, and some of each with amount ranges or issuer conditions.
+Every row has a distinct description, a merchant name plus a reference number, so descriptions can't be deduplicated.
+
+Compile time (once per rules.json version) and apply time are reported separately, as medians over runs.
+The categories are checked against a plain row-by-row, rule-by-rule implementation, on a sample of rows.
+
+rules.py is imported from the update_master lambda, so its dependencies, boto3 included, must be installed.
+
+Usage:
+    python benchmarks/rules.py [--rules 1000 3000] [--rows 100000] [--runs 5]
+"""
+
+import os
+import re
+import sys
+import time
+import argparse
+import statistics
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambdas", "update_master"))
+import rules
+import master_schema as schema
+
+ISSUERS = ["Chase Freedom Unlimited", "American Express Gold", "Amazon Visa"]
+SAMPLE_ROWS = 2_000
+
+def merchant_names(num_merchants, rng):
+    words = ["".join(rng.choice(list("abcdefghijklmnopqrstuvwxyz"), rng.integers(4, 10))) for _ in range(2 * num_merchants)]
+    return [f"{words[2 * i]} {words[2 * i + 1]}" for i in range(num_merchants)]
+
+def rules_body(num_rules, merchants, rng):
+    """A synthetic rules.json: 70% contains rules, 20% regex rules, 10% contains rules with a regex."""
+
+    body = []
+    for i in range(num_rules):
+        merchant = merchants[i]
+        kind = rng.random()
+
+        if kind < 0.7:
+            rule = {"category": f"Category {i % 50}", "contains": merchant}
+        elif kind < 0.9:
+            first, second = merchant.split()
+            rule = {"category": f"Category {i % 50}", "regex": rf"^(pos |sq \*)?{first}\s+{second[:3]}"}
+        else:
+            rule = {"category": f"Category {i % 50}", "contains": merchant.split()[0], "regex": r"#\d{3}\b"}
+
+        if rng.random() < 0.15:
+            rule["max_amount"] = -float(rng.integers(10, 500))
+        if rng.random() < 0.1:
+            rule["issuer"] = ISSUERS[i % len(ISSUERS)]
+
+        body.append(rule)
+
+    return body
+
+def rows(num_rows, merchants, rng):
+    """New rows with distinct descriptions; about a fifth of them from merchants no rule mentions."""
+
+    picks = rng.integers(0, len(merchants), num_rows)
+    prefixes = np.array(["", "POS ", "SQ *"], dtype=object)[rng.integers(0, 3, num_rows)]
+
+    return schema.conform(pd.DataFrame({
+        "transaction_id": [f"{i:064x}" for i in range(num_rows)],
+        "transaction_date": pd.Timestamp("2024-01-01"),
+        "description": [f"{prefix}{merchants[m].upper()} #{i}" for i, (prefix, m) in enumerate(zip(prefixes, picks))],
+        "amount": np.round(rng.normal(-50, 200, num_rows), 2),
+        "statement_issuer": np.array(ISSUERS, dtype=object)[rng.integers(0, len(ISSUERS), num_rows)],
+        "category": None,
+        "notes": None,
+    }))
+
+def reference_category(row, compiled):
+    """The first rule matching row, checked one rule at a time."""
+
+    description = row.description.lower()
+    for rule, regex in compiled:
+        if "contains" in rule and rule["contains"].lower() not in description:
+            continue
+        if regex is not None and not regex.search(description):
+            continue
+        if "min_amount" in rule and not row.amount >= rule["min_amount"] * 100:
+            continue
+        if "max_amount" in rule and not row.amount <= rule["max_amount"] * 100:
+            continue
+        if "issuer" in rule and row.statement_issuer != rule["issuer"]:
+            continue
+        return rule["category"]
+
+    return None
+
+def timed(fn, *args, runs):
+    """Median seconds of fn(*args) over runs, and its result."""
+
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn(*args)
+        times.append(time.perf_counter() - start)
+
+    return result, statistics.median(times)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rules", type=int, nargs="+", default=[1_000, 3_000])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    merchants = merchant_names(int(max(args.rules) * 1.25), rng)
+    df = rows(args.rows, merchants, rng)
+
+    print(f"{args.rows:,} rows with distinct descriptions, median of {args.runs} runs")
+    print(f"{'rules':>8} {'compile':>10} {'apply':>10} {'categorized':>12}")
+
+    for num_rules in args.rules:
+        body = rules_body(num_rules, merchants, rng)
+
+        rule_set, compile_s = timed(rules.RuleSet, body, runs=args.runs)
+        (categorized, num_categorized), apply_s = timed(rule_set.apply, df, runs=args.runs)
+
+        compiled = [(rule, re.compile(rule["regex"], re.IGNORECASE) if "regex" in rule else None) for rule in body]
+        sample = rng.choice(len(df), min(SAMPLE_ROWS, len(df)), replace=False)
+        expected = [reference_category(row, compiled) for row in df.iloc[sample].itertuples()]
+        got = categorized[rules.CATEGORY_COLUMN].astype(object).iloc[sample]
+        if [None if pd.isna(category) else category for category in got] != expected:
+            raise AssertionError(f"categories differ from the reference implementation, with {num_rules} rules")
+
+        print(f"{num_rules:>8} {compile_s * 1000:>8.0f}ms {apply_s * 1000:>8.0f}ms {num_categorized:>12,}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Benchmark the Sankey diagram's node totals: plotters.sankey_totals() against the original per-category scans.
+
+The original filtered the whole frame once per category, then walked categories.json with extract_categories()
+once per primary node and expense bucket, on every render. sankey_totals() takes one groupby, and rolls it up through
+the CategoryModel's hierarchy table, which is built once per categories.json; its build time is reported separately.
+
+Both are run on the same synthetic master and categories.json, with category columns as objects (as masters were
+before master_schema) and as categoricals, and their totals are checked to be identical.
+
+ui/config.py reads st.secrets on import, so .streamlit/secrets.toml or ~/.streamlit/secrets.toml must exist.
+
+Usage:
+    python benchmarks/sankey.py [--rows 100000] [--buckets 8] [--categories-per-bucket 6]
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "ui"))
+import config as c
+import utils.master_schema as schema
+from utils.plotters import sankey_totals
+from utils.helpers import extract_categories
+from utils.categories import CategoryModel
+
+def categories_body(num_buckets, categories_per_bucket):
+    """A synthetic categories.json, with a few income and savings categories, and the expenses under buckets."""
+
+    return {
+        c.INCOME_PARENT_CATEGORY_KEY: [f"Income {i}" for i in range(5)],
+        c.SAVINGS_PARENT_CATEGORY_KEY: [f"Savings {i}" for i in range(5)],
+        c.EXPENSES_PARENT_CATEGORY_KEY: {
+            f"Bucket {b}": [f"Expense {b}.{i}" for i in range(categories_per_bucket)]
+            for b in range(num_buckets)
+        },
+        c.NON_EXPENSES_PARENT_CATEGORY_KEY: c.NON_EXPENSES_CATEGORIES,
+    }
+
+def master(num_rows, categories, seed=0):
+    """A synthetic master, with about 10% of rows uncategorized; amounts in integer cents."""
+
+    rng = np.random.default_rng(seed)
+
+    category = pd.Series(np.array(categories, dtype=object)[rng.integers(0, len(categories), num_rows)])
+    category[rng.random(num_rows) < 0.1] = None
+
+    return pd.DataFrame({
+        c.CATEGORY_COLUMN: category,
+        c.AMOUNT_COLUMN: pd.array(rng.integers(-100_000, 100_000, num_rows), dtype="Int64"),
+    })
+
+def legacy_totals(df, body):
+    """The original node totals, as plotters.sankey() computed them before sankey_totals()."""
+
+    categories = extract_categories(body)
+    expenses_body = body.get(c.EXPENSES_PARENT_CATEGORY_KEY, {})
+
+    # net values for all categories
+    totals = {
+        category: abs(df[df[c.CATEGORY_COLUMN] == category][c.AMOUNT_COLUMN].sum())
+        for category in categories
+    }
+
+    # add primary nodes to totals
+    for primary_node in body.keys():
+        primary_node_categories = extract_categories(body.get(primary_node, []))
+        totals[primary_node] = sum(totals.get(category, 0) for category in primary_node_categories)
+
+    # add expense buckets to totals
+    for bucket in expenses_body.keys():
+        bucket_categories = extract_categories(expenses_body.get(bucket, []))
+        totals[bucket] = sum(totals.get(category, 0) for category in bucket_categories)
+
+    return totals
+
+def timed(fn, *args, runs):
+    """Median seconds of fn(*args) over runs, and its result."""
+
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn(*args)
+        times.append(time.perf_counter() - start)
+
+    return result, statistics.median(times)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--buckets", type=int, default=8)
+    parser.add_argument("--categories-per-bucket", type=int, default=6)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    body = categories_body(args.buckets, args.categories_per_bucket)
+    model, model_s = timed(CategoryModel, body, runs=args.runs)
+    df = master(args.rows, model.categories)
+
+    print(f"{len(model.categories)} categories, {len(model.buckets)} buckets, {args.rows:,} rows, median of {args.runs} runs")
+    print(f"  CategoryModel build (once per categories.json): {model_s * 1000:.1f}ms")
+    print(f"{'category column':>20} {'legacy':>10} {'totals':>10} {'speedup':>8}")
+
+    for name, frame in [("object", df), ("categorical", schema.conform(df))]:
+        legacy, legacy_s = timed(legacy_totals, frame, body, runs=args.runs)
+        totals, totals_s = timed(sankey_totals, frame, model, runs=args.runs)
+
+        if {node: int(total) for node, total in totals.items()} != {node: int(total) for node, total in legacy.items()}:
+            raise AssertionError(f"totals differ from the legacy implementation, with {name} categories")
+
+        print(f"{name:>20} {legacy_s * 1000:>8.1f}ms {totals_s * 1000:>8.1f}ms {legacy_s / totals_s:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
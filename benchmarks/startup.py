@@ -0,0 +1,93 @@
+"""
+Benchmark the Streamlit app's startup: the latency of a first run of ui/app.py, and what it's spent on.
+
+app.py is run in a fresh interpreter with -X importtime, from the repo root as `streamlit run ui/app.py` runs it,
+so .streamlit/secrets.toml or ~/.streamlit/secrets.toml must exist. Without a session, app.py renders the landing page.
+The run is split into module imports, broken down by top-level package, and the landing page render.
+boto3 is checked to not be imported at all, i.e. no AWS clients are constructed and no requests are made on startup.
+
+Usage:
+    python benchmarks/startup.py [--runs 5]
+"""
+
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+from collections import defaultdict
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+UI = os.path.join(ROOT, "ui")
+
+FIRST_PARTY = {"config", "sections", "utils"}
+
+RUN_APP = """
+import sys, time, runpy
+start = time.perf_counter()
+runpy.run_path("ui/app.py")
+print(time.perf_counter() - start, "boto3" in sys.modules)
+"""
+
+def run_app():
+    """
+    Run app.py in a fresh interpreter.
+
+    Returns:
+        (float, dict, bool): seconds to run app.py, self import time in seconds per top-level package,
+        and whether boto3 was imported.
+    """
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", RUN_APP],
+        cwd=ROOT,
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [UI, os.environ.get("PYTHONPATH")]))},
+        capture_output=True,
+        text=True,
+    )
+
+    if result.returncode != 0:
+        raise RuntimeError(f"running app.py failed:\n{result.stderr[-2000:]}")
+
+    # lines look like: "import time:       self [us] |  cumulative | imported package"
+    self_times = defaultdict(float)
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+
+        self_us, _, name = line.removeprefix("import time:").split("|")
+        self_times[name.strip().split(".")[0]] += int(self_us) / 1e6
+
+    total, boto3_imported = result.stdout.strip().splitlines()[-1].split()
+    return float(total), self_times, boto3_imported == "True"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8, help="number of packages to break import time down by")
+    args = parser.parse_args()
+
+    # the first run warms the filesystem and bytecode caches
+    run_app()
+    runs = [run_app() for _ in range(args.runs)]
+
+    totals = [total for total, _, _ in runs]
+    imports = [sum(self_times.values()) for _, self_times, _ in runs]
+    first_party = [sum(t for name, t in self_times.items() if name in FIRST_PARTY) for _, self_times, _ in runs]
+
+    print(f"app.py first run: median {statistics.median(totals):.3f}s over {args.runs} runs")
+    print(f"  imports: {statistics.median(imports):.3f}s, of which first-party modules (config, sections, utils): {statistics.median(first_party):.3f}s")
+    print(f"  landing page render: {statistics.median(total - i for total, i in zip(totals, imports)):.3f}s")
+    print(f"  boto3 imported on startup: {any(boto3_imported for _, _, boto3_imported in runs)}")
+
+    packages = defaultdict(list)
+    for _, self_times, _ in runs:
+        for name, t in self_times.items():
+            packages[name].append(t)
+
+    print(f"  top {args.top} packages by import time:")
+    for name, times in sorted(packages.items(), key=lambda item: -statistics.median(item[1]))[:args.top]:
+        print(f"    {name:<24} {statistics.median(times):.3f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark transaction_id generation: parser.generate_transaction_ids() against the original row-by-row loop.
+
+Both are run on the same synthetic statement, with valid repeated transactions, and their ids are checked to be identical.
+
+Usage:
+    python benchmarks/transaction_ids.py [--sizes 1000 100000 1000000]
+"""
+
+import os
+import sys
+import time
+import hashlib
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambdas", "parse_statement"))
+from parser import generate_transaction_ids
+
+logger = logging.getLogger()
+
+def legacy_transaction_ids(parsed_dates, descriptions):
+    """The original scheme, as parser.parse() generated it before generate_transaction_ids()."""
+
+    hashes = [
+        hashlib.sha256(str([date, desc]).encode("utf-8")).hexdigest()
+        for date, desc in zip(parsed_dates, descriptions)
+    ]
+
+    hash_counts = {}
+    transaction_ids = []
+    for h in hashes:
+        hash_counts[h] = hash_counts.get(h, 0) + 1
+
+        count = hash_counts.get(h)
+        if count == 1:
+            transaction_ids.append(h)
+        else:
+            new_hash = hashlib.sha256(f"{count} occurrence of {h}".encode("utf-8")).hexdigest()
+            transaction_ids.append(new_hash)
+
+            logger.info(f"count {count} for hash {h} detected. rehashed to {new_hash}")
+
+    return transaction_ids
+
+def statement(num_rows, seed=0):
+    """A synthetic statement, with about 5% repeated transactions and a few invalid dates."""
+
+    rng = np.random.default_rng(seed)
+    days = pd.date_range("2020-01-01", periods=5 * 365, freq="D")
+
+    dates = pd.Series(days[rng.integers(0, len(days), num_rows)])
+    dates[rng.random(num_rows) < 0.001] = pd.NaT
+
+    descriptions = pd.Series([f"MERCHANT {i} #{i % 97}" for i in rng.integers(0, num_rows, num_rows)])
+    repeats = rng.random(num_rows) < 0.05
+    descriptions[repeats] = "COFFEE SHOP"
+
+    return dates, descriptions
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'legacy':>10} {'batched':>10} {'speedup':>8}")
+    for num_rows in args.sizes:
+        dates, descriptions = statement(num_rows)
+
+        legacy, legacy_s = timed(legacy_transaction_ids, dates, descriptions)
+        batched, batched_s = timed(generate_transaction_ids, dates, descriptions)
+
+        if batched.tolist() != legacy:
+            raise AssertionError(f"transaction_ids differ from the legacy scheme at {num_rows} rows")
+
+        print(f"{num_rows:>10} {legacy_s:>9.3f}s {batched_s:>9.3f}s {legacy_s / batched_s:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Benchmark end-to-end upload latency, fused mode against the two-step state machine, see FUSED_UPLOADS in ui/config.py.
+
+Each run uploads the statement and waits until it's merged into the master, the same calls ui/sections/upload.py makes:
+    fused:    upload, then one synchronous update_master invocation that parses and merges the statement.
+    two-step: upload, then a state machine execution (parse_statement, then update_master), followed to completion.
+
+This runs against the deployed Lambdas and state machine, with credentials from the default boto3 chain.
+--user must be a dedicated benchmark user: all of its objects are deleted before every run, so every run merges the
+statement into an empty master, and again once the benchmark is done.
+Modes alternate run to run, and the first run of each mode is reported apart from the rest, as it's likely a cold start.
+
+Usage:
+    python benchmarks/upload_latency.py --user benchmark@example.com --issuer <issuer> --statement path/to/statement.csv [--runs 5]
+"""
+
+import time
+import uuid
+import json
+import argparse
+import statistics
+from datetime import datetime, timezone
+
+import boto3
+from botocore.config import Config
+
+# must match ui/config.py
+S3_BUCKET = "aws-budget-buddy"
+UPLOAD_STATE_MACHINE = "arn:aws:states:us-west-2:676206945006:stateMachine:handle_new_statement"
+UPDATE_MASTER_LAMBDA = "update_master"
+LAMBDA_CLIENT_CONFIG = {"read_timeout": 930, "retries": {"max_attempts": 0}}
+
+POLL_INTERVAL = 0.25  # seconds
+
+s3 = boto3.client("s3")
+sf = boto3.client("stepfunctions")
+aws_lambda = boto3.client("lambda", config=Config(**LAMBDA_CLIENT_CONFIG))
+
+def delete_user_objects(user):
+    """Delete every object under the user's folder."""
+
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=f"{user}/"):
+        objects = [{"Key": obj["Key"]} for obj in page.get("Contents", [])]
+        if objects:
+            s3.delete_objects(Bucket=S3_BUCKET, Delete={"Objects": objects})
+
+def upload(user, issuer, statement):
+    """Upload the statement like the UI does, and return its key."""
+
+    formatted_time = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H-%M-%S-%f")
+    key = f"{user}/statements/{issuer}/{issuer}_statement_{formatted_time}.csv"
+    s3.put_object(Bucket=S3_BUCKET, Key=key, Body=statement)
+
+    return key
+
+def process_fused(user, statement_key):
+    response = aws_lambda.invoke(
+        FunctionName=UPDATE_MASTER_LAMBDA,
+        Payload=json.dumps({"body": {"statement_key": statement_key, "fused": True}})
+    )
+    result = json.loads(response["Payload"].read())
+
+    if "FunctionError" in response or result.get("statusCode") != 200:
+        raise RuntimeError(f"fused update_master failed: {result}")
+
+def process_two_step(user, statement_key):
+    response = sf.start_execution(
+        stateMachineArn=UPLOAD_STATE_MACHINE,
+        input=json.dumps({"key": statement_key, "status_key": f"{user}/status/{uuid.uuid4()}.json"})
+    )
+
+    while True:
+        execution = sf.describe_execution(executionArn=response["executionArn"])
+        if execution["status"] != "RUNNING":
+            break
+        time.sleep(POLL_INTERVAL)
+
+    if execution["status"] != "SUCCEEDED":
+        raise RuntimeError(f"state machine execution {execution['status']}: {execution.get('cause', '')}")
+
+MODES = {
+    "fused": process_fused,
+    "two-step": process_two_step,
+}
+
+def run(mode, user, issuer, statement):
+    """Run one upload in the given mode, from an empty master, and return its latency in seconds."""
+
+    delete_user_objects(user)
+
+    start = time.perf_counter()
+    MODES[mode](user, upload(user, issuer, statement))
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user", required=True, help="dedicated benchmark user, all of its objects are deleted")
+    parser.add_argument("--issuer", required=True)
+    parser.add_argument("--statement", required=True, help="path to a CSV statement from the issuer")
+    parser.add_argument("--runs", type=int, default=5, help="runs per mode, after the first")
+    args = parser.parse_args()
+
+    with open(args.statement, "rb") as f:
+        statement = f.read()
+
+    latencies = {mode: [] for mode in MODES}
+    try:
+        for _ in range(args.runs + 1):
+            for mode in MODES:
+                latencies[mode].append(run(mode, args.user, args.issuer, statement))
+    finally:
+        delete_user_objects(args.user)
+
+    print(f"{len(statement) / 1024:.0f} KiB statement, {args.runs} runs per mode")
+    for mode, times in latencies.items():
+        first, rest = times[0], times[1:]
+        print(f"  {mode:<9} first {first:.2f}s, then median {statistics.median(rest):.2f}s (min {min(rest):.2f}s, max {max(rest):.2f}s)")
+
+    speedup = statistics.median(latencies["two-step"][1:]) / statistics.median(latencies["fused"][1:])
+    print(f"  two-step takes {speedup:.2f}x as long as fused")
+
+if __name__ == "__main__":
+    main()
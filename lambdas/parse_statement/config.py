@@ -7,39 +7,48 @@ Required keys for each issuer include:
     - EXPENSES_SIGN: a multiplier to apply to amounts to convert expenses to negative values (if needed).
 
 
-NOTE: This file is deprecated as of 2025-07-11 as issuers management has moved to src/issuers.json in S3
+NOTE: issuers management has moved to src/issuers.json in S3 as of 2025-07-11.
+ISSUERS is kept as a bundled fallback for when S3 is unavailable, see issuers.get_issuers().
+Keep it in sync with issuers.json at the root of the repo.
 """
 
 ISSUERS = {
-    "amazon": {
+    "Amazon Visa": {
         "DATE_COLUMN": "Transaction Date",
         "DESCRIPTION_COLUMN": "Description",
         "AMOUNT_COLUMN": "Amount",
         "EXPENSES_SIGN": 1
     },
 
-    "amex": {
+    "American Express Gold": {
         "DATE_COLUMN": "Date",
         "DESCRIPTION_COLUMN": "Description",
         "AMOUNT_COLUMN": "Amount",
         "EXPENSES_SIGN": -1  # Amex statements have expenses as positive amounts
     },
 
-    "chase": {
+    "American Express Platinum": {
+        "DATE_COLUMN": "Date",
+        "DESCRIPTION_COLUMN": "Description",
+        "AMOUNT_COLUMN": "Amount",
+        "EXPENSES_SIGN": -1  # Amex statements have expenses as positive amounts
+    },
+
+    "Chase Freedom Unlimited": {
         "DATE_COLUMN": "Transaction Date",
         "DESCRIPTION_COLUMN": "Description",
         "AMOUNT_COLUMN": "Amount",
         "EXPENSES_SIGN": 1
     },
 
-    "chase_debit": {
+    "Chase Debit": {
         "DATE_COLUMN": "Posting Date",
         "DESCRIPTION_COLUMN": "Description",
         "AMOUNT_COLUMN": "Amount",
         "EXPENSES_SIGN": 1
     },
 
-    "rbc": {
+    "RBC Bank Visa Signature": {
         "DATE_COLUMN": "Transaction Date",
         "DESCRIPTION_COLUMN": "Description",
         "AMOUNT_COLUMN": "Amount",
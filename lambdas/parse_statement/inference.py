@@ -0,0 +1,305 @@
+"""
+Issuer configs for statements from issuers that aren't in the issuers registry.
+
+Statements in a registered issuer's format are routed to that issuer's config by their header, see issuer_index.py.
+Configs for other statements are inferred: only the first SNIFF_BYTES of a statement are read, with a ranged GET.
+Its columns are probed as date, description and amount candidates, and EXPENSES_SIGN is inferred from the signs of its amounts.
+
+Inferred columns are cached per user by header fingerprint, in <user>/inferred_issuers.json, so a statement with a header
+the user uploaded before is matched with a dict lookup, without probing its rows:
+    {"<fingerprint>": {"COLUMNS": [...], "DATE_COLUMN": ..., "DESCRIPTION_COLUMN": ..., "AMOUNT_COLUMN": ...}}
+EXPENSES_SIGN isn't cached, it's inferred from each statement's own amounts.
+The file is only ever added to, with conditional writes, so entries can be overridden by editing them:
+fix an entry's columns, or pin its sign by adding "EXPENSES_SIGN"; delete an entry to have it inferred again.
+
+Shared by the parse_statement lambda and update_master's fused mode, see update_master/lambda_function.py.
+"""
+
+import json
+import boto3
+import logging
+import warnings
+import pandas as pd
+
+from io import BytesIO
+from botocore.exceptions import ClientError
+from issuer_index import CONFIG_COLUMNS, IssuerIndex, header_fingerprint
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+s3 = boto3.client('s3')
+
+BUCKET = 'aws-budget-buddy'
+INFERRED_ISSUERS_FILE = 'inferred_issuers.json'
+
+# S3 error codes of a conditional write whose precondition failed, or that raced another conditional write
+WRITE_CONFLICT_CODES = ('PreconditionFailed', 'ConditionalRequestConflict', '412', '409')
+
+# a new entry is written at most this many times, reloading the file after each conflict
+SAVE_ATTEMPTS = 3
+
+# enough for a header and a hundred or so rows of a typical statement
+SNIFF_BYTES = 16 * 1024
+
+# a column is only picked if at least this fraction of sampled rows look like its kind
+MIN_FRACTIONS = {"date": 0.9, "amount": 0.9, "description": 0.5}
+
+# columns whose header mentions their kind get a bonus, e.g. to prefer Amount over Balance
+HEADER_HINTS = {
+    "date": ("date",),
+    "description": ("description", "desc", "merchant", "payee", "narrative", "details"),
+    "amount": ("amount",),
+}
+HEADER_HINT_BONUS = 0.25
+
+# user -> (header fingerprint -> inferred config, ETag), revalidated with a conditional GET on every use
+inferred_cache = {}
+
+# the issuer index is rebuilt whenever get_issuers() returns a new registry
+index_cache = {"issuers": None, "index": None}
+
+def read_sample(key):
+    """
+    Read the first SNIFF_BYTES of a statement, with a ranged GET.
+
+    Returns:
+        pd.DataFrame: the header and the complete rows in the sample, all as strings.
+    """
+
+    obj = s3.get_object(Bucket=BUCKET, Key=key, Range=f"bytes=0-{SNIFF_BYTES - 1}")
+    head = obj['Body'].read()
+
+    # drop the last row if the range cut it short
+    if len(head) >= SNIFF_BYTES and b"\n" in head:
+        head = head[:head.rfind(b"\n") + 1]
+
+    return pd.read_csv(BytesIO(head), dtype=str)
+
+def probe_columns(sample):
+    """
+    Probe every column of a sample as a date, description and amount candidate.
+    Values are parsed as parser.parse() would parse them, so a picked column is known to parse.
+
+    Returns:
+        (pd.DataFrame, pd.DataFrame): fractions of sampled rows that look like each kind, and the scores
+        columns are ranked by; both indexed by column, with date, description and amount columns.
+    """
+
+    values = sample.apply(lambda col: col.str.strip())
+    num_rows = max(len(values), 1)
+
+    is_number = values.apply(lambda col: pd.to_numeric(col, errors="coerce")).notna()
+    with warnings.catch_warnings():
+        # pandas warns when it can't infer a date format, which is expected for most columns
+        warnings.simplefilter("ignore", UserWarning)
+        is_date = values.apply(lambda col: pd.to_datetime(col, errors="coerce")).notna() & ~is_number
+    is_text = values.notna() & values.ne("") & ~is_number & ~is_date
+
+    # amounts are mostly cents, unlike e.g. reference numbers
+    has_cents = values.apply(lambda col: col.str.contains(r"\.\d{2}$", regex=True, na=False))
+
+    fractions = pd.DataFrame({
+        "date": is_date.sum() / num_rows,
+        "description": is_text.sum() / num_rows,
+        "amount": is_number.sum() / num_rows,
+    })
+
+    # descriptions vary row to row, unlike e.g. category or transaction type columns
+    uniqueness = values.nunique() / num_rows
+    scores = fractions.assign(
+        description=fractions["description"] * uniqueness,
+        amount=fractions["amount"] * (0.5 + 0.5 * has_cents.sum() / num_rows),
+    )
+
+    headers = pd.Series(values.columns, index=values.columns).astype(str).str.lower()
+    for kind, hints in HEADER_HINTS.items():
+        scores[kind] += HEADER_HINT_BONUS * headers.str.contains("|".join(hints), regex=True)
+
+    return fractions, scores
+
+def infer_expenses_sign(amounts):
+    """
+    EXPENSES_SIGN for a statement, from the signs of its amounts.
+    Expenses outnumber payments and refunds in a statement, so if most amounts are positive, expenses are positive.
+    """
+    return -1 if (amounts > 0).sum() > (amounts < 0).sum() else 1
+
+def infer_from_sample(sample):
+    """
+    Infer an issuer config from a sample of a statement.
+
+    Returns:
+        dict: with DATE_COLUMN, DESCRIPTION_COLUMN, AMOUNT_COLUMN and EXPENSES_SIGN keys, like the issuers registry;
+        None if no column qualifies for one of them.
+    """
+
+    if sample.empty:
+        return None
+
+    fractions, scores = probe_columns(sample)
+
+    # date and amount columns are the most distinctive, so they're picked first; ties go to the leftmost column
+    picked = {}
+    for kind in ("date", "amount", "description"):
+        candidates = scores.loc[~scores.index.isin(picked.values()), kind]
+        if candidates.empty:
+            return None
+
+        column = candidates.idxmax()
+        if fractions.loc[column, kind] < MIN_FRACTIONS[kind]:
+            logger.info(f"No {kind} column found, best candidate {column} scored {fractions.loc[column, kind]:.2f}")
+            return None
+
+        picked[kind] = column
+
+    return {
+        "DATE_COLUMN": picked["date"],
+        "DESCRIPTION_COLUMN": picked["description"],
+        "AMOUNT_COLUMN": picked["amount"],
+        "EXPENSES_SIGN": infer_expenses_sign(pd.to_numeric(sample[picked["amount"]], errors="coerce")),
+    }
+
+def inferred_issuers_key(user):
+    return f"{user}/{INFERRED_ISSUERS_FILE}"
+
+def load_inferred_configs(user):
+    """
+    Returns the user's inferred configs, and the ETag they were read at; None if the file doesn't exist yet.
+    Configs are cached per container, and revalidated by ETag, so edited entries are picked up on the next statement.
+    """
+
+    cached = inferred_cache.get(user)
+
+    try:
+        kwargs = {"IfNoneMatch": cached[1]} if cached and cached[1] else {}
+        obj = s3.get_object(Bucket=BUCKET, Key=inferred_issuers_key(user), **kwargs)
+    except ClientError as e:
+        code = e.response['Error']['Code']
+        if code in ('304', 'NotModified'):
+            return cached
+        if code == 'NoSuchKey':
+            inferred_cache[user] = ({}, None)
+            return inferred_cache[user]
+
+        logger.warning(f"Failed to load inferred issuer configs, using {'cached' if cached else 'none'}: {e}")
+        return cached or ({}, None)
+
+    inferred_cache[user] = (json.loads(obj['Body'].read().decode('utf-8')), obj['ETag'])
+    return inferred_cache[user]
+
+def save_inferred_config(user, fingerprint, issuer_config):
+    """
+    Add an inferred config to the user's inferred configs.
+
+    The file is written with a conditional write on the ETag it was read at, so entries added or edited in the meantime
+    are never overwritten; on a conflict, it's reloaded and the config added again, unless its fingerprint is in there by now.
+    A failure to save is logged, the config is inferred again for the next statement with this header.
+    """
+
+    for _ in range(SAVE_ATTEMPTS):
+        configs, etag = load_inferred_configs(user)
+        if fingerprint in configs:
+            return
+
+        configs = {**configs, fingerprint: issuer_config}
+        conditions = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+
+        try:
+            response = s3.put_object(
+                Bucket=BUCKET,
+                Key=inferred_issuers_key(user),
+                Body=json.dumps(configs, indent=4).encode('utf-8'),
+                ContentType='application/json',
+                **conditions
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] in WRITE_CONFLICT_CODES:
+                logger.info(f"Inferred issuer configs changed since they were read, retrying: {e}")
+                continue
+
+            logger.warning(f"Failed to save inferred issuer config: {e}")
+            return
+
+        inferred_cache[user] = (configs, response['ETag'])
+        return
+
+    logger.warning(f"Failed to save inferred issuer config after {SAVE_ATTEMPTS} attempts")
+
+def get_issuer_index(issuers):
+    if index_cache["issuers"] is not issuers:
+        index_cache["issuers"], index_cache["index"] = issuers, IssuerIndex(issuers)
+
+    return index_cache["index"]
+
+def infer_issuer_config(sample, user):
+    """
+    Issuer config for a statement sample, with the user's cached columns when its header was seen before, otherwise inferred.
+    EXPENSES_SIGN is inferred from the sample's amounts, unless the cached entry pins it.
+
+    Returns:
+        dict: an issuer config, see infer_from_sample(); None if it can't be inferred.
+    """
+
+    fingerprint = header_fingerprint(sample.columns)
+    configs, _ = load_inferred_configs(user)
+    issuer_config = configs.get(fingerprint)
+
+    if issuer_config:
+        logger.info(f"Matched header fingerprint {fingerprint} to inferred config {issuer_config}")
+
+        # the fingerprint ignores case and whitespace, parse() doesn't
+        missing = [key for key in CONFIG_COLUMNS if issuer_config.get(key) not in sample.columns]
+        if missing:
+            logger.warning(f"Inferred config for header fingerprint {fingerprint} has {missing} not in {list(sample.columns)}")
+            return None
+
+        if "EXPENSES_SIGN" not in issuer_config:
+            amounts = pd.to_numeric(sample[issuer_config["AMOUNT_COLUMN"]], errors="coerce")
+            issuer_config = {**issuer_config, "EXPENSES_SIGN": infer_expenses_sign(amounts)}
+
+        return issuer_config
+
+    issuer_config = infer_from_sample(sample)
+    if issuer_config:
+        logger.info(f"Inferred config {issuer_config} for header fingerprint {fingerprint}")
+
+        # the header is kept for whoever edits the entry, the sign is inferred per statement
+        entry = {"COLUMNS": list(sample.columns), **{k: v for k, v in issuer_config.items() if k != "EXPENSES_SIGN"}}
+        save_inferred_config(user, fingerprint, entry)
+
+    return issuer_config
+
+def resolve_issuer_config(key, issuers):
+    """
+    Issuer config for a statement from an issuer that isn't in the registry.
+
+    Statements with a registered issuer's columns are parsed with its config. When several issuers match,
+    and their EXPENSES_SIGNs differ, the one matching the sample's amounts is used. Other statements get an inferred config.
+
+    Args:
+        key (str): raw statement key, <user>/statements/<issuer>/file.csv.
+        issuers (dict): the issuers registry, see get_issuers().
+
+    Returns:
+        dict: an issuer config; None if the statement can't be routed and its config can't be inferred.
+    """
+
+    try:
+        sample = read_sample(key)
+    except (pd.errors.EmptyDataError, pd.errors.ParserError, UnicodeDecodeError) as e:
+        logger.info(f"Unable to read a sample of {key}: {e}")
+        return None
+
+    candidates = get_issuer_index(issuers).candidates(sample.columns)
+    if not candidates:
+        return infer_issuer_config(sample, user=key.split("/")[0])
+
+    if len({issuers[issuer]["EXPENSES_SIGN"] for issuer in candidates}) > 1:
+        # candidates read the same columns, so any of them locates the amounts
+        amounts = pd.to_numeric(sample[issuers[candidates[0]]["AMOUNT_COLUMN"]], errors="coerce")
+        sign = infer_expenses_sign(amounts)
+        candidates = [issuer for issuer in candidates if issuers[issuer]["EXPENSES_SIGN"] == sign] or candidates
+
+    logger.info(f"Routed {key} to {candidates[0]} by its header, out of candidates {candidates}")
+    return issuers[candidates[0]]
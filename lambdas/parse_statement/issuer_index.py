@@ -0,0 +1,81 @@
+"""
+Routing of statements to issuers, by their header.
+
+Issuers are indexed by a fingerprint of the columns their config reads (DATE_COLUMN, DESCRIPTION_COLUMN, AMOUNT_COLUMN);
+issuers that read the same columns share an entry, e.g. American Express Gold and Platinum.
+A statement matches an entry if its header has all of the entry's columns, so only its header line is ever needed.
+Columns are matched by their exact names, as parser.parse() reads them; a header that differs in case or whitespace doesn't match.
+Matches are memoized by a fingerprint of the whole header, so routing a header seen before is a dict lookup.
+
+Shared by the lambdas and the UI, update_master/issuer_index.py and ui/utils/issuer_index.py are symlinks to this module.
+"""
+
+import csv
+import hashlib
+
+CONFIG_COLUMNS = ("DATE_COLUMN", "DESCRIPTION_COLUMN", "AMOUNT_COLUMN")
+
+def normalize(column):
+    return str(column).strip().lower()
+
+def fingerprint(columns):
+    return hashlib.sha256("\x1f".join(columns).encode("utf-8")).hexdigest()
+
+def header_fingerprint(header):
+    """Fingerprint of a statement's header, i.e. its column names in order, case and surrounding whitespace aside."""
+    return fingerprint([normalize(col) for col in header])
+
+def columns_fingerprint(columns):
+    """Fingerprint of a set of exact column names, in any order."""
+    return fingerprint(sorted({str(col) for col in columns}))
+
+def parse_header(line):
+    """Column names in a CSV header line, as bytes or str."""
+
+    if isinstance(line, bytes):
+        line = line.decode("utf-8-sig", errors="replace")
+
+    return next(csv.reader([line]), [])
+
+class IssuerIndex:
+    """
+    Issuers in a registry, indexed by the columns they read.
+
+    - entries: columns fingerprint -> (columns, issuers), in registry order.
+    - matches: exact header -> candidate issuers, memoized by candidates().
+    """
+
+    def __init__(self, issuers):
+        self.entries = {}
+        for issuer, issuer_config in issuers.items():
+            columns = frozenset(issuer_config[key] for key in CONFIG_COLUMNS)
+            self.entries.setdefault(columns_fingerprint(columns), (columns, []))[1].append(issuer)
+
+        self.matches = {}
+
+    def candidates(self, header, preferred=()):
+        """
+        Issuers a statement can be parsed as, i.e. whose columns are all in its header.
+
+        Args:
+            header (list): the statement's column names.
+            preferred (iterable, optional): issuers to list first when there are several candidates,
+                e.g. the ones a user already has statements from.
+
+        Returns:
+            list: candidate issuers, in registry order after preferred ones; empty if none match.
+        """
+
+        key = tuple(str(col) for col in header)
+        if key not in self.matches:
+            columns = set(key)
+            self.matches[key] = [
+                issuer for entry_columns, issuers in self.entries.values() if entry_columns <= columns for issuer in issuers
+            ]
+
+        candidates = self.matches[key]
+        preferred = set(preferred)
+        if len(candidates) > 1 and preferred:
+            candidates = sorted(candidates, key=lambda issuer: issuer not in preferred)
+
+        return candidates
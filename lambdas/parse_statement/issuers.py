@@ -0,0 +1,66 @@
+"""
+The issuers registry, src/issuers.json in S3, with config.ISSUERS as a bundled fallback.
+
+Shared by the parse_statement lambda and update_master's fused mode, see update_master/lambda_function.py.
+"""
+
+import json
+import time
+import boto3
+import config
+import logging
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+s3 = boto3.client('s3')
+
+BUCKET = 'aws-budget-buddy'
+ISSUERS_KEY = 'src/issuers.json'
+
+# issuers are cached at module level, so they live across warm invocations
+# after ISSUERS_TTL_SECONDS, the cache is revalidated with a conditional GET on its ETag
+ISSUERS_TTL_SECONDS = 300
+issuers_cache = {"issuers": None, "etag": None, "validated_at": 0}
+
+def fallback_issuers(error):
+    """Issuers to use when the registry can't be (re)loaded from S3."""
+
+    if issuers_cache["issuers"] is not None:
+        logger.warning(f"Failed to revalidate issuer configuration, using cached issuers: {error}")
+        return issuers_cache["issuers"]
+
+    logger.warning(f"Failed to load issuer configuration, using bundled issuers: {error}")
+    return config.ISSUERS
+
+def get_issuers():
+    """
+    Returns the issuers registry, from the warm cache when possible.
+
+    Falls back to the last cached registry, or to the bundled config.ISSUERS, when S3 is unavailable.
+    """
+
+    if issuers_cache["issuers"] is not None and time.time() - issuers_cache["validated_at"] < ISSUERS_TTL_SECONDS:
+        return issuers_cache["issuers"]
+
+    try:
+        kwargs = {"IfNoneMatch": issuers_cache["etag"]} if issuers_cache["etag"] else {}
+        config_obj = s3.get_object(Bucket=BUCKET, Key=ISSUERS_KEY, **kwargs)
+
+        issuers_cache["issuers"] = json.loads(config_obj['Body'].read().decode('utf-8'))
+        issuers_cache["etag"] = config_obj["ETag"]
+        logger.info(f"Loaded {len(issuers_cache['issuers'])} issuers from configuration.")
+
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('304', 'NotModified'):
+            return fallback_issuers(e)
+
+        logger.info("Issuer configuration not modified, using cached issuers.")
+
+    except Exception as e:
+        return fallback_issuers(e)
+
+    issuers_cache["validated_at"] = time.time()
+    return issuers_cache["issuers"]
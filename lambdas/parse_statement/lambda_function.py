@@ -3,13 +3,20 @@ Parse and clean financial statement CSV files uploaded to S3.
 This Lambda function is triggered by S3 events when new files are uploaded to the 'statements' folder.
 """
 
+import os
 import json
+import uuid
 import boto3
 import logging
 import traceback
 import pandas as pd
+import pyarrow.parquet as pq
 
-from parser import parse
+from io import BytesIO
+from parser import parse, to_table, infer_date_format, CLEANED_SCHEMA
+from issuers import get_issuers
+from upload_status import write_status, SUCCESS_STATUS, FAILURE_STATUS
+from inference import resolve_issuer_config
 from urllib.parse import unquote_plus
 
 logger = logging.getLogger()
@@ -18,29 +25,190 @@ logger.setLevel(logging.INFO)
 s3 = boto3.client('s3')
 
 BUCKET = 'aws-budget-buddy'
-ISSUERS_KEY = 'src/issuers.json'
+
+# the UI waits on a per-upload status object, see upload_status.py
+STEP_NAME = "parse_statement"
+
+# statements larger than this are parsed in chunks and uploaded incrementally
+# so peak memory stays flat regardless of statement size
+STREAMING_THRESHOLD_BYTES = 20 * 1024 * 1024
+CHUNK_ROWS = 50_000
+
+# S3 requires every part of a multipart upload, except the last, to be at least 5 MiB
+MIN_PART_BYTES = 5 * 1024 * 1024
+
+# set CSV_DEBUG_EXPORT to also export each cleaned statement as CSV, under <user>/DEBUG_FOLDER
+# amounts in the export are integer cents, as in the Parquet output
+# these are for debugging only, update_master never reads them
+CSV_DEBUG_EXPORT = os.environ.get("CSV_DEBUG_EXPORT", "").lower() in ("1", "true", "yes")
+DEBUG_FOLDER = "debug/cleaned"
+
+class MultipartUploadWriter:
+    """
+    Write-only file-like object that streams bytes to S3 via a multipart upload.
+
+    Bytes are buffered until MIN_PART_BYTES is reached, then uploaded as a part,
+    so at most one part is held in memory at a time.
+
+    It's also a valid sink for pq.ParquetWriter, which needs tell() and closed;
+    the writer never closes it, so complete() must still be called once the Parquet footer is written.
+    """
+
+    closed = False
+
+    def __init__(self, key):
+        self.key = key
+        self.upload_id = s3.create_multipart_upload(Bucket=BUCKET, Key=key)["UploadId"]
+        self.parts = []
+        self.buffer = BytesIO()
+        self.position = 0
+
+    def write(self, data):
+        self.buffer.write(data)
+        self.position += len(data)
+        if self.buffer.tell() >= MIN_PART_BYTES:
+            self.upload_part()
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def upload_part(self):
+        part_number = len(self.parts) + 1
+        response = s3.upload_part(
+            Bucket=BUCKET,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=self.buffer.getvalue()
+        )
+
+        self.parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+        self.buffer = BytesIO()
+
+    def complete(self):
+        if self.buffer.tell() or not self.parts:
+            self.upload_part()
+
+        s3.complete_multipart_upload(
+            Bucket=BUCKET,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={"Parts": self.parts}
+        )
+
+    def abort(self):
+        s3.abort_multipart_upload(Bucket=BUCKET, Key=self.key, UploadId=self.upload_id)
+
+def cleaned_key(user, issuer, min_date, max_date, folder="cleaned", extension="parquet"):
+    # output key is set based on issuer and date range
+    min_date = min_date.date().strftime("%Y-%m-%d")
+    max_date = max_date.date().strftime("%Y-%m-%d")
+    return f"{user}/{folder}/{issuer.lower()} activity from {min_date} to {max_date}.{extension}"
+
+def move_object(source_key, key):
+    s3.copy_object(
+        Bucket=BUCKET,
+        CopySource={'Bucket': BUCKET, 'Key': source_key},
+        Key=key
+    )
+    s3.delete_object(Bucket=BUCKET, Key=source_key)
+
+def parse_streaming(body, issuer_config, user, issuer):
+    """
+    Parse a large statement in CHUNK_ROWS sized chunks and upload the cleaned output incrementally.
+    Each chunk is written as one Parquet row group.
+
+    The cleaned key depends on the statement's date range, which is only known once every chunk is parsed,
+    so output is streamed to a staging key first and then moved to its final key with a server-side copy.
+
+    Args:
+        body (botocore.response.StreamingBody): raw statement CSV stream.
+        issuer_config (dict): issuer config for this statement, see issuers.json.
+        user (str): user root folder.
+        issuer (str): statement issuer.
+
+    Returns:
+        str: key of the cleaned output, or None if the statement had no rows.
+    """
+
+    # staged outside the cleaned folder, so partial output is never mistaken for a cleaned statement
+    writer = MultipartUploadWriter(f"{user}/staging/{uuid.uuid4()}.parquet")
+    debug_writer = MultipartUploadWriter(f"{user}/staging/{uuid.uuid4()}.csv") if CSV_DEBUG_EXPORT else None
+    writers = [w for w in (writer, debug_writer) if w is not None]
+
+    # running count per transaction hash, so repeats spanning chunk boundaries still get unique ids
+    occurrences = {}
+    num_rows = 0
+    min_dates, max_dates = [], []
+
+    # the date format is inferred once, from the first chunk with dates, as a single parse() would infer it
+    # otherwise a first chunk with only day <= 12 dates could be parsed month first, and later chunks day first
+    date_format, date_format_inferred = None, False
+
+    try:
+        parquet_writer = pq.ParquetWriter(writer, CLEANED_SCHEMA, compression='snappy')
+
+        for raw in pd.read_csv(body, chunksize=CHUNK_ROWS):
+            dates = raw[issuer_config["DATE_COLUMN"]]
+            if not date_format_inferred and dates.notna().any():
+                date_format, date_format_inferred = infer_date_format(dates), True
+                logger.info(f"Parsing dates with inferred format {date_format}")
+
+            clean = parse(raw, issuer_config, occurrences, date_format)
+            clean["statement_issuer"] = issuer
+
+            parquet_writer.write_table(to_table(clean))
+            if debug_writer:
+                debug_writer.write(clean.to_csv(index=False, header=num_rows == 0).encode('utf-8'))
+
+            num_rows += len(clean)
+            min_dates.append(clean["transaction_date"].min())
+            max_dates.append(clean["transaction_date"].max())
+
+            logger.info(f"Parsed {num_rows} rows so far")
+
+        # writes the Parquet footer
+        parquet_writer.close()
+
+    except Exception:
+        for w in writers:
+            w.abort()
+        raise
+
+    min_date = pd.Series(min_dates, dtype="datetime64[ns]").min()
+    max_date = pd.Series(max_dates, dtype="datetime64[ns]").max()
+    if num_rows == 0 or pd.isna(min_date):
+        for w in writers:
+            w.abort()
+        return None
+
+    for w in writers:
+        w.complete()
+
+    output_key = cleaned_key(user, issuer, min_date, max_date)
+    logger.info(f"Moving cleaned file to: {output_key}")
+    move_object(writer.key, output_key)
+
+    if debug_writer:
+        move_object(debug_writer.key, cleaned_key(user, issuer, min_date, max_date, folder=DEBUG_FOLDER, extension="csv"))
+
+    return output_key
 
 def lambda_handler(event, context):
     logger.info(f"Lambda triggered with event: ")
     logger.info(json.dumps(event))
 
     key = unquote_plus(event.get('key'))
-    logger.info(f"Processing file from bucket: {BUCKET}, key: {key}")
+    status_key = event.get('status_key')
 
-    # read ISSUERS from s3 
-    try:
-        config_obj = s3.get_object(Bucket=BUCKET, Key=ISSUERS_KEY)
-        config_data = config_obj['Body'].read().decode('utf-8')
-        ISSUERS = json.loads(config_data)
+    # multi-file uploads defer the master update to a single batched update_master invocation
+    defer_merge = event.get('defer_merge', False)
+    logger.info(f"Processing file from bucket: {BUCKET}, key: {key}")
 
-        logger.info(f"Loaded issuers from configuration.")
-        logger.info(json.dumps(ISSUERS, indent=4))
-    except Exception as e:
-        logger.error(f"Failed to load issuer configuration: {e}")
-        return {
-            "statusCode": 500,
-            "body": json.dumps({"error": "Failed to load issuer configuration"})
-        }
+    ISSUERS = get_issuers()
 
     try:
         # extract details from key path
@@ -49,60 +217,83 @@ def lambda_handler(event, context):
         user = parts[0]
         issuer = parts[2]
 
-        if not ISSUERS.get(issuer):
+        # new issuers' configs are inferred from the statement's header and first rows, see inference.py
+        issuer_config = ISSUERS.get(issuer) or resolve_issuer_config(key, ISSUERS)
+        if not issuer_config:
+            error = f"issuer {issuer} in key: {key} is unsupported/unrecognized, and its columns couldn't be detected"
+            write_status(status_key, STEP_NAME, FAILURE_STATUS, error=error)
+
             return {
                 "statusCode": 422,
                 "body": json.dumps({
-                    "error": f"issuer {issuer} in key: {key} is unsupported/unrecognized"
+                    "error": error,
+                    "status_key": status_key
                 })
             }
 
         obj = s3.get_object(Bucket=BUCKET, Key=key)
-        raw = pd.read_csv(obj['Body'])
-
-        logger.info(f"Read {len(raw)} rows from raw CSV")
-
-        clean = parse(raw, ISSUERS[issuer])
-        clean["statement_issuer"] = issuer
 
         output_key = None
-        if not clean.empty:
-            # set output key based on issuer and date range
-            min_date = clean["transaction_date"].dropna().min().date().strftime("%Y-%m-%d")
-            max_date = clean["transaction_date"].dropna().max().date().strftime("%Y-%m-%d")
-            output_key = f"{user}/cleaned/{issuer.lower()} activity from {min_date} to {max_date}.csv"
-            logger.info(f"Uploading cleaned file to: {output_key}")
-            
-            s3.put_object(
-                Bucket=BUCKET,
-                Key=output_key,
-                Body=clean.to_csv(index=False).encode('utf-8')
-            )
+        if obj['ContentLength'] > STREAMING_THRESHOLD_BYTES:
+            logger.info(f"Statement is {obj['ContentLength']} bytes, parsing in chunks of {CHUNK_ROWS} rows")
+            output_key = parse_streaming(obj['Body'], issuer_config, user, issuer)
 
         else:
+            raw = pd.read_csv(obj['Body'])
+            logger.info(f"Read {len(raw)} rows from raw CSV")
+
+            clean = parse(raw, issuer_config)
+            clean["statement_issuer"] = issuer
+
+            if not clean.empty:
+                min_date, max_date = clean["transaction_date"].dropna().min(), clean["transaction_date"].dropna().max()
+                output_key = cleaned_key(user, issuer, min_date, max_date)
+                logger.info(f"Uploading cleaned file to: {output_key}")
+
+                out_buffer = BytesIO()
+                pq.write_table(to_table(clean), out_buffer, compression='snappy')
+                s3.put_object(
+                    Bucket=BUCKET,
+                    Key=output_key,
+                    Body=out_buffer.getvalue()
+                )
+
+                if CSV_DEBUG_EXPORT:
+                    s3.put_object(
+                        Bucket=BUCKET,
+                        Key=cleaned_key(user, issuer, min_date, max_date, folder=DEBUG_FOLDER, extension="csv"),
+                        Body=clean.to_csv(index=False).encode('utf-8')
+                    )
+
+        if output_key is None:
             logger.warning(f"file {key} for issuer {issuer} is empty after parsing. No output generated.")
         
-        # check_lambda_completed() looks for this log to confirm execution success
-        logger.info("SUCCESS")
+        # check_lambda_completed() reads the status object to confirm execution success
+        logger.info(SUCCESS_STATUS)
+        write_status(status_key, STEP_NAME, SUCCESS_STATUS)
 
         return {
             "statusCode": 200,
             "body": json.dumps({
-                "parsed_statement_key": output_key
+                "parsed_statement_key": output_key,
+                "status_key": status_key,
+                "defer_merge": defer_merge
             })
         }
 
         
     except Exception as e:
-        # check_lambda_completed() looks for this log to confirm execution failure
-        logger.error("FAILURE")
+        # check_lambda_completed() reads the status object to confirm execution failure
+        logger.error(FAILURE_STATUS)
         logger.exception(f"Unable to process file {key}: {e}")
+        write_status(status_key, STEP_NAME, FAILURE_STATUS, error=str(e))
         
         tb = traceback.format_exc()
         return {
             "statusCode": 400,
             "body": json.dumps({
                 "error": str(e),
-                "traceback": tb
+                "traceback": tb,
+                "status_key": status_key
             })
         }
\ No newline at end of file
@@ -1,18 +1,119 @@
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 import hashlib
 import re
-import logging 
+import logging
+
+from pandas.tseries.api import guess_datetime_format
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-def parse(df, issuer_config):
+# cleaned statements are handed to update_master as Parquet, with this fixed schema
+# so both lambdas agree on dtypes, without a text round trip; fused mode conforms to it too, see to_table()
+CLEANED_SCHEMA = pa.schema([
+    ("transaction_id", pa.string()),
+    ("transaction_date", pa.timestamp("ns")),
+    ("description", pa.string()),
+    ("amount", pa.int64()),
+    ("statement_issuer", pa.string()),
+])
+
+def sha256_hex(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def generate_transaction_ids(dates, descriptions, occurrences=None):
+    """
+    Generate transaction_ids for a batch of transactions, column-wise.
+
+    transaction_ids are SHA-256 hashes over the canonical key str([date, desc]).
+    Valid repeated transactions (same date and description) produce the same base hash,
+    so every repeat after the first is rehashed as f"{count} occurrence of {base_hash}".
+    This reproduces the original row-by-row scheme byte for byte, so existing masters still dedupe.
+
+    Args:
+        dates (pd.Series): parsed transaction dates (NaT allowed).
+        descriptions (pd.Series): cleaned descriptions, aligned with dates.
+        occurrences (dict, optional): base hash -> number of times it was already seen.
+            Used when a statement is parsed in chunks, so repeats spanning chunk boundaries get the same ids
+            as they would if the statement was parsed in one pass. Updated in place.
+
+    Returns:
+        pd.Series: transaction_ids, aligned with the inputs.
+    """
+
+    # the canonical key embeds repr() of each value, i.e. str([Timestamp('2025-01-01 00:00:00'), 'desc'])
+    # keys are built and hashed once per distinct (date, description) pair, then broadcast back to rows
+    date_codes, unique_dates = pd.factorize(dates, use_na_sentinel=False)
+    desc_codes, unique_descs = pd.factorize(descriptions, use_na_sentinel=False)
+    num_descs = max(len(unique_descs), 1)
+    pair_codes, unique_pairs = pd.factorize(date_codes.astype("int64") * num_descs + desc_codes)
+
+    date_reprs = [repr(d) for d in unique_dates]
+    desc_reprs = [repr(desc) for desc in unique_descs]
+    keys = [
+        f"[{date_reprs[pair // num_descs]}, {desc_reprs[pair % num_descs]}]"
+        for pair in unique_pairs.tolist()
+    ]
+    unique_hashes = np.array(list(map(sha256_hex, keys)), dtype=object)
+    base_hashes = pd.Series(unique_hashes[pair_codes], index=dates.index, dtype=object)
+
+    # 1 for the first instance of a key, 2 for the second, and so on
+    occurrence = pd.Series(pair_codes, index=dates.index).groupby(pair_codes, sort=False).cumcount() + 1
+
+    if occurrences is not None:
+        # offset by the number of times each hash was seen in previous chunks
+        if occurrences:
+            occurrence += base_hashes.map(occurrences).fillna(0).astype("int64")
+
+        # the last occurrence of each key in this chunk is the running count to carry forward
+        last_occurrence = occurrence.groupby(pair_codes, sort=False).max()
+        occurrences.update(zip(unique_hashes[last_occurrence.index], last_occurrence.tolist()))
+
+    repeats = occurrence > 1
+
+    transaction_ids = base_hashes.copy()
+    if repeats.any():
+        repeat_keys = [f"{count} occurrence of {h}" for count, h in zip(occurrence[repeats], base_hashes[repeats])]
+        transaction_ids[repeats] = list(map(sha256_hex, repeat_keys))
+
+        logger.info(f"{repeats.sum()} valid repeated transactions detected and rehashed to unique transaction_ids")
+
+    return transaction_ids
+
+def infer_date_format(dates):
+    """
+    The date format pd.to_datetime() infers for dates, i.e. the format of the first non-null value.
+
+    Returns:
+        str: a strftime format; None if it can't be guessed, in which case dates are parsed value by value.
+    """
+
+    values = dates.dropna()
+    if values.empty or not isinstance(values.iloc[0], str):
+        return None
+
+    return guess_datetime_format(values.iloc[0])
+
+def parse(df, issuer_config, occurrences=None, date_format=None):
+    """
+    Clean a raw statement.
+
+    Args:
+        df (pd.DataFrame): raw statement, or a chunk of one.
+        issuer_config (dict): issuer config for this statement, see issuers.json.
+        occurrences (dict, optional): running counts of repeated transactions across chunks, see generate_transaction_ids().
+        date_format (str, optional): strftime format of the statement's dates; inferred from df if not given.
+            Chunks of a statement must share one, see infer_date_format().
+    """
+
     DATE_COLUMN = issuer_config["DATE_COLUMN"]
     DESCRIPTION_COLUMN = issuer_config["DESCRIPTION_COLUMN"]
     AMOUNT_COLUMN = issuer_config["AMOUNT_COLUMN"]
     EXPENSES_SIGN = issuer_config["EXPENSES_SIGN"]
 
-    parsed_dates = pd.to_datetime(df[DATE_COLUMN], errors='coerce')
+    parsed_dates = pd.to_datetime(df[DATE_COLUMN], errors='coerce', format=date_format)
     num_invalid = parsed_dates.isna().sum()
 
     if num_invalid > 0:
@@ -23,34 +124,28 @@ def parse(df, issuer_config):
     # generate transaction_ids, intended to be a unique deduplication key for transactions, via SHA-256 hashes over transaction_date and description columns
     # we intentionally exclude amount column, because the amount may be user-adjusted for valid reasons (splitting costs)
     # note that, its possible to have repeated transactions on the same day, producing duplicate SHA-256 hashes for valid repeated transactions
-    # to handle this, we identify the valid repeated transactions, and re-hash them using the base hash to produce truly unique transaction_ids
-    hashes = [
-        hashlib.sha256(str([date, desc]).encode("utf-8")).hexdigest()
-        for date, desc in zip(parsed_dates, descriptions)
-    ]
-
-    hash_counts = {}
-    transaction_ids = []
-    for h in hashes:
-        hash_counts[h] = hash_counts.get(h, 0) + 1
-
-        count = hash_counts.get(h)
-        if count == 1:
-            # this captures the first instance of all transactions, including transactions in valid repeated transactions
-            transaction_ids.append(h)
-        else:
-            # subsequent transactions in valid repeat transactions are rehashed to produce final unique transaction_id
-            new_hash = hashlib.sha256(f"{count} occurrence of {h}".encode("utf-8")).hexdigest()
-            transaction_ids.append(new_hash)
-
-            logger.info(f"count {count} for hash {h} detected. rehashed to {new_hash}")
+    # generate_transaction_ids() handles these by re-hashing repeats using the base hash to produce truly unique transaction_ids
+    # occurrences carries those counts across chunks when a statement is streamed, see generate_transaction_ids()
+    transaction_ids = generate_transaction_ids(parsed_dates, descriptions, occurrences)
 
     return pd.DataFrame({
         "transaction_id": transaction_ids,
         "transaction_date": parsed_dates,
         "description": descriptions,
-        
-        # statement amounts are positive for expenses, 
+
+        # amounts are kept in integer cents, so they sum exactly downstream
+        # statement amounts are positive for expenses,
         # multiply by -1 to match preferred convention, if required
-        "amount": df[AMOUNT_COLUMN].astype(float) * EXPENSES_SIGN
-    })
\ No newline at end of file
+        "amount": (df[AMOUNT_COLUMN].astype(float) * 100).round().astype("Int64") * EXPENSES_SIGN
+    })
+
+def to_table(clean):
+    """Convert a cleaned statement to an Arrow table with CLEANED_SCHEMA."""
+    return pa.Table.from_pandas(clean[CLEANED_SCHEMA.names], schema=CLEANED_SCHEMA, preserve_index=False)
+
+def from_table(table):
+    """
+    Convert a cleaned statement table back to a DataFrame.
+    amount is read as nullable Int64, as a plain to_pandas() turns integer columns with nulls into floats, i.e. dollars.
+    """
+    return table.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
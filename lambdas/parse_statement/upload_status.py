@@ -0,0 +1,44 @@
+"""
+Per-upload status objects, which the UI reads to confirm each step's result, see check_lambda_completed() in ui/utils/helpers.py.
+
+Shared by the parse_statement and update_master lambdas, update_master/upload_status.py is a symlink to this module.
+"""
+
+import json
+import boto3
+import logging
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+s3 = boto3.client('s3')
+
+BUCKET = 'aws-budget-buddy'
+
+SUCCESS_STATUS = "SUCCESS"
+FAILURE_STATUS = "FAILURE"
+
+def write_status(status_key, step, status, **details):
+    """
+    Write a step's result to the upload's status object.
+    A failure to write status is logged, but never fails the invocation.
+
+    Args:
+        status_key (str): status object key provided by the caller; nothing is written if None.
+        step (str): the lambda reporting its result, i.e. its name in the state machine.
+        status (str): SUCCESS_STATUS or FAILURE_STATUS.
+        details: additional JSON serializable fields, e.g. error.
+    """
+
+    if not status_key:
+        return
+
+    try:
+        s3.put_object(
+            Bucket=BUCKET,
+            Key=status_key,
+            Body=json.dumps({"step": step, "status": status, **details}).encode('utf-8'),
+            ContentType='application/json'
+        )
+    except Exception as e:
+        logger.warning(f"Failed to write status to {status_key}: {e}")
@@ -0,0 +1,244 @@
+"""
+Delta backups for a user's master expenses data.
+
+Backups are stored as:
+    - <user>/backups/snapshots/<timestamp>.parquet: full copies of the master, edits included, taken when segments are compacted.
+    - <user>/backups/deltas/<timestamp>__<kind>.<ext>: changes since the previous backup, where kind is
+        - added: new rows appended by the update_master lambda, as full rows (.parquet), applied by transaction_id
+        - changed: cells edited by the user in the UI, as a copy of the edit log (.json), applied with schema.apply_edits()
+          changed deltas written by earlier versions of the UI hold full rows (.parquet), and are applied by transaction_id
+
+Any point in time can be rebuilt from the latest snapshot before it plus the deltas in between, see restore(),
+and the master rolled back to it, see rollback().
+
+Only the latest RETAINED_SNAPSHOTS snapshots, and the deltas after the oldest of them, are kept.
+Backups taken before delta backups were introduced (<user>/backups/<n>-<m>__<timestamp>.parquet) are left untouched.
+"""
+
+import boto3
+import logging
+import master_schema as schema
+import master_store as ms
+from datetime import timezone
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+s3 = boto3.client('s3')
+
+BUCKET = ms.BUCKET
+RETAINED_SNAPSHOTS = 4
+
+ADDED_DELTA_KIND = "added"
+CHANGED_DELTA_KIND = "changed"
+
+def snapshots_folder(user):
+    return f"{ms.backup_folder(user)}/snapshots"
+
+def deltas_folder(user):
+    return f"{ms.backup_folder(user)}/deltas"
+
+def backup_timestamp(key):
+    """Extract the timestamp from a snapshot or delta key, whatever its extension."""
+    return key.rsplit("/", 1)[-1].split(".")[0].split("__")[0]
+
+def list_backups(folder):
+    """Returns backup keys in folder, oldest first."""
+
+    keys = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=BUCKET, Prefix=f"{folder}/"):
+        keys.extend(obj['Key'] for obj in page.get('Contents', []))
+
+    return sorted(keys, key=backup_timestamp)
+
+def record_added_delta(user, segment_key):
+    """Record the rows added by an upload, via a server-side copy of its master segment."""
+
+    delta_key = f"{deltas_folder(user)}/{backup_timestamp(segment_key)}__{ADDED_DELTA_KIND}.parquet"
+    s3.copy_object(
+        Bucket=BUCKET,
+        CopySource={'Bucket': BUCKET, 'Key': segment_key},
+        Key=delta_key
+    )
+
+    logger.info(f"recorded backup delta at {delta_key}")
+
+def record_changed_delta(user, edit_key):
+    """
+    Record cells edited by the user, via a server-side copy of their edit log.
+
+    Returns:
+        bool: True if the delta was recorded, False if the edit log no longer exists.
+    """
+
+    delta_key = f"{deltas_folder(user)}/{backup_timestamp(edit_key)}__{CHANGED_DELTA_KIND}.json"
+    try:
+        s3.copy_object(
+            Bucket=BUCKET,
+            CopySource={'Bucket': BUCKET, 'Key': edit_key},
+            Key=delta_key
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+            raise
+
+        logger.warning(f"edit log {edit_key} no longer exists, no backup delta recorded")
+        return False
+
+    logger.info(f"recorded backup delta at {delta_key}")
+    return True
+
+def snapshot(user, segment_keys):
+    """
+    Take a full snapshot of the master, then evict backups outside the retention policy.
+
+    When there are no segments or edit logs, the base master is the full master and is copied server-side.
+    Otherwise the base and segments are merged, and edit logs applied, first.
+    """
+
+    snapshot_key = f"{snapshots_folder(user)}/{ms.timestamp()}.parquet"
+    edit_keys = ms.list_edits(user)
+
+    if segment_keys or edit_keys:
+        frames = [ms.read_parquet(key) for key in [ms.master_key(user), *segment_keys]]
+        frames = [df for df in frames if df is not None]
+        master = schema.concat(frames).drop_duplicates(subset=ms.DEDUPLICATION_COLS)
+        ms.apply_edits(master, edit_keys)
+        ms.write_parquet(snapshot_key, master)
+    else:
+        s3.copy_object(
+            Bucket=BUCKET,
+            CopySource={'Bucket': BUCKET, 'Key': ms.master_key(user)},
+            Key=snapshot_key
+        )
+
+    logger.info(f"took master snapshot at {snapshot_key}")
+    evict(user)
+
+def ensure_snapshot(user, segment_keys):
+    """
+    Snapshot existing masters that have no snapshot yet, so restores always have a starting point.
+    Masters that don't exist yet need no snapshot, since every row they will hold is recorded as a delta.
+    """
+
+    if list_backups(snapshots_folder(user)):
+        return
+
+    if not ms.object_exists(ms.master_key(user)) and not segment_keys:
+        return
+
+    snapshot(user, segment_keys)
+
+def evict(user):
+    """Delete snapshots beyond RETAINED_SNAPSHOTS, and deltas older than the oldest retained snapshot."""
+
+    snapshots = list_backups(snapshots_folder(user))
+    if len(snapshots) <= RETAINED_SNAPSHOTS:
+        return
+
+    expired = snapshots[:-RETAINED_SNAPSHOTS]
+    oldest_retained = backup_timestamp(snapshots[-RETAINED_SNAPSHOTS])
+    expired += [key for key in list_backups(deltas_folder(user)) if backup_timestamp(key) < oldest_retained]
+
+    ms.delete_objects(expired)
+
+    logger.info(f"evicted {len(expired)} backups older than {oldest_retained}")
+
+def restore(user, at=None):
+    """
+    Rebuild the master as it was at a point in time.
+
+    Args:
+        user (str): user root folder.
+        at (datetime, optional): point in time to restore, naive datetimes are taken as local time;
+            defaults to the latest backup.
+
+    Returns:
+        pd.DataFrame: the restored master, or None if no backups cover the requested time.
+    """
+
+    cutoff = at.astimezone(timezone.utc).strftime(ms.TIMESTAMP_FORMAT) if at else None
+    covered = lambda key: cutoff is None or backup_timestamp(key) <= cutoff
+
+    all_snapshots = list_backups(snapshots_folder(user))
+    snapshots = [key for key in all_snapshots if covered(key)]
+
+    if not snapshots and len(all_snapshots) >= RETAINED_SNAPSHOTS:
+        # deltas before the oldest retained snapshot may have been evicted
+        logger.warning(f"{cutoff} is outside the backup retention window")
+        return None
+
+    base_timestamp = backup_timestamp(snapshots[-1]) if snapshots else ""
+    deltas = [
+        key for key in list_backups(deltas_folder(user))
+        if covered(key) and backup_timestamp(key) > base_timestamp
+    ]
+
+    if not snapshots and not deltas:
+        return None
+
+    master = ms.read_parquet(snapshots[-1]) if snapshots else None
+    for key in deltas:
+        if key.endswith(".json"):
+            if master is not None:
+                schema.apply_edits(master, ms.read_edits(key))
+            continue
+
+        # existing rows win over delta rows with the same transaction_id, as when segments are read or compacted
+        delta = ms.read_parquet(key)
+        frames = [df for df in (master, delta) if df is not None]
+        master = schema.concat(frames).drop_duplicates(subset=ms.DEDUPLICATION_COLS)
+
+    if master is None:
+        return None
+
+    logger.info(f"restored {len(master)} rows from {len(snapshots[-1:])} snapshot and {len(deltas)} deltas")
+    return master
+
+def rollback(user, at=None):
+    """
+    Roll the user's master back to a point in time, see restore().
+
+    The restored master replaces the base master, and the segments and edit logs, which hold later changes, are deleted.
+    Rows added since then leave the master, so the id index is rebuilt; otherwise they'd be skipped as duplicates on re-upload.
+    The restored master is snapshotted, so later restores start from it.
+
+    The base is only replaced if it's unchanged since the rollback started, like in ms.compact(); otherwise, e.g. a merge
+    compacted segments or the UI saved edits in the meantime, nothing is written or deleted.
+
+    Args:
+        user (str): user root folder.
+        at (datetime, optional): point in time to roll back to, see restore().
+
+    Returns:
+        int: number of rows in the restored master, or None if no backups cover the requested time.
+
+    Raises:
+        ClientError: with one of ms.WRITE_CONFLICT_CODES, or NoSuchKey, if the base master was rewritten or deleted during the rollback.
+    """
+
+    # read before restoring, so changes written in the meantime are neither overwritten nor deleted
+    etag = ms.base_etag(user)
+    later_changes = ms.list_segments(user) + ms.list_edits(user)
+
+    master = restore(user, at)
+    if master is None:
+        return None
+
+    master = master.sort_values(by="transaction_date", ascending=False)
+    response = s3.put_object(
+        Bucket=BUCKET,
+        Key=ms.master_key(user),
+        Body=schema.write(master),
+        **({"IfNoneMatch": "*"} if etag == ms.NO_BASE_ETAG else {"IfMatch": etag})
+    )
+
+    ms.delete_objects(later_changes)
+    ms.rebuild_id_index(user, [], response['ETag'])
+    snapshot(user, [])
+
+    logger.info(f"rolled master back to {at or 'the latest backup'}, {len(master)} rows")
+    return len(master)
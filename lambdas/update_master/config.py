@@ -0,0 +1 @@
+../parse_statement/config.py
\ No newline at end of file
@@ -0,0 +1 @@
+../parse_statement/inference.py
\ No newline at end of file
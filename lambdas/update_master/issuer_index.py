@@ -0,0 +1 @@
+../parse_statement/issuer_index.py
\ No newline at end of file
@@ -0,0 +1 @@
+../parse_statement/issuers.py
\ No newline at end of file
@@ -1,16 +1,43 @@
 """
 Lambda function to update master expenses file when new cleaned files are generated by parse_statement lambda function.
 This function is triggered by S3 events when new cleaned files are uploaded.
+
+It is also invoked directly with a batch of parsed statements, either a list of parsed_statement_keys or a
+parsed_statements_prefix, which are merged into the master in one pass: one segment, one index update and one backup delta.
+
+In fused mode, it's invoked directly with a raw statement_key instead, and parses the statement itself,
+merging the parsed DataFrame from memory; this skips the parse_statement invocation, the cleaned file round trip,
+and the state machine transitions. parser.py, issuers.py and config.py are symlinks to parse_statement's,
+so both paths parse statements identically.
+
+New rows are auto-categorized by the user's rules, see rules.py,
+then appended to the master as immutable segments, see master_store.py for the storage layout.
+
+Backups are also managed here, see backups.py, with two more direct invocations, selected by the body's action:
+    - {"action": "record_edits", "edit_log_key": ...}: invoked by the UI after each save, records the edit log as a backup delta.
+    - {"action": "rollback", "user": ..., "at": <ISO 8601 datetime, optional>}: rolls the user's master back to a point in time.
+      It answers 409 if the master changed during the rollback, in which case nothing is rolled back.
 """
 
 import json
 import boto3
+import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
 import logging
-from datetime import datetime
+import rules
+import backups
+import master_store as ms
+import master_schema as schema
 
 from io import BytesIO
+from datetime import datetime
+from parser import parse, to_table, from_table
+from issuers import get_issuers
+from upload_status import write_status, SUCCESS_STATUS, FAILURE_STATUS
+from inference import resolve_issuer_config
 from urllib.parse import unquote_plus
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
 
 logger = logging.getLogger()
@@ -20,28 +47,32 @@ s3 = boto3.client('s3')
 
 BUCKET = 'aws-budget-buddy'
 REQUIRED_COLS = ["transaction_id", "category", "notes"]
-DEDUPLICATION_COLS = ["transaction_id"]
+DEDUPLICATION_COLS = ms.DEDUPLICATION_COLS
 
-def lambda_handler(event, context):
-    logger.info("Lambda triggered with event:")
-    logger.info(json.dumps(event))
+# the UI waits on a per-upload status object, see upload_status.py
+STEP_NAME = "update_master"
 
-    try:
-        body = json.loads(event["body"]) if isinstance(event["body"], str) else event["body"]
-        key = unquote_plus(body.get("parsed_statement_key", "KEY_NOT_FOUND_IN_EVENT_BODY"))
+# batches of parsed statements are read from S3 concurrently, by a pool of this size
+READ_WORKERS = 8
 
-        logger.info(f"Processing file from bucket: {BUCKET}, key: {key}")
+# actions of direct invocations, see the module docstring; invocations without an action merge statements
+RECORD_EDITS_ACTION = "record_edits"
+ROLLBACK_ACTION = "rollback"
 
-        # extract details from key path
-        # expected format: <user>/cleaned/file.csv
-        parts = key.split("/")
-        user = parts[0]
+# parse_statement writes Parquet; CSV is only read for statements parsed before the switch
+PARSED_STATEMENT_EXTENSIONS = (".parquet", ".csv")
 
-        MASTER_KEY = f'{user}/categorized_expenses.parquet'
-        BACKUP_FOLDER = f'{user}/backups'
+def read_parsed_statement(key):
+    """
+    Read a cleaned statement written by the parse_statement lambda.
+    These are Parquet files, with a fixed schema; CSV is still read for statements parsed before the switch to Parquet.
+    """
 
-        obj = s3.get_object(Bucket=BUCKET, Key=key)
-        new_data = pd.read_csv(
+    obj = s3.get_object(Bucket=BUCKET, Key=key)
+    if key.endswith(".parquet"):
+        clean = from_table(pq.read_table(BytesIO(obj['Body'].read())))
+    else:
+        clean = pd.read_csv(
             obj['Body'],
             dtype={
                 'description': 'str',
@@ -53,90 +84,253 @@ def lambda_handler(event, context):
             parse_dates=['transaction_date'],
         )
 
-        if new_data.empty:
-            logger.warning(f"New file {key} is empty. Skipping update.")
+    # statements parsed before amounts were stored as cents hold float dollars
+    # converted per file, so a batch never mixes dollars and cents
+    if pd.api.types.is_float_dtype(clean['amount'].dtype):
+        clean['amount'] = schema.to_cents(clean['amount'])
+
+    return clean
+
+def parse_raw_statement(key):
+    """
+    Parse a raw statement in memory, for fused mode; the same steps as the parse_statement lambda.
+
+    Args:
+        key (str): raw statement key, <user>/statements/<issuer>/file.csv.
+    """
+
+    issuer = key.split("/")[2]
+    ISSUERS = get_issuers()
+    issuer_config = ISSUERS.get(issuer) or resolve_issuer_config(key, ISSUERS)
+    if not issuer_config:
+        raise ValueError(f"issuer {issuer} in key: {key} is unsupported/unrecognized, and its columns couldn't be detected")
+
+    obj = s3.get_object(Bucket=BUCKET, Key=key)
+    clean = parse(pd.read_csv(obj['Body']), issuer_config)
+    clean["statement_issuer"] = issuer
+
+    # conformed to the cleaned statement schema, so merged rows are typed exactly as in the two-step path
+    return from_table(to_table(clean))
+
+def list_parsed_statements(prefix):
+    """Returns the keys of parsed statements under prefix, oldest first."""
+
+    objects = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=BUCKET, Prefix=prefix):
+        objects.extend(obj for obj in page.get('Contents', []) if obj['Key'].endswith(PARSED_STATEMENT_EXTENSIONS))
+
+    return [obj['Key'] for obj in sorted(objects, key=lambda obj: obj['LastModified'])]
+
+def file_accounting(keys, frames, added):
+    """
+    Per-file counts of rows read, rows added to the master, and duplicate rows skipped.
+
+    Args:
+        keys (list[str]): parsed statement keys.
+        frames (list[pd.DataFrame]): parsed statements, aligned with keys.
+        added (np.ndarray[bool]): True for rows added to the master, aligned with the concatenated frames.
+    """
+
+    file_index = np.repeat(np.arange(len(keys)), [len(df) for df in frames])
+    num_added = np.bincount(file_index[added], minlength=len(keys))
+
+    return [
+        {"key": key, "rows": len(df), "added": int(n), "duplicates": len(df) - int(n)}
+        for key, df, n in zip(keys, frames, num_added)
+    ]
+
+def record_edits(body):
+    """Record a user's edit log as a backup delta."""
+
+    edit_log_key = body["edit_log_key"]
+    user = edit_log_key.split("/")[0]
+
+    backups.ensure_snapshot(user, ms.list_segments(user))
+    recorded = backups.record_changed_delta(user, edit_log_key)
+
+    return {
+        "statusCode": 200,
+        "body": json.dumps({"message": "Edits recorded" if recorded else "Edit log no longer exists, edits not recorded"})
+    }
+
+def rollback(body):
+    """Roll a user's master back to a point in time, see backups.rollback()."""
+
+    user = body["user"]
+    at = datetime.fromisoformat(body["at"]) if body.get("at") else None
+
+    try:
+        num_rows = backups.rollback(user, at)
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ms.WRITE_CONFLICT_CODES + ('NoSuchKey',):
+            raise
+
+        logger.warning(f"Base master was rewritten during the rollback, nothing rolled back: {e}")
+        return {
+            "statusCode": 409,
+            "body": json.dumps({"error": "the master changed during the rollback, try again"})
+        }
+
+    if num_rows is None:
+        return {
+            "statusCode": 404,
+            "body": json.dumps({"error": f"no backups cover {body.get('at') or 'the latest backup'}"})
+        }
+
+    return {
+        "statusCode": 200,
+        "body": json.dumps({"message": "Master rolled back", "rows": num_rows})
+    }
+
+def lambda_handler(event, context):
+    logger.info("Lambda triggered with event:")
+    logger.info(json.dumps(event))
+
+    keys, status_key = [], None
+
+    try:
+        body = json.loads(event["body"]) if isinstance(event["body"], str) else event["body"]
+        status_key = body.get("status_key")
+
+        if body.get("action") == RECORD_EDITS_ACTION:
+            return record_edits(body)
+
+        if body.get("action") == ROLLBACK_ACTION:
+            return rollback(body)
+
+        if "error" in body:
+            # parse_statement failed and has already reported its failure to the status object
+            logger.error(f"parse_statement failed, skipping update: {body['error']}")
+
+            return {
+                "statusCode": 400,
+                "body": json.dumps({"error": body["error"]})
+            }
+
+        if body.get("defer_merge"):
+            # multi-file uploads merge all their parsed statements in one batched invocation, see ui/sections/upload.py
+            logger.info("Merge deferred to a batched update_master invocation.")
+            write_status(status_key, STEP_NAME, SUCCESS_STATUS, parsed_statement_key=body.get("parsed_statement_key"))
+
+            return {
+                "statusCode": 200,
+                "body": json.dumps({
+                    "message": "Master update deferred",
+                    "parsed_statement_key": body.get("parsed_statement_key")
+                })
+            }
+
+        # a raw statement in fused mode, a single parsed statement from the state machine, or a batch of them,
+        # either listed (multi-file uploads) or everything under a prefix (backfills, e.g. <user>/cleaned/)
+        if body.get("fused"):
+            keys = [body["statement_key"]]
+        elif "parsed_statements_prefix" in body:
+            keys = list_parsed_statements(body["parsed_statements_prefix"])
+        else:
+            keys = body.get("parsed_statement_keys", [body.get("parsed_statement_key", "KEY_NOT_FOUND_IN_EVENT_BODY")])
+
+        # parse_statement produces no output (None) when a statement is empty
+        keys = [unquote_plus(key) for key in keys if key is not None]
+
+        if not keys:
+            logger.warning("No parsed statement to merge. Skipping update.")
+            write_status(status_key, STEP_NAME, SUCCESS_STATUS)
 
             return {
                 "statusCode": 200,
                 "body": json.dumps({"message": "Master file updated successfully"})
             }
 
+        # extract details from key path
+        # expected format: <user>/cleaned/file.parquet, or <user>/statements/<issuer>/file.csv in fused mode
+        user = keys[0].split("/")[0]
+        if any(key.split("/")[0] != user for key in keys):
+            raise ValueError(f"parsed statements in a batch must belong to a single user: {keys}")
+
+        logger.info(f"Processing {len(keys)} files from bucket: {BUCKET}, keys: {keys}")
+        if body.get("fused"):
+            frames = [parse_raw_statement(keys[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=READ_WORKERS) as pool:
+                frames = list(pool.map(read_parsed_statement, keys))
+
+        new_data = pd.concat(frames, ignore_index=True)
+
+        if new_data.empty:
+            logger.warning(f"New files {keys} are empty. Skipping update.")
+            write_status(status_key, STEP_NAME, SUCCESS_STATUS)
+
+            return {
+                "statusCode": 200,
+                "body": json.dumps({
+                    "message": "Master file updated successfully",
+                    "files": file_accounting(keys, frames, np.zeros(0, dtype=bool))
+                })
+            }
+
         else:
-            logger.info(f"Read {len(new_data)} rows from new CSV")
-
-        # Load master file (if it exists)
-        try:
-            master_obj = s3.get_object(Bucket=BUCKET, Key=MASTER_KEY)
-            master_body = BytesIO(master_obj['Body'].read())
-            master_df = pd.read_parquet(master_body)
-
-            num_rows = len(master_df)
-            num_uncategorized = master_df['category'].isna().sum()
-            logger.info(f"Read {num_rows} rows from master file")
-
-            # Backup current copy of master file
-            backup_key = f"{BACKUP_FOLDER}/{num_uncategorized}-{num_rows}__{datetime.now().strftime("%Y-%m-%dT%H-%M-%S-%f")}.parquet"
-            s3.copy_object(
-                Bucket=BUCKET,
-                CopySource={'Bucket': BUCKET, 'Key': MASTER_KEY},
-                Key=backup_key
-            )
-
-            logger.info(f"backed up latest master file at {backup_key}")
-
-        except ClientError as e:
-            if e.response['Error']['Code'] == 'NoSuchKey':
-                logger.warning("Master file not found. Starting fresh.")
-                master_df = pd.DataFrame(columns=new_data.columns)
-            else:
-                # streamlit checks for this log to confirm execution failure
-                logger.error("FAILURE")
-                logger.exception(f"Unable to process file {key}: {e}")
-                
-                return {
-                    "statusCode": 400,
-                    "body": json.dumps({"error": str(e)})
-                }
+            logger.info(f"Read {len(new_data)} rows from {len(keys)} parsed statements")
 
         # include required columns in master schema
-        # handles cases where master is empty or missing 
         for col in REQUIRED_COLS:
-            if col not in master_df.columns:
-                master_df[col] = pd.NA
-
-        # Merge and deduplicate
-        # we ignore columns that are not in both dataframes, handling categorized expenses gracefully
-        combined = pd.concat([master_df, new_data], ignore_index=True)
-        before = len(combined)
-        combined = combined.drop_duplicates(subset=DEDUPLICATION_COLS)
-        after = len(combined)
-        logger.info(f"Dropped {before - after} duplicate rows. Final row count: {after}")
-
-        # Save to Parquet in memory
-        out_buffer = BytesIO()
-        combined.to_parquet(out_buffer, index=False, compression='snappy')
-
-        # Upload updated master file
-        s3.put_object(
-            Bucket=BUCKET,
-            Key=MASTER_KEY,
-            Body=out_buffer.getvalue()
-        )
+            if col not in new_data.columns:
+                new_data[col] = pd.NA
+
+        new_data = schema.conform(new_data)
+
+        # deduplicate against the sidecar id index, without loading any of the master's history
+        segment_keys = ms.list_segments(user)
+        id_index, base_etag = ms.load_id_index(user, segment_keys)
+        logger.info(f"Read {len(id_index)} existing transaction_ids from index")
+
+        digests = ms.to_digests(new_data[DEDUPLICATION_COLS[0]])
+        is_new = ~ms.index_contains(id_index, digests)
+
+        # one dedupe pass over the whole batch, against the master and across files; the first file listed wins
+        added = is_new & ~new_data.duplicated(subset=DEDUPLICATION_COLS).to_numpy()
+        new_rows = new_data[added]
+        logger.info(f"Dropped {len(new_data) - len(new_rows)} duplicate rows. Adding {len(new_rows)} new rows")
+
+        # only new rows are categorized, so rules never override the user's own categories
+        rule_set = rules.get_rules(user)
+        if len(rule_set) and not new_rows.empty:
+            new_rows, num_categorized = rule_set.apply(new_rows)
+            logger.info(f"Categorized {num_categorized} of {len(new_rows)} new rows with {len(rule_set)} rules")
+
+        # masters that predate delta backups need a full snapshot before their first delta
+        backups.ensure_snapshot(user, segment_keys)
+
+        if not new_rows.empty:
+            # the segment is written before the index, so a failure in between can only cause re-appends, never lost rows
+            segment_key = ms.write_segment(user, new_rows)
+            segment_keys.append(segment_key)
+            ms.write_id_index(user, id_index, digests[added], base_etag)
+            backups.record_added_delta(user, segment_key)
 
-        logger.info(f"updated master file at {MASTER_KEY}")
+        if len(segment_keys) >= ms.COMPACTION_THRESHOLD:
+            compacted_etag = ms.compact(user, segment_keys, base_etag)
+            if compacted_etag:
+                ms.stamp_id_index(user, compacted_etag)
+                backups.snapshot(user, [])
 
-        # check_lambda_completed() looks for this log to confirm execution success
-        logger.info("SUCCESS")
+        # check_lambda_completed() reads the status object to confirm execution success
+        logger.info(SUCCESS_STATUS)
+        write_status(status_key, STEP_NAME, SUCCESS_STATUS)
 
         return {
             "statusCode": 200,
-            "body": json.dumps({"message": "Master file updated successfully"})
+            "body": json.dumps({
+                "message": "Master file updated successfully",
+                "files": file_accounting(keys, frames, added)
+            })
         }
 
     except Exception as e:
-        # check_lambda_completed() looks for this log to confirm execution failure
-        logger.error("FAILURE")
-        logger.exception(f"Unable to process file {key}: {e}")
+        # check_lambda_completed() reads the status object to confirm execution failure
+        logger.error(FAILURE_STATUS)
+        logger.exception(f"Unable to process files {keys}: {e}")
+        write_status(status_key, STEP_NAME, FAILURE_STATUS, error=str(e))
 
         return {
             "statusCode": 400,
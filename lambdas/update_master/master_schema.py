@@ -0,0 +1,302 @@
+"""
+Canonical schema of the master expenses data, in memory and on disk.
+
+In memory, masters, segments and new rows are conformed to MASTER_DTYPES:
+    - transaction_id, description and notes are Arrow-backed strings (string[pyarrow]), not Python str objects.
+    - statement_issuer and category are categoricals, i.e. dictionary-encoded.
+    - transaction_date is datetime64[ns].
+    - amount is in integer cents (Int64), so sums are exact; dollars are only used for display, see to_dollars().
+
+On disk, Parquet files hold the same columns, except transaction_id, which is stored as its 32-byte SHA-256 digest
+(fixed_size_binary(32)) instead of 64 hex characters; read() converts it back to hex.
+Files written before this schema (hex string ids, plain string columns, float dollar amounts) are read and conformed
+transparently: a float amount column always holds dollars, an integer one cents.
+
+Edit logs hold edited cells as JSON {"transaction_id", "column", "value"} records, see edits_to_records() and apply_edits().
+
+Shared by the update_master lambda and the UI, ui/utils/master_schema.py is a symlink to this module.
+"""
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from io import BytesIO
+from datetime import date
+
+ID_COLUMN = "transaction_id"
+EDIT_COLUMNS = [ID_COLUMN, "column", "value"]
+ID_BYTES = 32
+
+AMOUNT_COLUMN = "amount"
+CENTS = 100
+
+STRING = pd.StringDtype("pyarrow")
+MASTER_DTYPES = {
+    "transaction_id": STRING,
+    "transaction_date": "datetime64[ns]",
+    "description": STRING,
+    "amount": "Int64",
+    "statement_issuer": "category",
+    "category": "category",
+    "notes": STRING,
+}
+
+CATEGORICAL_COLUMNS = [col for col, dtype in MASTER_DTYPES.items() if dtype == "category"]
+
+# on-disk Arrow types, fixed so e.g. an all-null category column isn't written as a null column
+# transaction_id is stored as digests, see to_table()
+DISK_TYPES = {
+    "transaction_date": pa.timestamp("ns"),
+    "description": pa.string(),
+    "amount": pa.int64(),
+    "statement_issuer": pa.dictionary(pa.int32(), pa.string()),
+    "category": pa.dictionary(pa.int32(), pa.string()),
+    "notes": pa.string(),
+}
+
+# lookup tables between ASCII hex digits and their values, so ids are converted without a Python loop
+HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+HEX_VALUES = np.zeros(256, dtype=np.uint8)
+HEX_VALUES[HEX_DIGITS] = np.arange(16)
+HEX_VALUES[np.frombuffer(b"ABCDEF", dtype=np.uint8)] = np.arange(10, 16)
+IS_HEX = np.zeros(256, dtype=bool)
+IS_HEX[np.frombuffer(b"0123456789abcdefABCDEF", dtype=np.uint8)] = True
+
+def ids_to_digests(ids):
+    """
+    Convert hex transaction_ids to their 32-byte SHA-256 digests.
+
+    Returns:
+        np.ndarray: fixed-width S32 array, aligned with ids.
+
+    Raises:
+        ValueError: if an id is missing, or isn't 64 hex characters.
+    """
+
+    hex_ids = pa.array(pd.Series(ids).astype(STRING))
+    if isinstance(hex_ids, pa.ChunkedArray):
+        hex_ids = hex_ids.combine_chunks()
+
+    # invalid ids would otherwise be converted to wrong digests silently, a missing id to a digest of zeros
+    if hex_ids.null_count:
+        raise ValueError(f"{hex_ids.null_count} of {len(hex_ids)} transaction_ids are missing")
+
+    wrong_length = pc.not_equal(pc.binary_length(hex_ids), 2 * ID_BYTES)
+    if pc.any(wrong_length).as_py():
+        invalid = hex_ids.filter(wrong_length)
+        raise ValueError(f"{len(invalid)} transaction_ids aren't {2 * ID_BYTES} hex characters, e.g. {invalid[0].as_py()!r}")
+
+    # ids are cast to fixed-width 64-byte values, so their characters are one contiguous buffer
+    hex_ids = hex_ids.cast(pa.binary(2 * ID_BYTES))
+
+    characters = np.frombuffer(hex_ids.buffers()[1], dtype=np.uint8, count=len(hex_ids) * 2 * ID_BYTES, offset=hex_ids.offset * 2 * ID_BYTES)
+    characters = characters.reshape(-1, 2 * ID_BYTES)
+
+    is_hex = IS_HEX[characters].all(axis=1)
+    if not is_hex.all():
+        invalid = hex_ids.filter(pa.array(~is_hex)).cast(pa.string())
+        raise ValueError(f"{len(invalid)} transaction_ids aren't {2 * ID_BYTES} hex characters, e.g. {invalid[0].as_py()!r}")
+
+    nibbles = HEX_VALUES[characters]
+    digests = (nibbles[:, 0::2] << 4) | nibbles[:, 1::2]
+
+    return np.ascontiguousarray(digests).view(f"S{ID_BYTES}").ravel()
+
+def digests_to_ids(digests):
+    """
+    Convert 32-byte SHA-256 digests to hex transaction_ids.
+
+    Args:
+        digests (pa.FixedSizeBinaryArray): as stored on disk.
+
+    Returns:
+        pa.Array: hex transaction_ids, as strings.
+    """
+
+    values = np.frombuffer(digests.buffers()[1], dtype=np.uint8, count=len(digests) * ID_BYTES, offset=digests.offset * ID_BYTES)
+    values = values.reshape(-1, ID_BYTES)
+
+    hex_ids = np.empty((len(digests), 2 * ID_BYTES), dtype=np.uint8)
+    hex_ids[:, 0::2] = HEX_DIGITS[values >> 4]
+    hex_ids[:, 1::2] = HEX_DIGITS[values & 0x0F]
+
+    return pa.array(hex_ids.view(f"S{2 * ID_BYTES}").ravel(), type=pa.binary()).cast(pa.string())
+
+def to_cents(dollars):
+    """Convert dollar amounts to integer cents, rounded to the nearest cent."""
+    return (pd.to_numeric(dollars) * CENTS).round().astype(MASTER_DTYPES[AMOUNT_COLUMN])
+
+def to_dollars(cents):
+    """Convert integer cents to float dollars, for display."""
+    return cents.astype("float64") / CENTS
+
+def conform(df):
+    """
+    Cast the master columns present in df to MASTER_DTYPES. Missing columns are not added, other columns are kept as is.
+
+    Returns:
+        pd.DataFrame: a conformed copy, or df itself if it already conforms.
+    """
+
+    dtypes = {
+        col: dtype for col, dtype in MASTER_DTYPES.items()
+        if col in df.columns and df[col].dtype != dtype
+    }
+
+    if not dtypes:
+        return df
+
+    # float amounts are dollars, from files written before amounts were stored as cents
+    if AMOUNT_COLUMN in dtypes and pd.api.types.is_float_dtype(df[AMOUNT_COLUMN].dtype):
+        df = df.assign(**{AMOUNT_COLUMN: to_cents(df[AMOUNT_COLUMN])})
+
+    # categoricals are built from object values, so their categories have the same dtype however the column was read
+    df = df.astype({col: object for col in dtypes if col in CATEGORICAL_COLUMNS})
+    return df.astype(dtypes)
+
+def concat(frames):
+    """
+    pd.concat() for conformed frames, which keeps categorical columns categorical.
+    A plain pd.concat() upcasts categoricals to object unless every frame has the same categories.
+    """
+
+    frames = [df for df in frames if df is not None]
+
+    for col in CATEGORICAL_COLUMNS:
+        if all(col in df.columns and isinstance(df[col].dtype, pd.CategoricalDtype) for df in frames):
+            # all-null columns have no categories, and their categories' dtype may differ (object, not str), so they're left out
+            columns = [df[col] for df in frames if len(df[col].cat.categories)]
+            if not columns:
+                continue
+
+            categories = pd.api.types.union_categoricals(columns).categories
+            frames = [df.assign(**{col: df[col].cat.set_categories(categories)}) for df in frames]
+
+    return pd.concat(frames, ignore_index=True)
+
+def edit_value(value):
+    """
+    Convert an edited cell's value to its edit log form: None for missing values, ISO 8601 strings for dates,
+    and Python scalars for numpy ones.
+
+    Raises:
+        TypeError: for values that have no edit log form.
+    """
+
+    if pd.api.types.is_scalar(value) and pd.isna(value):
+        return None
+    if isinstance(value, np.datetime64):
+        value = pd.Timestamp(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, (str, bool, int, float)):
+        return value
+
+    raise TypeError(f"edited value {value!r} of type {type(value).__name__} can't be written to an edit log")
+
+def edits_to_records(edits):
+    """
+    Convert edited cells to edit log records.
+
+    Args:
+        edits (pd.DataFrame): edited cells, with transaction_id, column and value columns.
+
+    Returns:
+        list: JSON serializable {"transaction_id", "column", "value"} records.
+    """
+
+    return [
+        {ID_COLUMN: transaction_id, "column": column, "value": edit_value(value)}
+        for transaction_id, column, value in edits[EDIT_COLUMNS].itertuples(index=False)
+    ]
+
+def apply_edits(master, edits):
+    """
+    Apply edited cells to master, in place.
+    Later edits of the same cell win, and edits of rows that are no longer in master are ignored.
+
+    Args:
+        master (pd.DataFrame): master, with unique transaction_ids.
+        edits (pd.DataFrame): edited cells, with transaction_id, column and value columns; oldest first.
+            Amounts are in dollars, as shown in the editor, and dates may be ISO 8601 strings, as read from an edit log.
+    """
+
+    edits = edits.drop_duplicates(subset=[ID_COLUMN, "column"], keep="last")
+
+    # locate edited rows with a single isin() scan, then only index the (few) matching rows
+    ids = master[ID_COLUMN]
+    rows = np.flatnonzero(ids.isin(edits[ID_COLUMN]).to_numpy())
+    positions = edits[ID_COLUMN].map(pd.Series(rows, index=ids.iloc[rows].to_numpy()))
+    edits = edits.assign(position=positions).dropna(subset=["position"]).astype({"position": "int64"})
+
+    for col, cells in edits.groupby("column", sort=False):
+        if col not in master.columns:
+            continue
+
+        values = pd.Series(cells["value"].tolist(), dtype=object)
+        dtype = master[col].dtype
+
+        if col == AMOUNT_COLUMN and pd.api.types.is_integer_dtype(dtype):
+            # edit logs hold amounts in dollars, as shown in the editor
+            values = to_cents(values)
+        elif pd.api.types.is_numeric_dtype(dtype):
+            values = pd.to_numeric(values)
+        elif pd.api.types.is_datetime64_any_dtype(dtype):
+            values = pd.to_datetime(values).astype(dtype)
+        elif isinstance(dtype, pd.CategoricalDtype):
+            new_categories = values.dropna().unique()
+            master[col] = master[col].cat.add_categories([v for v in new_categories if v not in dtype.categories])
+
+        master.iloc[cells["position"].to_numpy(), master.columns.get_loc(col)] = values.to_numpy()
+
+def to_table(df):
+    """Convert a master DataFrame to an Arrow table in the on-disk schema."""
+
+    table = pa.Table.from_pandas(conform(df), preserve_index=False)
+
+    for col, type in DISK_TYPES.items():
+        if col in table.column_names and table.schema.field(col).type != type:
+            table = table.set_column(table.column_names.index(col), col, table.column(col).cast(type))
+
+    if ID_COLUMN in table.column_names:
+        digests = pa.array(ids_to_digests(df[ID_COLUMN]), type=pa.binary(ID_BYTES))
+        table = table.set_column(table.column_names.index(ID_COLUMN), ID_COLUMN, digests)
+
+    return table
+
+def from_table(table):
+    """Convert an Arrow table in the on-disk schema, or a legacy one, to a conformed master DataFrame."""
+
+    if ID_COLUMN in table.column_names and pa.types.is_fixed_size_binary(table.schema.field(ID_COLUMN).type):
+        ids = pa.chunked_array([digests_to_ids(chunk) for chunk in table.column(ID_COLUMN).chunks], type=pa.string())
+        table = table.set_column(table.column_names.index(ID_COLUMN), ID_COLUMN, ids)
+
+    # integers are read as nullable Int64, as a plain to_pandas() turns integer columns with nulls into floats
+    types = {pa.string(): STRING, pa.large_string(): STRING, pa.int64(): pd.Int64Dtype()}
+    return conform(table.to_pandas(types_mapper=types.get))
+
+def read(data, columns=None):
+    """
+    Read a master, segment or backup from Parquet bytes.
+
+    Returns:
+        pd.DataFrame: conformed to MASTER_DTYPES.
+    """
+    return from_table(pq.read_table(BytesIO(data), columns=columns))
+
+def write(df):
+    """
+    Write a master, segment or backup to Parquet bytes, in the on-disk schema.
+
+    Returns:
+        bytes
+    """
+
+    out_buffer = BytesIO()
+    pq.write_table(to_table(df), out_buffer, compression='snappy')
+    return out_buffer.getvalue()
@@ -0,0 +1,357 @@
+"""
+Storage layout for a user's master expenses data.
+
+The master is stored as:
+    - <user>/categorized_expenses.parquet: the compacted base master, rewritten only on compaction and by the UI.
+    - <user>/master_segments/<timestamp>.parquet: immutable segments, each holding only the new rows from one upload.
+    - <user>/transaction_ids.idx: sidecar index of every transaction_id in the master,
+      stored as a sorted array of fixed-width 32-byte SHA-256 digests,
+      and stamped with the ETag of the base master it was built against, see load_id_index().
+    - <user>/master_edits/<timestamp>.json: immutable edit logs, each holding the cells edited in one UI save,
+      as a list of {"transaction_id", "column", "value"} records, with amounts in dollars.
+      These are compacted into the base by the UI.
+
+Parquet objects are written and read in the compact master schema, see master_schema.py.
+
+Readers merge the base with all segments, then apply edit logs oldest first; the base wins on duplicate transaction_ids.
+Once enough segments accumulate, compact() folds them into the base.
+The base is rewritten both here and by the UI, so both rewrite it with a conditional write on the ETag they read it at;
+a base rewritten in the meantime is never overwritten, the losing side retries on its next merge or save.
+
+Deduplication only fetches the sidecar index, so a merge scales with the size of the new statement, not with history.
+The index may lag the segments (e.g. a failed index write, or concurrent uploads), in which case a few rows are
+appended twice; readers and compact() drop those by transaction_id, so missing ids are safe.
+Ids of rows that are no longer in the master are not: their rows would be skipped as duplicates on every re-upload.
+Rows leave the master when the base is rewritten by the UI's edit compaction, so the index is rebuilt whenever
+the base's ETag no longer matches its stamp; rollbacks rebuild it directly, see backups.rollback().
+"""
+
+import json
+import boto3
+import numpy as np
+import logging
+import pandas as pd
+import master_schema as schema
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+s3 = boto3.client('s3')
+
+BUCKET = 'aws-budget-buddy'
+DEDUPLICATION_COLS = ["transaction_id"]
+
+# the id index is stamped with the base master's ETag, in this user metadata key
+BASE_ETAG_METADATA = "base-etag"
+NO_BASE_ETAG = "none"
+
+# S3 error codes of a conditional write whose precondition failed, or that raced another conditional write
+WRITE_CONFLICT_CODES = ('PreconditionFailed', 'ConditionalRequestConflict', '412', '409')
+
+# number of segments that triggers compaction into the base master
+COMPACTION_THRESHOLD = 10
+
+# UTC timestamps are used in segment and backup keys, so lexical order is chronological
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H-%M-%S-%f"
+
+def master_key(user):
+    return f'{user}/categorized_expenses.parquet'
+
+def segments_folder(user):
+    return f'{user}/master_segments'
+
+def edits_folder(user):
+    return f'{user}/master_edits'
+
+def id_index_key(user):
+    return f'{user}/transaction_ids.idx'
+
+def backup_folder(user):
+    return f'{user}/backups'
+
+def timestamp():
+    return datetime.now(timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+def object_exists(key):
+    try:
+        s3.head_object(Bucket=BUCKET, Key=key)
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+            return False
+        raise
+
+def base_etag(user):
+    """ETag of the user's base master, or NO_BASE_ETAG if there is none yet."""
+
+    try:
+        return s3.head_object(Bucket=BUCKET, Key=master_key(user))['ETag']
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+            return NO_BASE_ETAG
+        raise
+
+def read_parquet(key, columns=None):
+    """
+    Read a Parquet object from S3.
+
+    Returns:
+        pd.DataFrame, conformed to the master schema; or None if the key does not exist.
+    """
+
+    try:
+        obj = s3.get_object(Bucket=BUCKET, Key=key)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchKey':
+            return None
+        raise
+
+    return schema.read(obj['Body'].read(), columns=columns)
+
+def write_parquet(key, df):
+    s3.put_object(
+        Bucket=BUCKET,
+        Key=key,
+        Body=schema.write(df)
+    )
+
+def delete_objects(keys):
+    """Delete keys, in batches of at most 1000, the delete_objects limit."""
+
+    for i in range(0, len(keys), 1000):
+        s3.delete_objects(
+            Bucket=BUCKET,
+            Delete={"Objects": [{"Key": key} for key in keys[i:i + 1000]]}
+        )
+
+def list_segments(user):
+    """Returns segment keys for the user, oldest first."""
+
+    keys = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=BUCKET, Prefix=f"{segments_folder(user)}/"):
+        keys.extend(obj['Key'] for obj in page.get('Contents', []))
+
+    # keys are timestamped, so lexical order is chronological
+    return sorted(keys)
+
+def list_edits(user):
+    """Returns edit log keys for the user, oldest first."""
+
+    keys = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=BUCKET, Prefix=f"{edits_folder(user)}/"):
+        keys.extend(obj['Key'] for obj in page.get('Contents', []))
+
+    # keys are timestamped, so lexical order is chronological
+    return sorted(keys)
+
+def read_edits(key):
+    """Read an edit log, as a DataFrame of transaction_id, column and value."""
+
+    obj = s3.get_object(Bucket=BUCKET, Key=key)
+    records = json.loads(obj['Body'].read().decode('utf-8'))
+    return pd.DataFrame(records, columns=schema.EDIT_COLUMNS)
+
+def apply_edits(master, edit_keys):
+    """
+    Apply edit logs to master, in place, oldest first.
+    The UI applies the same edit logs on read, with the same master_schema.apply_edits().
+    """
+
+    if not edit_keys:
+        return
+
+    edits = pd.concat([read_edits(key) for key in edit_keys], ignore_index=True)
+    schema.apply_edits(master, edits)
+
+    logger.info(f"applied {len(edits)} edited cells from {len(edit_keys)} edit logs")
+
+def load_transaction_ids(user, segment_keys):
+    """
+    Load the transaction_ids already present in the master (base + segments).
+
+    Only the transaction_id column is decoded, the rest of the history is never materialized.
+
+    Returns:
+        pd.Index: existing transaction_ids.
+    """
+
+    frames = [read_parquet(key, columns=DEDUPLICATION_COLS) for key in [master_key(user), *segment_keys]]
+    frames = [df for df in frames if df is not None]
+
+    if not frames:
+        return pd.Index([])
+
+    return pd.Index(pd.concat(frames, ignore_index=True)[DEDUPLICATION_COLS[0]])
+
+def to_digests(transaction_ids):
+    """Convert hex transaction_ids to a fixed-width array of 32-byte SHA-256 digests."""
+    return schema.ids_to_digests(transaction_ids)
+
+def load_id_index(user, segment_keys):
+    """
+    Load the sidecar transaction_id index.
+
+    The index is only trusted if its stamp matches the base master's current ETag. Otherwise, or if it does not exist yet
+    (i.e. masters written before the index was introduced), it is rebuilt from the master, see rebuild_id_index().
+
+    Returns:
+        (np.ndarray, str): sorted, unique 32-byte digests, and the base master ETag they were checked against.
+    """
+
+    # read before the index, so a base rewritten in between is caught by the next merge
+    etag = base_etag(user)
+
+    try:
+        obj = s3.get_object(Bucket=BUCKET, Key=id_index_key(user))
+        if obj.get('Metadata', {}).get(BASE_ETAG_METADATA) == etag:
+            return np.frombuffer(obj['Body'].read(), dtype="S32"), etag
+
+        logger.warning("transaction_id index is stale, the base master was rewritten since it was built. Rebuilding from master.")
+
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchKey':
+            raise
+
+        logger.warning("transaction_id index not found. Rebuilding from master.")
+
+    return rebuild_id_index(user, segment_keys, etag), etag
+
+def rebuild_id_index(user, segment_keys, etag=None):
+    """
+    Rebuild the sidecar transaction_id index from the transaction_id column of the base master and its segments.
+
+    Args:
+        etag (str, optional): ETag of the base master, read before the master is; read here if not given.
+
+    Returns:
+        np.ndarray: sorted, unique 32-byte digests.
+    """
+
+    etag = etag or base_etag(user)
+    id_index = np.unique(to_digests(load_transaction_ids(user, segment_keys)))
+
+    s3.put_object(
+        Bucket=BUCKET,
+        Key=id_index_key(user),
+        Body=id_index.tobytes(),
+        Metadata={BASE_ETAG_METADATA: etag}
+    )
+
+    logger.info(f"rebuilt transaction_id index with {len(id_index)} ids")
+    return id_index
+
+def index_contains(id_index, digests):
+    """
+    Vectorized membership test of digests against a sorted id index.
+
+    Returns:
+        np.ndarray[bool]: True where the digest is already in the index.
+    """
+
+    if len(id_index) == 0:
+        return np.zeros(len(digests), dtype=bool)
+
+    positions = np.searchsorted(id_index, digests).clip(max=len(id_index) - 1)
+    return id_index[positions] == digests
+
+def write_id_index(user, id_index, new_digests, etag):
+    """Merge new digests into the sorted id index and upload it, stamped with the base master ETag it was loaded against."""
+
+    new_digests = np.unique(new_digests)
+    merged = np.insert(id_index, np.searchsorted(id_index, new_digests), new_digests)
+
+    s3.put_object(
+        Bucket=BUCKET,
+        Key=id_index_key(user),
+        Body=merged.tobytes(),
+        Metadata={BASE_ETAG_METADATA: etag}
+    )
+
+    logger.info(f"updated transaction_id index with {len(new_digests)} new ids, {len(merged)} ids total")
+
+def stamp_id_index(user, etag):
+    """
+    Re-stamp the id index with a new base master ETag, via a server-side copy.
+    Only valid when the new base holds the same transaction_ids, i.e. after compact().
+    """
+
+    s3.copy_object(
+        Bucket=BUCKET,
+        CopySource={'Bucket': BUCKET, 'Key': id_index_key(user)},
+        Key=id_index_key(user),
+        Metadata={BASE_ETAG_METADATA: etag},
+        MetadataDirective='REPLACE'
+    )
+
+def write_segment(user, new_rows):
+    """
+    Write rows not yet present in the master as a new immutable segment.
+
+    Returns:
+        str: key of the new segment.
+    """
+
+    key = f"{segments_folder(user)}/{timestamp()}.parquet"
+    write_parquet(key, new_rows)
+
+    logger.info(f"wrote {len(new_rows)} new rows to master segment {key}")
+    return key
+
+def compact(user, segment_keys, etag):
+    """
+    Fold segments into the base master, then delete the folded segments.
+
+    The base is only rewritten if it's unchanged since etag was read; otherwise, e.g. the UI rewrote it in the meantime,
+    nothing is written, and the segments are compacted on a later merge.
+
+    Backups are handled by the caller, see backups.snapshot().
+
+    Args:
+        etag (str): ETag of the base master, as checked by load_id_index(); NO_BASE_ETAG if there was none.
+
+    Returns:
+        str: ETag of the new base master, or None if the base was rewritten since etag was read.
+        The new base holds the same transaction_ids, so the id index stays valid, see stamp_id_index().
+    """
+
+    # a base that doesn't exist yet must still not exist when it's written
+    conditions = {"IfNoneMatch": "*"} if etag == NO_BASE_ETAG else {"IfMatch": etag}
+
+    try:
+        base = None
+        if etag != NO_BASE_ETAG:
+            obj = s3.get_object(Bucket=BUCKET, Key=master_key(user), **conditions)
+            base = schema.read(obj['Body'].read())
+
+        frames = [base] + [read_parquet(key) for key in segment_keys]
+        frames = [df for df in frames if df is not None]
+
+        # base rows come first so user edits win over re-uploaded rows
+        combined = schema.concat(frames)
+        before = len(combined)
+        combined = combined.drop_duplicates(subset=DEDUPLICATION_COLS)
+        logger.info(f"Dropped {before - len(combined)} duplicate rows during compaction. Final row count: {len(combined)}")
+
+        response = s3.put_object(
+            Bucket=BUCKET,
+            Key=master_key(user),
+            Body=schema.write(combined),
+            **conditions
+        )
+
+    except ClientError as e:
+        if e.response['Error']['Code'] not in WRITE_CONFLICT_CODES + ('NoSuchKey',):
+            raise
+
+        logger.warning(f"Base master was rewritten since it was read, skipping compaction: {e}")
+        return None
+
+    delete_objects(segment_keys)
+
+    logger.info(f"compacted {len(segment_keys)} segments into master file at {master_key(user)}")
+    return response['ETag']
@@ -0,0 +1 @@
+../parse_statement/parser.py
\ No newline at end of file
@@ -0,0 +1,448 @@
+"""
+Auto-categorization rules, applied to new rows as they're merged into the master.
+
+Rules are stored per user at <user>/rules.json, next to categories.json, as a list in priority order:
+    [
+        {"category": "Groceries", "contains": "whole foods"},
+        {"category": "Rent", "regex": "^zelle to .*landlord", "max_amount": -1000},
+        {"category": "Travel", "contains": "delta air", "issuer": ["Chase Freedom Unlimited", "Amazon Visa"]}
+    ]
+
+    - category: the category to assign; required.
+    - contains: a substring of the description, case-insensitive.
+    - regex: a regex searched in the description, case-insensitive; in RE2 syntax, i.e. without lookarounds or backreferences.
+    - issuer: a statement issuer, or a list of them.
+    - min_amount, max_amount: an inclusive amount range, in dollars; expenses are negative.
+
+A rule matches a row if all of its conditions hold, and the first matching rule wins. Only uncategorized rows are categorized.
+
+Rules are compiled once per rules.json version (ETag) into a RuleSet. Contains rules are found in one pass over the batch's
+distinct descriptions, joined into one string: substrings of GRAM_LENGTH characters or more by a hash of their first
+GRAM_LENGTH characters, see gram_hashes(), the shorter ones by one regex, built from a trie of them.
+Regex rules are combined into alternations, searched with Arrow's vectorized RE2 kernel, see regex_pairs().
+The remaining conditions are then checked as arrays, over the (row, rule) pairs the descriptions allow.
+"""
+
+import re
+import json
+import boto3
+import logging
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+s3 = boto3.client('s3')
+
+BUCKET = 'aws-budget-buddy'
+DESCRIPTION_COLUMN = "description"
+AMOUNT_COLUMN = "amount"
+ISSUER_COLUMN = "statement_issuer"
+CATEGORY_COLUMN = "category"
+
+# descriptions are searched as one string, joined by a character that never appears in a contains rule
+SEPARATOR = "\n"
+
+# contains substrings at least this long are found by hashing every window of this many characters in the descriptions
+GRAM_LENGTH = 4
+GRAM_BASE = np.uint64(1_000_003)
+# windows are filtered by the low bits of their hash, in a bitmap indexed by them, before looking them up
+GRAM_FILTER_MASK = np.uint64((1 << 20) - 1)
+
+# RE2 searches an alternation with one DFA, whatever the number of regexes in it; past a few hundred regexes the DFA
+# outgrows RE2's memory budget and it falls back to a much slower NFA, so regex rules are combined in chunks of this size
+REGEX_CHUNK_SIZE = 256
+
+# rule sets are cached at module level, so they live across warm invocations; user -> (ETag, RuleSet)
+rules_cache = {}
+
+def rules_key(user):
+    return f"{user}/rules.json"
+
+def trie_pattern(literals):
+    """
+    Regex matching any of literals, built from a trie of them, so literals sharing a prefix share its comparisons.
+    At a given position, the longest literal is matched; the shorter literals it starts with are found from the trie.
+    """
+
+    trie = {}
+    for literal in literals:
+        node = trie
+        for char in literal:
+            node = node.setdefault(char, {})
+        node[""] = literal
+
+    def pattern(node):
+        branches = [re.escape(char) + pattern(child) for char, child in node.items() if char != ""]
+        if not branches:
+            return ""
+
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        return f"(?:{body})?" if "" in node else body
+
+    return pattern(trie), trie
+
+def code_points(text):
+    """Code points of text, one per character, as an np.ndarray."""
+    return np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+
+def gram_hashes(codes):
+    """
+    Polynomial hash of every GRAM_LENGTH characters window of codes, see code_points(), by its starting position.
+    Hashes wrap around in uint64; colliding windows are only candidates, which are checked against the substrings.
+    """
+
+    num_windows = max(len(codes) - GRAM_LENGTH + 1, 0)
+    hashes = np.zeros(num_windows, dtype=np.uint64)
+    for offset in range(GRAM_LENGTH):
+        hashes = hashes * GRAM_BASE + codes[offset:offset + num_windows]
+
+    return hashes
+
+def search(descriptions, regex):
+    """Whether regex is found in each of descriptions (pa.StringArray), case-insensitive; as a boolean np.ndarray."""
+    return pc.match_substring_regex(descriptions, regex, ignore_case=True).to_numpy(zero_copy_only=False)
+
+def search_any(descriptions, regexes):
+    """
+    Whether any of regexes is found in each of descriptions, searched as one alternation.
+    Alternations too large for RE2 to compile are split in two, so a chunk of long regexes never fails a merge.
+    """
+
+    try:
+        return search(descriptions, "|".join(f"(?:{regex})" for regex in regexes))
+    except pa.ArrowInvalid:
+        if len(regexes) == 1:
+            raise
+
+        half = len(regexes) // 2
+        return search_any(descriptions, regexes[:half]) | search_any(descriptions, regexes[half:])
+
+def regex_pairs(descriptions, regex_rules, row_conditions):
+    """
+    (description, rule) pairs where the rule's regex is found, with a handful of searches instead of one per rule.
+
+    Rules are searched a chunk at a time, as one alternation. Within a chunk, the rules a description matched are found by
+    bisection: halves it matches are split again, down to single rules. Halves are visited in priority order, and
+    a description is dropped once it matched a rule without row conditions, since no later rule can take precedence.
+
+    Args:
+        descriptions (pa.StringArray): descriptions to search.
+        regex_rules (dict): rule -> regex, in priority order.
+        row_conditions (np.ndarray): whether each rule has conditions other than its regex, see RuleSet.
+
+    Returns:
+        (np.ndarray, np.ndarray): positions in descriptions, and rules.
+    """
+
+    pair_positions, pair_rules = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    done = np.zeros(len(descriptions), dtype=bool)
+
+    def visit(positions, rules):
+        """Pairs for positions, which all match some rule in rules; marks positions done on a rule without row conditions."""
+
+        if len(rules) == 1:
+            pair_positions.append(positions)
+            pair_rules.append(np.full(len(positions), rules[0], dtype=np.int64))
+            if not row_conditions[rules[0]]:
+                done[positions] = True
+            return
+
+        first, second = rules[:len(rules) // 2], rules[len(rules) // 2:]
+
+        in_first = search_any(descriptions.take(positions), [regex_rules[i] for i in first])
+        if in_first.any():
+            visit(positions[in_first], first)
+
+        # positions not matching the first half match the second; the others might too, unless they are done
+        in_second = ~in_first
+        undecided = np.flatnonzero(in_first & ~done[positions])
+        if len(undecided):
+            in_second[undecided] = search_any(descriptions.take(positions[undecided]), [regex_rules[i] for i in second])
+
+        if in_second.any():
+            visit(positions[in_second], second)
+
+    rules = list(regex_rules)
+    pending = np.arange(len(descriptions))
+    for start in range(0, len(rules), REGEX_CHUNK_SIZE):
+        if not len(pending):
+            break
+
+        chunk = rules[start:start + REGEX_CHUNK_SIZE]
+        matched = search_any(descriptions.take(pending), [regex_rules[i] for i in chunk])
+        if matched.any():
+            visit(pending[matched], chunk)
+            pending = pending[~done[pending]]
+
+    return np.concatenate(pair_positions), np.concatenate(pair_rules)
+
+class RuleSet:
+    """
+    A user's rules.json, compiled for matching a batch of rows at once.
+
+    - categories, min_cents, max_cents, has_amount_range: one entry per valid rule, in priority order.
+    - issuers: rule -> allowed statement issuers, for rules with an issuer condition.
+    - gram_literals: hash of a contains substring's first GRAM_LENGTH characters -> substrings of GRAM_LENGTH characters or more starting with them.
+    - literal_pattern: regex finding the shorter contains substrings.
+    - literal_rules: contains substring -> rules it (or, if it's found by literal_pattern, a substring it starts with) is the contains condition of.
+    - regex_rules: rule -> regex, for rules with a regex condition.
+    - regex_only: rules whose only description condition is a regex, which are checked against every description.
+    - free_rules: rules without any description condition, which are checked against every row.
+    - row_conditions: whether each rule has amount or issuer conditions, which depend on the row, not just its description.
+    """
+
+    def __init__(self, rules):
+        valid = [rule for position, rule in enumerate(rules) if self.is_valid(rule, position)]
+
+        self.categories = np.array([rule["category"] for rule in valid], dtype=object)
+        self.has_amount_range = np.array([("min_amount" in rule) or ("max_amount" in rule) for rule in valid], dtype=bool)
+        # amounts are stored in cents, see master_schema.py
+        self.min_cents = np.array([round(rule["min_amount"] * 100) if "min_amount" in rule else -np.inf for rule in valid], dtype=float)
+        self.max_cents = np.array([round(rule["max_amount"] * 100) if "max_amount" in rule else np.inf for rule in valid], dtype=float)
+
+        self.issuers = {}
+        for i, rule in enumerate(valid):
+            if "issuer" in rule:
+                self.issuers[i] = frozenset([rule["issuer"]] if isinstance(rule["issuer"], str) else rule["issuer"])
+
+        self.row_conditions = self.has_amount_range | np.array([i in self.issuers for i in range(len(valid))], dtype=bool)
+
+        self.regex_rules = {i: rule["regex"] for i, rule in enumerate(valid) if "regex" in rule}
+        self.free_rules = np.array([i for i, rule in enumerate(valid) if "contains" not in rule and "regex" not in rule], dtype=np.int64)
+
+        # contains rules, by lowercased substring
+        rules_by_literal = {}
+        for i, rule in enumerate(valid):
+            if "contains" in rule:
+                rules_by_literal.setdefault(rule["contains"].lower(), []).append(i)
+
+        # every long substring found at a position is reported, so each one maps to its own rules
+        self.gram_literals = {}
+        self.literal_rules = {}
+        for literal, literal_rules in rules_by_literal.items():
+            if len(literal) >= GRAM_LENGTH:
+                self.gram_literals.setdefault(int(gram_hashes(code_points(literal[:GRAM_LENGTH]))[0]), []).append(literal)
+                self.literal_rules[literal] = np.array(literal_rules, dtype=np.int64)
+
+        self.gram_filter = np.zeros(int(GRAM_FILTER_MASK) + 1, dtype=bool)
+        self.gram_filter[np.array(list(self.gram_literals), dtype=np.uint64) & GRAM_FILTER_MASK] = True
+
+        self.literal_pattern = None
+        short_literals = {literal: rules for literal, rules in rules_by_literal.items() if len(literal) < GRAM_LENGTH}
+        if short_literals:
+            pattern, trie = trie_pattern(short_literals)
+
+            # lookahead, so every position is tried, including ones inside another match
+            self.literal_pattern = re.compile(f"(?=({pattern}))")
+
+            for literal in short_literals:
+                matched, node = [], trie
+                for char in literal:
+                    node = node[char]
+                    if "" in node:
+                        matched += short_literals[node[""]]
+                self.literal_rules[literal] = np.array(sorted(matched), dtype=np.int64)
+
+        # regex rules that also have a contains condition are only checked where the substring was found
+        self.regex_only = {i for i in self.regex_rules if "contains" not in valid[i]}
+
+    def __len__(self):
+        return len(self.categories)
+
+    @staticmethod
+    def is_valid(rule, position):
+        """Whether a rule can be compiled; invalid rules are skipped, with a warning, so they never fail a merge."""
+
+        try:
+            if not isinstance(rule.get("category"), str) or not rule["category"]:
+                raise ValueError("a category is required")
+            if "contains" in rule and (not isinstance(rule["contains"], str) or not rule["contains"] or SEPARATOR in rule["contains"]):
+                raise ValueError("contains must be a non-empty, single line string")
+            if "regex" in rule:
+                search(pa.array([""], type=pa.string()), rule["regex"])
+            if "issuer" in rule and not (isinstance(rule["issuer"], str) or all(isinstance(issuer, str) for issuer in rule["issuer"])):
+                raise ValueError("issuer must be a string, or a list of strings")
+            for key in ("min_amount", "max_amount"):
+                if key in rule and not isinstance(rule[key], (int, float)):
+                    raise ValueError(f"{key} must be a number")
+
+            return True
+
+        except (AttributeError, TypeError, ValueError, pa.ArrowException) as e:
+            logger.warning(f"Skipping rule {position} {rule}: {e}")
+            return False
+
+    def description_pairs(self, uniques):
+        """
+        (description, rule) pairs whose description conditions hold, over distinct descriptions.
+
+        Args:
+            uniques (np.ndarray): distinct lowercased descriptions.
+
+        Returns:
+            (np.ndarray, np.ndarray): positions in uniques, and rules.
+        """
+
+        pair_uniques, pair_rules = [], []
+
+        if self.literal_rules and len(uniques):
+            # one search over all descriptions, match positions are mapped back to descriptions by offset
+            text = SEPARATOR.join(uniques)
+            lengths = np.fromiter((len(description) + 1 for description in uniques), dtype=np.int64, count=len(uniques))
+            offsets = np.cumsum(lengths) - lengths
+
+            positions, literals = [], []
+            if self.gram_literals:
+                hashes = gram_hashes(code_points(text))
+                candidates = np.flatnonzero(self.gram_filter[hashes & GRAM_FILTER_MASK])
+                for position, key in zip(candidates.tolist(), hashes[candidates].tolist()):
+                    for literal in self.gram_literals.get(key, ()):
+                        if text.startswith(literal, position):
+                            positions.append(position)
+                            literals.append(literal)
+
+            if self.literal_pattern is not None:
+                for match in self.literal_pattern.finditer(text):
+                    positions.append(match.start())
+                    literals.append(match.group(1))
+
+            if positions:
+                found = pd.DataFrame({
+                    "unique": np.searchsorted(offsets, positions, side="right") - 1,
+                    "literal": literals
+                }).drop_duplicates()
+
+                for literal, rows in found.groupby("literal", sort=False)["unique"]:
+                    rules = self.literal_rules[literal]
+                    pair_uniques.append(np.repeat(rows.to_numpy(), len(rules)))
+                    pair_rules.append(np.tile(rules, len(rows)))
+
+        if pair_uniques:
+            pair_uniques, pair_rules = np.concatenate(pair_uniques), np.concatenate(pair_rules)
+        else:
+            pair_uniques, pair_rules = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        descriptions = pa.array(uniques, type=pa.string()) if self.regex_rules else None
+
+        # regex conditions of rules that also have a contains condition, on the descriptions where it was found
+        keep = np.ones(len(pair_rules), dtype=bool)
+        order = np.argsort(pair_rules, kind="stable")
+        rules, starts = np.unique(pair_rules[order], return_index=True)
+        for i, checked in zip(rules, np.split(order, starts[1:])):
+            if i in self.regex_rules:
+                keep[checked] = search(descriptions.take(pair_uniques[checked]), self.regex_rules[i])
+
+        pair_uniques, pair_rules = [pair_uniques[keep]], [pair_rules[keep]]
+
+        # regex-only rules, searched together
+        if self.regex_only:
+            regex_only = {i: regex for i, regex in self.regex_rules.items() if i in self.regex_only}
+            positions, rules = regex_pairs(descriptions, regex_only, self.row_conditions)
+            pair_uniques.append(positions)
+            pair_rules.append(rules)
+
+        return np.concatenate(pair_uniques), np.concatenate(pair_rules)
+
+    def match(self, df):
+        """
+        The first matching rule for each row of df.
+
+        Returns:
+            np.ndarray: a rule per row, in df order; len(self) for rows no rule matches.
+        """
+
+        num_rows = len(df)
+        best = np.full(num_rows, len(self), dtype=np.int64)
+        if not len(self) or not num_rows:
+            return best
+
+        codes, uniques = pd.factorize(df[DESCRIPTION_COLUMN].astype(object).str.lower())
+        uniques = np.asarray(uniques, dtype=object)
+        pair_uniques, pair_rules = self.description_pairs(uniques)
+
+        # expand (description, rule) pairs to (row, rule) pairs, via rows grouped by description
+        order = np.argsort(codes, kind="stable")
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        starts = np.cumsum(counts) - counts + (codes < 0).sum()
+
+        repeats = counts[pair_uniques]
+        within = np.arange(repeats.sum()) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        rows = order[np.repeat(starts[pair_uniques], repeats) + within]
+        rules = np.repeat(pair_rules, repeats)
+
+        # rules without description conditions apply to every row
+        if len(self.free_rules):
+            rows = np.concatenate([rows, np.tile(np.arange(num_rows), len(self.free_rules))])
+            rules = np.concatenate([rules, np.repeat(self.free_rules, num_rows)])
+
+        # amount and issuer conditions, for all pairs at once
+        amounts = df[AMOUNT_COLUMN].to_numpy(dtype=float, na_value=np.nan)[rows]
+        ok = ~self.has_amount_range[rules] | ((amounts >= self.min_cents[rules]) & (amounts <= self.max_cents[rules]))
+
+        if self.issuers:
+            issuer_codes, issuer_uniques = pd.factorize(df[ISSUER_COLUMN].astype(object))
+            allowed = np.ones((len(self), len(issuer_uniques) + 1), dtype=bool)
+            for i, issuers in self.issuers.items():
+                # the last column stands for rows without an issuer, which issuer conditions never match
+                allowed[i] = [issuer in issuers for issuer in issuer_uniques] + [False]
+            ok &= allowed[rules, issuer_codes[rows]]
+
+        np.minimum.at(best, rows[ok], rules[ok])
+        return best
+
+    def apply(self, df):
+        """
+        Categorize df's uncategorized rows that match a rule.
+
+        Returns:
+            (pd.DataFrame, int): df with categories filled in, and the number of rows categorized.
+        """
+
+        uncategorized = df[CATEGORY_COLUMN].isna().to_numpy()
+        best = self.match(df[uncategorized])
+        matched = best < len(self)
+
+        if not matched.any():
+            return df, 0
+
+        categories = df[CATEGORY_COLUMN].astype(object).to_numpy(copy=True)
+        categories[np.flatnonzero(uncategorized)[matched]] = self.categories[best[matched]]
+
+        return df.assign(**{CATEGORY_COLUMN: pd.Series(categories, index=df.index, dtype="category")}), int(matched.sum())
+
+def get_rules(user):
+    """
+    Returns the user's rules, compiled, from the warm cache when rules.json hasn't changed.
+    Rules are optional, and never fail a merge: without rules.json, or if it can't be read, no rule applies.
+    """
+
+    cached = rules_cache.get(user)
+
+    try:
+        kwargs = {"IfNoneMatch": cached[0]} if cached else {}
+        obj = s3.get_object(Bucket=BUCKET, Key=rules_key(user), **kwargs)
+        rule_set = RuleSet(json.loads(obj['Body'].read().decode('utf-8')))
+        rules_cache[user] = (obj["ETag"], rule_set)
+        logger.info(f"Compiled {len(rule_set)} rules for {user}")
+
+    except ClientError as e:
+        code = e.response['Error']['Code']
+        if code in ('304', 'NotModified'):
+            return cached[1]
+
+        rules_cache.pop(user, None)
+        if code != 'NoSuchKey':
+            logger.warning(f"Failed to load rules for {user}, no rules applied: {e}")
+        return RuleSet([])
+
+    except Exception as e:
+        logger.warning(f"Failed to load rules for {user}, no rules applied: {e}")
+        return RuleSet([])
+
+    return rule_set
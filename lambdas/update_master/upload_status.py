@@ -0,0 +1 @@
+../parse_statement/upload_status.py
\ No newline at end of file
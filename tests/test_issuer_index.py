@@ -0,0 +1,24 @@
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambdas", "parse_statement"))
+from issuer_index import IssuerIndex, parse_header
+
+with open(os.path.join(os.path.dirname(__file__), "..", "issuers.json")) as f:
+    ISSUERS = json.load(f)
+
+def test_routes_exact_header():
+    index = IssuerIndex(ISSUERS)
+    assert index.candidates(parse_header("Details,Posting Date,Description,Amount,Type,Balance")) == ["Chase Debit"]
+
+def test_case_mismatch_is_not_routed():
+    # parse() reads the config's exact column names, so a lowercased header must not be routed to the config
+    index = IssuerIndex(ISSUERS)
+    assert index.candidates(parse_header("posting date,description,amount")) == []
+    assert index.candidates(parse_header(" Posting Date,Description,Amount")) == []
+
+def test_case_mismatch_is_not_memoized_as_a_match():
+    index = IssuerIndex(ISSUERS)
+    assert index.candidates(["Posting Date", "Description", "Amount"]) == ["Chase Debit"]
+    assert index.candidates(["POSTING DATE", "DESCRIPTION", "AMOUNT"]) == []
@@ -2,48 +2,103 @@
 contains all config settings that are general across all users
 '''
 
+import os
 import json
-import boto3
+import logging
 import streamlit as st
 
+logger = logging.getLogger(__name__)
+
 # AWS General
 S3_BUCKET = "aws-budget-buddy"
 AWS_ACCESS_KEY_ID = st.secrets["aws"]["AWS_ACCESS_KEY_ID"]
 AWS_SECRET_ACCESS_KEY = st.secrets["aws"]["AWS_SECRET_ACCESS_KEY"]
 AWS_REGION = st.secrets["aws"]["AWS_REGION"]
 UPLOAD_STATE_MACHINE = "arn:aws:states:us-west-2:676206945006:stateMachine:handle_new_statement"
+UPDATE_MASTER_LAMBDA = "update_master"
+RECORD_EDITS_ACTION = "record_edits"  # must match lambdas/update_master/lambda_function.py
+
+# synchronous Lambda invocations wait out the function, so the client's read timeout must exceed the Lambda timeout
+# 900s is the maximum Lambda timeout; retries are disabled, as a retried invocation would run the function again
+LAMBDA_TIMEOUT_SECONDS = 900
+LAMBDA_CLIENT_CONFIG = {"read_timeout": LAMBDA_TIMEOUT_SECONDS + 30, "retries": {"max_attempts": 0}}
+
+# S3 error codes of a conditional write whose precondition failed, or that raced another conditional write
+S3_WRITE_CONFLICT_CODES = ("PreconditionFailed", "ConditionalRequestConflict", "412", "409")
+
+# if enabled, single statement uploads are parsed and merged in one update_master invocation (fused mode)
+# the UPLOAD_STATE_MACHINE is the fallback, for statements over FUSED_UPLOAD_MAX_BYTES or if the fused invocation can't run
+# off by default, compare both modes with benchmarks/upload_latency.py before enabling it
+FUSED_UPLOADS = False
+FUSED_UPLOAD_MAX_BYTES = 20 * 1024 * 1024
+
+# boto3 clients and resources
+# these are constructed lazily on first use and shared across sessions,
+# so importing config (and starting the app) costs no AWS round trips
+# config holds botocore Config options, e.g. LAMBDA_CLIENT_CONFIG
+# Config rewrites its retries option in place, so it's given a copy; otherwise the cache key would change after the first call
+@st.cache_resource
+def get_client(service, **config):
+    import copy
+    import boto3
+    from botocore.config import Config
+
+    config = copy.deepcopy(config)
+
+    return boto3.client(
+        service,
+        aws_access_key_id=AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+        region_name=AWS_REGION,
+        config=Config(**config) if config else None
+    )
+
+@st.cache_resource
+def get_resource(service):
+    import boto3
 
-# boto3 clients
-logs = boto3.client(
-    "logs",
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_REGION
-)
-
-s3 = boto3.client(
-    "s3",
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_REGION
-)
-
-sf = boto3.client(
-    "stepfunctions",
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_REGION
-)
+    return boto3.resource(
+        service,
+        aws_access_key_id=AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+        region_name=AWS_REGION
+    )
 
 # ISSUERS
+# issuers are refreshed from S3 every ISSUERS_TTL_SECONDS, without an app restart
+# the copy of issuers.json bundled with the repo is used when S3 is unavailable
 ISSUERS_KEY = 'src/issuers.json'
-try:
-    config_obj = s3.get_object(Bucket=S3_BUCKET, Key=ISSUERS_KEY)
-    config_data = config_obj['Body'].read().decode('utf-8')
-    ISSUERS = json.loads(config_data)
-except Exception as e:
-    ISSUERS = {}
-KNOWN_ISSUERS = list(ISSUERS.keys())
+ISSUERS_TTL_SECONDS = 300
+BUNDLED_ISSUERS_PATH = os.path.join(os.path.dirname(__file__), "..", "issuers.json")
+
+@st.cache_data(ttl=ISSUERS_TTL_SECONDS, show_spinner=False)
+def get_issuers():
+    # the bundled fallback is cached too, so an S3 outage costs one failed request per TTL, not one per access
+    try:
+        config_obj = get_client("s3").get_object(Bucket=S3_BUCKET, Key=ISSUERS_KEY)
+        return json.loads(config_obj['Body'].read().decode('utf-8'))
+
+    except Exception as e:
+        logger.warning(f"Failed to load {ISSUERS_KEY} from S3, using bundled issuers: {e}")
+
+        with open(BUNDLED_ISSUERS_PATH) as f:
+            return json.load(f)
+
+# module attributes resolved lazily, on first access (PEP 562)
+# allows existing call sites to keep using c.s3, c.sf, c.ISSUERS and c.KNOWN_ISSUERS
+LAZY_ATTRIBUTES = {
+    "s3": lambda: get_client("s3"),
+    "sf": lambda: get_client("stepfunctions"),
+    "aws_lambda": lambda: get_client("lambda", **LAMBDA_CLIENT_CONFIG),
+    "ISSUERS": get_issuers,
+    "KNOWN_ISSUERS": lambda: list(get_issuers().keys()),
+}
+
+def __getattr__(name):
+    if name in LAZY_ATTRIBUTES:
+        return LAZY_ATTRIBUTES[name]()
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # free/premiun tier settings
 # note: premium override key in secrets.toml exists
@@ -72,9 +127,12 @@ PREFERRED_UI_DATE_FORMAT_MOMENTJS = "dddd, MMMM DD, YYYY"
 PREFERRED_UI_DATE_FORMAT_STRFTIME = "%A, %B %d, %Y"
 FILTER_PLACEHOLDER_TEXT = "No filter is applied when there is no input."
 FILE_UPLOADER_HELP_TEXT = "Statements uploaded remain encrypted at all times."
+NEW_ISSUER_NOTICE = "New issuer! Its date, description and amount columns will be detected from your statement."
 ASSETS_PATH = "ui/assets"
 LOGOUT_BUTTON_KEY_NAME = "logout_button"
 TYPING_ANIMATION_DELAY = 0.001  # seconds
+BACKUP_TIMESTAMP_FORMAT = "%Y-%m-%dT%H-%M-%S-%f" # UTC, must match lambdas/update_master/master_store.py
+MAX_MASTER_EDIT_LOGS = 20  # edit logs are compacted into the base master once this many accumulate
 
 # tab settings
 GET_PREMIUM_TAB_NAME = "Get Premium"
@@ -121,6 +179,8 @@ GROUP_BY_COLUMN = "group_by"
 EDITING_NOT_ALLOWED_TEXT = "Editing is not allowed here! It breaks deduplication logic. 🤭"
 SELECTION_PROMPT = "To get started, make a selection."
 OUTDATED_CATEGORY_LABEL_PREFIX = "OUTDATED CATEGORY:"
+CATEGORIZE_PAGE_SIZES = [25, 50, 100, 250, 500]
+DEFAULT_CATEGORIZE_PAGE_SIZE = 100
 
 # note: CATEGORY_COLUMN and ISSUER_COLUMN config is added right before st.data_editor() is invoked
 # this is because it relies on user specific data
@@ -142,6 +202,7 @@ column_configs = {
         width=None
     ),
 
+    # master amounts are integer cents, the categorize view converts them to dollars for display
     AMOUNT_COLUMN: st.column_config.NumberColumn(
         label="Amount",
         format="dollar",
@@ -199,10 +260,3 @@ LAMBDAS = {
         "error": "🔴 Something went wrong while updating your master file. 😔"
     }
 }
-
-UPLOAD_STATE_MACHINE_TERMINAL_STATES = [
-    "SUCCEEDED",
-    "FAILED",
-    "TIMED OUT",
-    "ABORTED"
-]
\ No newline at end of file
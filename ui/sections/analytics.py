@@ -4,7 +4,7 @@ import streamlit as st
 import utils.css as css
 import utils.helpers as h
 import utils.plotters as p
-from datetime import timedelta as td
+from utils.analytics_cube import AnalyticsCube
 
 def show_analytics():
     # ensure master data is loaded
@@ -24,8 +24,12 @@ def show_analytics():
         default = "Trailing 3 Months"
     )
 
-    min_date_in_master = master[c.DATE_COLUMN].min()
-    max_date_in_master = master[c.DATE_COLUMN].max()
+    # daily totals per category, aggregated once per master version
+    # every time range and category selection is answered from the cube, without rescanning master
+    cube = h.cached_for_master("analytics_cube", AnalyticsCube)
+
+    min_date_in_master = cube.min_date
+    max_date_in_master = cube.max_date
 
     start, end = None, None
     if time_range == "All Time":
@@ -52,15 +56,9 @@ def show_analytics():
         start = pd.Timestamp(start)
         end = pd.Timestamp(end)
 
-        # prepare analysis dataframe
-        # copy to avoid modifying the original master DataFrame
-        # without copy, Pandas raises a SettingWithCopyWarning 
-        # and behavior can be unpredictable 
-        analyze = master[
-            master[c.DATE_COLUMN].between(start, end) &
-            master[c.CATEGORY_COLUMN].notna() &
-            ~master[c.CATEGORY_COLUMN].isin(st.session_state.user.NON_EXPENSES_CATEGORIES)
-        ].copy()
+        # prepare analysis window of daily totals
+        model = st.session_state.user.category_model
+        analyze = cube.window(start, end, exclude=model.categories_of(c.NON_EXPENSES_PARENT_CATEGORY_KEY))
 
         st.markdown(f":orange-badge[:material/date_range: {start.strftime(c.PREFERRED_UI_DATE_FORMAT_STRFTIME)} - {end.strftime(c.PREFERRED_UI_DATE_FORMAT_STRFTIME)}]")
 
@@ -71,27 +69,15 @@ def show_analytics():
         css.header("*Deep Dives by Category*", lvl=5)
         filtered_categories = st.multiselect(
             label = "Filter by category",
-            options = [cat for cat in st.session_state.user.CATEGORIES if cat not in st.session_state.user.NON_EXPENSES_CATEGORIES], 
+            options = [cat for cat in model.categories if not model.is_under(cat, c.NON_EXPENSES_PARENT_CATEGORY_KEY)], 
             default = None,
             placeholder = c.SELECTION_PROMPT,
             label_visibility ='collapsed'
         )
 
         if filtered_categories:
-            if (end - start) > td(days=60):
-                # group by month
-                analyze[c.GROUP_BY_COLUMN] = analyze[c.DATE_COLUMN].values.astype("datetime64[M]")
-            elif (end - start) > td(days=15):
-                # group by week
-                analyze[c.GROUP_BY_COLUMN] = analyze[c.DATE_COLUMN].apply(lambda x: x - td(days=x.weekday()))
-            else:
-                # group by day
-                analyze[c.GROUP_BY_COLUMN] = analyze[c.DATE_COLUMN]
-
-            x_values = sorted(analyze[c.GROUP_BY_COLUMN].unique())
-
-            grouped = analyze.groupby([c.CATEGORY_COLUMN, c.GROUP_BY_COLUMN])[c.AMOUNT_COLUMN].sum().abs().reset_index()
-            filtered = grouped[grouped[c.CATEGORY_COLUMN].isin(filtered_categories)]
+            # grouped by month, week or day, depending on the length of the time range
+            filtered = cube.rollup(analyze, start, end, filtered_categories)
 
             # build Python‐datetime tick list
             raw_vals = sorted(filtered[c.GROUP_BY_COLUMN].unique())
@@ -103,5 +89,5 @@ def show_analytics():
             )
 
         css.header("*Cashflow At A Glance*", lvl=5)
-        st.plotly_chart(p.sankey(analyze), use_container_width=True)
+        st.plotly_chart(p.sankey(cube.category_totals(analyze)), use_container_width=True)
 
@@ -1,9 +1,12 @@
+import math
 import traceback
 import config as c
 import pandas as pd
 import streamlit as st
 import utils.css as css
 import utils.helpers as h
+import utils.master_schema as schema
+from utils.filters import get_filter_index
 
 def show_categorize():
     # ensure master data is loaded
@@ -19,8 +22,10 @@ def show_categorize():
         return 
     
     try:
-        uncategorized = master[master[c.CATEGORY_COLUMN].isna()]
-        TBD = master[(master[c.CATEGORY_COLUMN] == "TBD")]
+        # indexes are rebuilt only when master changes, so filtering stays interactive on every rerun
+        filter_index = get_filter_index()
+        num_uncategorized = filter_index.num_uncategorized()
+        num_TBD = filter_index.num_in_categories(["TBD"])
 
         with st.expander("Apply filters", icon=":material/tune:"):
             # date filter
@@ -63,8 +68,8 @@ def show_categorize():
             st.divider()
             css.markdown(css.underline("*Amount*", thickness="1px"))
             range_step = 10
-            min_amount_in_master = int(master[c.AMOUNT_COLUMN].min() - range_step)
-            max_amount_in_master = int(master[c.AMOUNT_COLUMN].max() + range_step)
+            min_amount_in_master = int(master[c.AMOUNT_COLUMN].min() / schema.CENTS - range_step)
+            max_amount_in_master = int(master[c.AMOUNT_COLUMN].max() / schema.CENTS + range_step)
 
             css.empty_space()
 
@@ -93,9 +98,10 @@ def show_categorize():
             st.divider()
             css.markdown(css.underline("*Category*", thickness="1px"))
 
-            # identify outdated categories; dropna() is used to exclude None
-            outdated_categories = list(set(master[c.CATEGORY_COLUMN].dropna().unique()) - set(st.session_state.user.CATEGORIES))
-            categories_including_outdated = st.session_state.user.CATEGORIES + outdated_categories
+            # identify outdated categories; the index's categories exclude None
+            model = st.session_state.user.category_model
+            outdated_categories = [cat for cat in filter_index.categories if cat not in model.category_set]
+            categories_including_outdated = model.categories + outdated_categories
 
             UNCATEGORIZED_PILL_NAME = "Show Uncategorized Only"
             OUTDATED_CATEGORIES_PILL_NAME = "Filter by Outdated Categories"
@@ -104,12 +110,12 @@ def show_categorize():
             # 1. OUTDATED_CATEGORIES_PILL_NAME
             # 2. UNCATEGORIZED_PILL_NAME 
             # 3. None
-            default = OUTDATED_CATEGORIES_PILL_NAME if outdated_categories else UNCATEGORIZED_PILL_NAME if not(uncategorized.empty) else None
+            default = OUTDATED_CATEGORIES_PILL_NAME if outdated_categories else UNCATEGORIZED_PILL_NAME if num_uncategorized else None
             
             # show quick filter pills, if applicable
             options = []
             category_pill = None
-            options += [UNCATEGORIZED_PILL_NAME] if not(uncategorized.empty) else [] 
+            options += [UNCATEGORIZED_PILL_NAME] if num_uncategorized else [] 
             options += [OUTDATED_CATEGORIES_PILL_NAME] if outdated_categories else []
             if options:
                 category_pill = st.pills(
@@ -122,7 +128,7 @@ def show_categorize():
             if category_pill == UNCATEGORIZED_PILL_NAME:
                 # technically no options are required since the widget is disabled
                 # but Streamlit has a minor bug where the passed placeholder str is not used if len(options) == 0
-                options = st.session_state.user.CATEGORIES
+                options = model.categories
                 default = None
                 disabled = True
                 placeholder = "Filtering for uncategorized expenses."
@@ -134,8 +140,8 @@ def show_categorize():
                 placeholder = c.FILTER_PLACEHOLDER_TEXT
 
             else:
-                options = st.session_state.user.CATEGORIES
-                default = ["TBD"] if not(TBD.empty) else None
+                options = model.categories
+                default = ["TBD"] if num_TBD else None
                 disabled = False
                 placeholder = c.FILTER_PLACEHOLDER_TEXT
 
@@ -157,31 +163,22 @@ def show_categorize():
                 label = "notes", 
             ) 
 
-        date_filter = master[c.DATE_COLUMN].between(min_date, max_date)
-        description_filter = master[c.DESCRIPTION_COLUMN].str.contains(description_filter_setting, case=False, na=False) if description_filter_setting else True
-        amount_filter = master[c.AMOUNT_COLUMN].between(min_amount, max_amount)
-        issuer_filter = master[c.ISSUER_COLUMN].isin(filtered_issuers) if filtered_issuers else True
-        notes_filter = master[c.NOTES_COLUMN].str.contains(notes_filter_setting, case=False, na=False) if notes_filter_setting else True
-
-        # this logic controls category_filter for the st.data_editor() widget
-        if category_pill == UNCATEGORIZED_PILL_NAME:
+        positions = filter_index.filter(
+            min_date, max_date,
+            min_amount, max_amount,
+            issuers=filtered_issuers,
+            categories=filtered_categories,
             # if user explicitly filters for UNCATEGORIZED_PILL_NAME, respond accordingly
-            category_filter = master[c.CATEGORY_COLUMN].isna()
-        else:
-            if filtered_categories:
-                # if the user provided filtered_categories,
-                # or, filter category section logic injected default values, then apply filters.
-                category_filter = master[c.CATEGORY_COLUMN].isin(filtered_categories)
-            else:
-                # this is the path where no category filters have been applied
-                # however, no selection == no filter
-                category_filter = True         
-
-        display_df = master[date_filter & description_filter & amount_filter & issuer_filter & category_filter & notes_filter]
-        
-        n1 = len(uncategorized)
-        n2 = len(TBD)
-        n3 = len(master[master[c.CATEGORY_COLUMN].isin(outdated_categories)])
+            uncategorized=category_pill == UNCATEGORIZED_PILL_NAME,
+            description=description_filter_setting,
+            notes=notes_filter_setting
+        )
+
+        display_df = master.iloc[positions]
+
+        n1 = num_uncategorized
+        n2 = num_TBD
+        n3 = filter_index.num_in_categories(outdated_categories)
         if n1 or n2 or n3:
             msg = f"""
                 {f"{n1} transaction{'s' if n1 > 1 else ''} need{'s' if n1 == 1 else ''} to be categorized.  " if n1 > 0 else ""}
@@ -222,30 +219,79 @@ def show_categorize():
         c.column_configs[c.ISSUER_COLUMN] = st.column_config.SelectboxColumn(
             label="Statement Issuer",
             width="medium",
-            options=master[c.ISSUER_COLUMN].unique().tolist(),
+            options=filter_index.issuers.tolist(),
+        )
+
+        # only one page of display_df is sent to the browser, so the payload doesn't grow with master
+        page_size_col, page_col, _ = st.columns([1, 1, 4])
+        page_size = page_size_col.selectbox(
+            options=c.CATEGORIZE_PAGE_SIZES,
+            index=c.CATEGORIZE_PAGE_SIZES.index(c.DEFAULT_CATEGORIZE_PAGE_SIZE),
+            key="categorize_page_size",
+            label="Rows per page",
+        )
+
+        # unkeyed, so the page resets to 1 whenever the number of pages changes
+        num_pages = max(math.ceil(len(display_df) / page_size), 1)
+        page = page_col.number_input(
+            min_value=1,
+            max_value=num_pages,
+            value=1,
+            label=f"Page (of {num_pages})",
         )
 
-        display_df = master[date_filter & description_filter & amount_filter & issuer_filter & category_filter & notes_filter]
+        page_df = display_df.iloc[(page - 1) * page_size : page * page_size]
 
+        # unsaved edits are buffered per cell, as (transaction_id, column) -> value,
+        # so they survive page switches and filter changes until saved
+        pending_edits = st.session_state.setdefault("pending_edits", {})
+        page_ids = set(page_df[c.TRANSACTION_ID_COLUMN])
+        page_pending = [(tid, col, value) for (tid, col), value in pending_edits.items() if tid in page_ids]
+
+        # categoricals are shown as plain values, so the editor can set categories that aren't in the column's categories yet
+        # amounts are shown, and edited, in dollars
+        page_df = page_df.astype({c.CATEGORY_COLUMN: object, c.ISSUER_COLUMN: object})
+        page_df = page_df.assign(**{c.AMOUNT_COLUMN: schema.to_dollars(page_df[c.AMOUNT_COLUMN])})
+
+        shown_df = page_df.copy()
+        if page_pending:
+            schema.apply_edits(shown_df, pd.DataFrame(page_pending, columns=schema.EDIT_COLUMNS))
+
+        # keyed by the page's rows, so the editor's state never carries over to another page;
+        # with a key and fixed rows, re-showing buffered edits doesn't reset the editor
         edited = st.data_editor(
-            display_df,
+            shown_df,
+            key=f"categorize_editor_{hash(frozenset(page_ids))}",
             use_container_width=True,
             num_rows="fixed",
             hide_index=True,
             column_config=c.column_configs
         )
 
+        # the editor holds every edit made on this page, so it replaces the page's buffered edits
+        for tid, col, _ in page_pending:
+            del pending_edits[(tid, col)]
+
+        page_edits = h.diff_edits(page_df, edited)
+        pending_edits.update({(tid, col): value for tid, col, value in page_edits.itertuples(index=False)})
+
+        if pending_edits:
+            st.caption(f"{len(pending_edits)} unsaved edit{'s' if len(pending_edits) > 1 else ''}.")
+
         if st.button("💾 Save Changes"):
-            # Update original master with edited categories
-            for col in edited.columns:
-                master.loc[edited.index, col] = edited[col]
+            # only the cells the user actually changed are saved, as an edit log
+            edits = pd.DataFrame(
+                [(tid, col, value) for (tid, col), value in pending_edits.items()],
+                columns=[c.TRANSACTION_ID_COLUMN, "column", "value"]
+            )
 
-            # upload updated master to S3
-            st.session_state.user.update_master(master)
-            
+            if not edits.empty:
+                st.session_state.user.save_edits(edits)
+
+            pending_edits.clear()
             h.save_toast()
 
-            # force reload master data
+            # reload master data; the saved edits are already applied, so this only picks up new segments
             st.session_state.user.load_master()
             st.rerun()
 
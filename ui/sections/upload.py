@@ -1,11 +1,20 @@
-import time 
+import time
 import json
+import uuid
 import random
 import traceback
 import config as c
+import pandas as pd
 import streamlit as st
 import utils.helpers as h
+from functools import partial
 from datetime import datetime, timezone
+from utils.executions import get_tracker
+from utils.issuer_index import IssuerIndex, parse_header
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# multi-file uploads push files and poll their status objects concurrently, from a pool of this size
+UPLOAD_WORKERS = 8
 
 def show_upload():
     # ensure master data is loaded
@@ -14,15 +23,16 @@ def show_upload():
     master = st.session_state.user.master
 
     st.header("🗂️ Upload Statements")
-    
+
     if h.user_is_premium():
         # never impose upload limits on premium users
         disabled = False
+        num_remaining_uploads = None
     else:
         # show statement processing limit notice if free-tier
         num_uploads = getattr(st.session_state.user, 'num_uploads', 0)
         num_remaining_uploads = c.MAX_FREE_STATEMENT_UPLOADS - num_uploads
-        
+
         # evaluate if file uploading should be disabled
         if num_remaining_uploads <= 0:
             st.error(f"You can only process {c.MAX_FREE_STATEMENT_UPLOADS} statements on the free tier. Upgrade to premium!", icon="🚫")
@@ -31,81 +41,368 @@ def show_upload():
             st.warning(f"You can process {num_remaining_uploads} more statements.")
             disabled = False
 
-    file = st.file_uploader("Upload CSV File", type=["csv"], on_change=h.clear_issuer_selection, help=c.FILE_UPLOADER_HELP_TEXT, disabled=disabled)
-    
-    issuer_disabled = disabled or not file
-    issuer_placeholder = "Upload a statement first." if file is None else "Select the issuer for this statement; or add a new one."
+    files = st.file_uploader(
+        "Upload CSV Files",
+        type=["csv"],
+        accept_multiple_files=True,
+        on_change=h.clear_issuer_selection,
+        help=c.FILE_UPLOADER_HELP_TEXT,
+        disabled=disabled
+    )
+
+    issuer_disabled = disabled or not files
+    issuer_placeholder = "Upload a statement first." if not files else "Detected per statement; or select the issuer for all of them, or add a new one."
     issuer = st.selectbox(
         "Select Issuer",
-        c.KNOWN_ISSUERS, 
-        index=None, 
-        key="issuer", 
-        disabled=issuer_disabled, 
-        accept_new_options=True, 
+        c.KNOWN_ISSUERS,
+        index=None,
+        key="issuer",
+        disabled=issuer_disabled,
+        accept_new_options=True,
         placeholder=issuer_placeholder
     )
 
     if issuer is not None and issuer not in c.KNOWN_ISSUERS:
-        # logic to follow
-        st.write("🆕 New Issuer")
+        # parse_statement infers new issuers' date, description and amount columns from the statement itself
+        st.info(c.NEW_ISSUER_NOTICE, icon="🆕")
+
+    if not files or disabled:
+        return
 
-    if file and issuer:
+    if num_remaining_uploads is not None and len(files) > num_remaining_uploads:
+        st.error(f"You selected {len(files)} statements, but can only process {num_remaining_uploads} more on the free tier.", icon="🚫")
+        return
+
+    # without a selected issuer, each statement is routed to an issuer by its header
+    issuers = route_statements(files) if issuer is None else [issuer] * len(files)
+    if not all(issuers):
+        st.warning("Some statements weren't recognized. Pick their issuers above, or select the issuer for all of them.")
+        return
+
+    if len(files) == 1:
         if st.button("📤 Upload Statement"):
-            upload_s = time.time()
-            formatted_time = datetime.fromtimestamp(upload_s, tz=timezone.utc).strftime("%Y-%m-%dT%H-%M-%S-%f")
+            upload_statement(files[0], issuers[0])
+
+    elif st.button(f"📤 Upload {len(files)} Statements"):
+        upload_statements(files, issuers)
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def get_issuer_index(issuers_json):
+    """Issuer index for a registry, built once per registry version; issuers are passed as JSON, so they're hashable."""
+    return IssuerIndex(json.loads(issuers_json))
+
+def route_statements(files):
+    """
+    Route each statement to an issuer by its header line, see utils/issuer_index.py.
+    Routed issuers are shown in an editable table, so they can be corrected per statement before uploading,
+    either to a known issuer or to a new one, typed in; a new issuer's columns are detected from its statement.
+
+    Returns:
+        list: an issuer per file; None for statements that weren't recognized, and weren't assigned one.
+    """
+
+    index = get_issuer_index(json.dumps(c.ISSUERS, sort_keys=True))
+
+    # between issuers with the same columns, prefer ones the user already has statements from
+    master = st.session_state.user.master
+    preferred = master[c.ISSUER_COLUMN].dropna().unique().tolist() if master is not None else []
+
+    routed = []
+    for file in files:
+        candidates = index.candidates(parse_header(file.readline()), preferred=preferred)
+        file.seek(0)
+        routed.append(candidates[0] if candidates else None)
+
+    routing = st.data_editor(
+        pd.DataFrame({"Statement": [file.name for file in files], "Issuer": routed, "New Issuer": [None] * len(files)}),
+        # keyed by the uploaded files, so corrections reset when the upload changes
+        key=f"issuer_routing_{hash(tuple(file.file_id for file in files))}",
+        use_container_width=True,
+        num_rows="fixed",
+        hide_index=True,
+        column_config={
+            "Statement": st.column_config.TextColumn(label="Statement", disabled=True),
+            "Issuer": st.column_config.SelectboxColumn(label="Issuer", options=c.KNOWN_ISSUERS),
+            "New Issuer": st.column_config.TextColumn(
+                label="New Issuer",
+                help="For issuers that aren't listed, type a name. It overrides the selected issuer.",
+                validate=r"^[^/]*$"
+            ),
+        }
+    )
+
+    # issuers name S3 folders, see upload_statement(), so new issuers can't contain "/"
+    new_issuers = [issuer.strip() if isinstance(issuer, str) and "/" not in issuer else "" for issuer in routing["New Issuer"]]
+    issuers = [new or (issuer if isinstance(issuer, str) else None) for new, issuer in zip(new_issuers, routing["Issuer"])]
+
+    if any(new and new not in c.KNOWN_ISSUERS for new in new_issuers):
+        st.info(c.NEW_ISSUER_NOTICE, icon="🆕")
+
+    return issuers
+
+def upload_statement(file, issuer):
+    """Upload a single statement, and process it in fused mode when enabled, otherwise through the state machine."""
+
+    upload_s = time.time()
+    formatted_time = datetime.fromtimestamp(upload_s, tz=timezone.utc).strftime("%Y-%m-%dT%H-%M-%S-%f")
+
+    new_statement_key = f"{st.session_state.user.STATEMENTS_FOLDER}/{issuer}/{issuer}_statement_{formatted_time}.csv"
+
+    with st.status("Uploading to cloud...", expanded=True) as status:
+        try:
+            c.s3.upload_fileobj(file, c.S3_BUCKET, new_statement_key)
+            st.write("🟢 Uploaded to cloud ☁️")
+        except Exception as e:
+            status.update(label="Upload failed", state="error")
+            st.error(f"🔴 Upload failed: {e}")
+            st.code(traceback.format_exc())
+            st.stop()
+
+        fused = c.FUSED_UPLOADS and file.size <= c.FUSED_UPLOAD_MAX_BYTES
+        if not (fused and process_statement_fused(new_statement_key, status)):
+            process_statement(new_statement_key, status)
+
+        status.update(label="done!", state="complete", expanded=False)
+
+        # increment num_uploads counter
+        st.session_state.user.update_num_uploads()
+
+        # update master contents
+        st.session_state.user.load_master()
+
+def process_statement_fused(statement_key, status):
+    """
+    Parse and merge a statement in a single update_master invocation, see FUSED_UPLOADS in config.py.
+
+    Returns:
+        True once the statement is merged.
+        False if the fused invocation couldn't run, e.g. it crashed or timed out, so the caller falls back to the state machine;
+        merges are idempotent, so a fallback after a partial merge only skips the already added rows.
+
+    The script is stopped if the statement failed to process.
+    """
+
+    h.animate_typing(random.choice(c.LAMBDAS["parse_statement"]["progress"]))
+
+    try:
+        response = c.aws_lambda.invoke(
+            FunctionName=c.UPDATE_MASTER_LAMBDA,
+            Payload=json.dumps({"body": {"statement_key": statement_key, "fused": True}})
+        )
+        result = json.loads(response["Payload"].read())
+    except Exception:
+        return False
+
+    if "FunctionError" in response:
+        return False
+
+    if result.get("statusCode") != 200:
+        status.update(label="Processing failed", state="error")
+        st.error(f"{c.LAMBDAS['parse_statement']['error']} {json.loads(result.get('body', '{}')).get('error', '')}")
+        st.stop()
+
+    st.write(c.LAMBDAS["parse_statement"]["success"])
+    st.write(c.LAMBDAS[c.UPDATE_MASTER_LAMBDA]["success"])
+
+    return True
+
+def process_statement(statement_key, status):
+    """Run an uploaded statement through the state machine, and follow its execution step by step."""
+
+    # Lambda functions report their result to this status object
+    status_key = f"{st.session_state.user.STATUS_FOLDER}/{uuid.uuid4()}.json"
+    input_payload = {"key": statement_key, "status_key": status_key}
+    response = c.sf.start_execution(
+        stateMachineArn=c.UPLOAD_STATE_MACHINE,
+        input=json.dumps(input_payload)
+    )
 
-            new_statement_key = f"{st.session_state.user.STATEMENTS_FOLDER}/{issuer}/{issuer}_statement_{formatted_time}.csv"
+    execution_arn = response["executionArn"]
+    tracker = get_tracker(execution_arn)
+    completed_reference = None
+    used_msgs = set()
+    msg = None
+
+    # the tracker only fetches new history events, and adapts its poll cadence to the execution's activity
+    deadline = time.time() + h.UPLOAD_TIMEOUT
+    while not tracker.finished and time.time() < deadline:
+        tracker.poll()
+        current, completed = tracker.current_step, tracker.last_completed_step
+
+        # get a msg not yet used
+        # current is None until the first step is entered
+        available_msgs = c.LAMBDAS.get(current, {}).get("progress", [])
+        unused_msgs = list(set(available_msgs) - used_msgs)
+
+        if unused_msgs:
+            msg = random.choice(unused_msgs)
+            used_msgs.add(msg)
+            h.animate_typing(msg)
+        else:
+            # all messages used, allow reuse
+            used_msgs.clear()
+
+        if completed != completed_reference:
+            completed_reference = completed
+            st.write(c.LAMBDAS.get(completed)["success"])
+
+        time.sleep(tracker.delay)
+
+    # One last check to emit final completed step's success message
+    tracker.poll()
+    if tracker.last_completed_step != completed_reference:
+        st.write(c.LAMBDAS.get(tracker.last_completed_step)["success"])
+
+    if tracker.error:
+        st.error(f"Something went wrong at {tracker.error['failed_step'] or 'unknown step'}: {tracker.error['error']} — {tracker.error['cause']}")
+
+    result = h.check_lambda_completed(status_key, execution_arn=execution_arn)
+    if result is not True:
+        status.update(label="Processing failed", state="error")
+
+        if result:
+            st.error(f"{c.LAMBDAS.get(result['step'])['error']} {result.get('error', '')}")
+        else:
+            st.error("🔴 Timed out waiting for this statement to be processed. 😔")
+
+        st.stop()
+
+def start_statement_processing(s3, sf, file, statement_key, status_key):
+    """
+    Upload a statement and start its state machine execution, with the master update deferred.
+    Runs in a worker thread, so it must not call any st.* functions.
+
+    Returns:
+        str: the execution's ARN.
+    """
+
+    s3.upload_fileobj(file, c.S3_BUCKET, statement_key)
+    response = sf.start_execution(
+        stateMachineArn=c.UPLOAD_STATE_MACHINE,
+        input=json.dumps({"key": statement_key, "status_key": status_key, "defer_merge": True})
+    )
+
+    return response["executionArn"]
+
+def upload_statements(files, issuers):
+    """
+    Upload several statements at once, each with its own issuer, so mixed-issuer batches run in one go.
+
+    Files are uploaded and parsed concurrently, each in its own state machine execution,
+    which skips the master update (defer_merge). Once every statement is parsed, all of them are merged
+    into the master in a single update_master invocation, and the master is reloaded once.
+    """
+
+    user = st.session_state.user
+    formatted_time = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H-%M-%S-%f")
+
+    statement_keys = [f"{user.STATEMENTS_FOLDER}/{issuer}/{issuer}_statement_{formatted_time}_{i}.csv" for i, issuer in enumerate(issuers)]
+    status_keys = [f"{user.STATUS_FOLDER}/{uuid.uuid4()}.json" for _ in files]
+
+    # index -> parsed statement key (None for empty statements), or error message
+    parsed, failed = {}, {}
+
+    # index -> state machine execution ARN
+    executions = {}
+
+    with st.status(f"Uploading {len(files)} statements to cloud...", expanded=True) as status:
+        rows = [st.empty() for _ in files]
+        for row, file in zip(rows, files):
+            row.write(f"⚪ {file.name}: waiting to upload...")
+
+        # clients are resolved on the script thread, as c.s3 and c.sf go through st.cache_resource,
+        # and passed to every worker call; boto3 clients are safe to share across threads
+        s3, sf = c.s3, c.sf
+
+        with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as pool:
+            futures = {
+                pool.submit(start_statement_processing, s3, sf, file, statement_key, status_key): i
+                for i, (file, statement_key, status_key) in enumerate(zip(files, statement_keys, status_keys))
+            }
+
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    executions[i] = future.result()
+                    rows[i].write(f"🟠 {files[i].name}: uploaded, parsing...")
+                except Exception as e:
+                    failed[i] = f"upload failed: {e}"
+                    rows[i].write(f"🔴 {files[i].name}: {failed[i]}")
+
+            # poll every pending status object per round, with exponential backoff between rounds
+            pending = [i for i in range(len(files)) if i not in failed]
+            deadline = time.time() + h.UPLOAD_TIMEOUT
+            delay = h.STATUS_POLL_INITIAL_DELAY
+
+            while pending and time.time() < deadline:
+                time.sleep(delay)
+                delay = min(delay * 2, h.STATUS_POLL_MAX_DELAY)
 
-            with st.status("Uploading to cloud...", expanded=True) as status:
                 try:
-                    c.s3.upload_fileobj(file, c.S3_BUCKET, new_statement_key)
-                    st.write("🟢 Uploaded to cloud ☁️")
+                    statuses = list(pool.map(
+                        partial(h.read_upload_status, s3=s3, sf=sf),
+                        [status_keys[i] for i in pending], [executions[i] for i in pending]
+                    ))
                 except Exception as e:
-                    status.update(label="Upload failed", state="error")
-                    st.error(f"🔴 Upload failed: {e}")
+                    st.warning(f"Status check failed: {e}")
                     st.code(traceback.format_exc())
-                    st.stop()
-
-                input_payload = {"key": new_statement_key}
-                response = c.sf.start_execution(
-                    stateMachineArn=c.UPLOAD_STATE_MACHINE,
-                    input=json.dumps(input_payload)
-                )
-
-                execution_arn = response["executionArn"]
-                completed_reference = None
-                used_msgs = set()
-                msg = None
-                while c.sf.describe_execution(executionArn=execution_arn)["status"] not in c.UPLOAD_STATE_MACHINE_TERMINAL_STATES:
-                    current, completed = h.get_step_status(execution_arn)
-
-                    # get a msg not yet used
-                    available_msgs = c.LAMBDAS.get(current)["progress"]
-                    unused_msgs = list(set(available_msgs) - used_msgs)
-
-                    if unused_msgs:
-                        msg = random.choice(unused_msgs)
-                        used_msgs.add(msg)
-                        h.animate_typing(msg)
+                    break
+
+                for i, result in list(zip(pending, statuses)):
+                    if not h.is_terminal_status(result):
+                        continue
+
+                    h.delete_status(status_keys[i])
+                    pending.remove(i)
+
+                    if result["status"] == h.SUCCESSFUL_CONFIRMATION_TEXT:
+                        parsed[i] = result.get("parsed_statement_key")
+                        rows[i].write(f"🟢 {files[i].name}: parsed")
                     else:
-                        # all messages used, allow reuse
-                        used_msgs.clear()
+                        failed[i] = f"{c.LAMBDAS.get(result['step'])['error']} {result.get('error', '')}"
+                        rows[i].write(f"🔴 {files[i].name}: {failed[i]}")
+
+        for i in pending:
+            h.delete_status(status_keys[i])
+            failed[i] = "timed out waiting for this statement to be processed"
+            rows[i].write(f"🔴 {files[i].name}: {failed[i]} 😔")
+
+        if not parsed:
+            status.update(label="Processing failed", state="error")
+            st.stop()
 
-                    if completed != completed_reference:
-                        completed_reference = completed
-                        st.write(c.LAMBDAS.get(completed)["success"])
-                      
-                    time.sleep(0.5)
+        h.animate_typing(random.choice(c.LAMBDAS[c.UPDATE_MASTER_LAMBDA]["progress"]))
 
-                # One last check to emit final completed step's success message
-                current, completed = h.get_step_status(execution_arn)
-                if completed != completed_reference:
-                    st.write(c.LAMBDAS.get(completed)["success"])
+        try:
+            response = c.aws_lambda.invoke(
+                FunctionName=c.UPDATE_MASTER_LAMBDA,
+                Payload=json.dumps({"body": {"parsed_statement_keys": [parsed[i] for i in sorted(parsed)]}})
+            )
+            result = json.loads(response["Payload"].read())
 
-                status.update(label="done!", state="complete", expanded=False)
+            if "FunctionError" in response or result.get("statusCode") != 200:
+                raise RuntimeError(json.loads(result.get("body", "{}")).get("error", result))
+
+        except Exception as e:
+            status.update(label="Processing failed", state="error")
+            st.error(f"{c.LAMBDAS[c.UPDATE_MASTER_LAMBDA]['error']} {e}")
+            st.stop()
+
+        st.write(c.LAMBDAS[c.UPDATE_MASTER_LAMBDA]["success"])
+
+        # update_master reports rows added and duplicates skipped per parsed statement
+        accounting = {f["key"]: f for f in json.loads(result["body"]).get("files", [])}
+        for i, parsed_key in parsed.items():
+            if parsed_key in accounting:
+                rows[i].write(f"🟢 {files[i].name}: {accounting[parsed_key]['added']} new transactions, {accounting[parsed_key]['duplicates']} duplicates skipped")
+
+        if failed:
+            status.update(label=f"{len(failed)} of {len(files)} statements failed", state="error")
+        else:
+            status.update(label="done!", state="complete", expanded=False)
 
-                # increment num_uploads counter
-                st.session_state.user.update_num_uploads()
+        # increment num_uploads counter
+        user.update_num_uploads(len(parsed))
 
-                # update master contents
-                st.session_state.user.load_master()
+        # update master contents, once for the whole batch
+        user.load_master()
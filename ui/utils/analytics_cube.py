@@ -0,0 +1,81 @@
+import config as c
+import numpy as np
+import pandas as pd
+from datetime import timedelta as td
+
+class AnalyticsCube:
+    """
+    Daily totals per category, aggregated once per master version.
+
+    Holds one row per (day, category) that has transactions, sorted by day, so any time range is a slice
+    found by binary search, and month/week/day rollups are grouped over days instead of raw transactions.
+    Uncategorized transactions are left out, as analytics never uses them.
+    Amounts are summed as integer cents, so totals are exact; they're converted to dollars when plotted.
+    """
+
+    def __init__(self, master):
+        self.min_date = master[c.DATE_COLUMN].min()
+        self.max_date = master[c.DATE_COLUMN].max()
+
+        categorized = master[master[c.CATEGORY_COLUMN].notna()]
+        daily = categorized.groupby(
+            [categorized[c.DATE_COLUMN].dt.normalize(), categorized[c.CATEGORY_COLUMN].astype(object)]
+        )[c.AMOUNT_COLUMN].sum().reset_index()
+
+        self.daily = daily.sort_values(c.DATE_COLUMN, kind="stable", ignore_index=True)
+        self.dates = self.daily[c.DATE_COLUMN].to_numpy(dtype="datetime64[ns]")
+
+    def window(self, start, end, exclude=()):
+        """
+        Daily totals within [start, end].
+
+        Args:
+            start, end (pd.Timestamp): inclusive date range.
+            exclude (list, optional): categories to leave out, e.g. non-expenses.
+
+        Returns:
+            pd.DataFrame: transaction_date, category and amount columns.
+        """
+
+        lo = np.searchsorted(self.dates, np.datetime64(start, "ns"), side="left")
+        hi = np.searchsorted(self.dates, np.datetime64(end, "ns"), side="right")
+        window = self.daily.iloc[lo:hi]
+
+        if len(exclude):
+            window = window[~window[c.CATEGORY_COLUMN].isin(exclude)]
+
+        return window
+
+    def category_totals(self, window):
+        """Net amount per category over a window, one row per category."""
+        return window.groupby(c.CATEGORY_COLUMN, sort=False)[c.AMOUNT_COLUMN].sum().reset_index()
+
+    def rollup(self, window, start, end, categories):
+        """
+        Absolute net amount per category and period, over a window.
+        Periods are months for ranges over 60 days, weeks (starting Monday) over 15 days, and days otherwise.
+
+        Returns:
+            pd.DataFrame: category, group_by and amount columns.
+        """
+
+        window = window[window[c.CATEGORY_COLUMN].isin(categories)]
+        dates = window[c.DATE_COLUMN]
+
+        if (end - start) > td(days=60):
+            # group by month
+            periods = dates.to_numpy(dtype="datetime64[M]").astype("datetime64[ns]")
+        elif (end - start) > td(days=15):
+            # group by week
+            periods = dates - pd.to_timedelta(dates.dt.weekday, unit="D")
+        else:
+            # group by day
+            periods = dates
+
+        return (
+            window.assign(**{c.GROUP_BY_COLUMN: periods})
+            .groupby([c.CATEGORY_COLUMN, c.GROUP_BY_COLUMN])[c.AMOUNT_COLUMN]
+            .sum()
+            .abs()
+            .reset_index()
+        )
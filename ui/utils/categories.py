@@ -0,0 +1,88 @@
+import config as c
+import pandas as pd
+from utils.helpers import extract_categories
+
+# node colors by parent, ordered by depth in the categories model: (parent, child, grandchild)
+PARENT_COLORS = {
+    c.INCOME_PARENT_CATEGORY_KEY: ("#014400", "#158013"),
+    c.SAVINGS_PARENT_CATEGORY_KEY: ("#72b772", "#bae7ba"),
+    c.EXPENSES_PARENT_CATEGORY_KEY: ("#d62728", "#f75d5d", "#ffcccc"),
+}
+
+# e.g. non-expenses, which are never rendered
+DEFAULT_COLOR = "#000000"
+
+class CategoryModel:
+    """
+    A user's categories.json, compiled once into a flat table with set and dict lookups.
+
+    categories.json nests categories under parents (its top-level keys), and expense categories under buckets:
+        {"Income": [...], "Savings": [...], "Expenses": {"<bucket>": [...]}, "Non-Expenses": [...]}
+
+    - table: one row per category, with its parent, bucket (None outside of expenses) and color.
+    - parent_categories / bucket_categories: parent or bucket -> its categories, in categories.json order.
+    - parent_of / bucket_of: category -> its parent or bucket.
+    - hierarchy: (level, node, category) rows, to roll category totals up to parents and buckets with a groupby.
+
+    It's rebuilt only when categories.json changes, as identified by its ETag, see User.load_categories().
+    """
+
+    def __init__(self, body, etag=None):
+        self.body = body
+        self.etag = etag
+
+        expenses_body = body.get(c.EXPENSES_PARENT_CATEGORY_KEY, {})
+        self.parents = list(body.keys())
+        self.buckets = list(expenses_body.keys()) if isinstance(expenses_body, dict) else []
+
+        rows = []
+        for parent, parent_body in body.items():
+            if parent == c.EXPENSES_PARENT_CATEGORY_KEY and self.buckets:
+                rows += [(category, parent, bucket) for bucket in self.buckets for category in extract_categories(expenses_body[bucket])]
+            else:
+                rows += [(category, parent, None) for category in extract_categories(parent_body)]
+
+        self.parent_categories = {parent: [] for parent in self.parents}
+        self.bucket_categories = {bucket: [] for bucket in self.buckets}
+        for category, parent, bucket in rows:
+            self.parent_categories[parent].append(category)
+            if bucket is not None:
+                self.bucket_categories[bucket].append(category)
+
+        self.categories = [category for category, _, _ in rows]
+        self.category_set = frozenset(self.categories)
+        self.parent_sets = {parent: frozenset(categories) for parent, categories in self.parent_categories.items()}
+
+        # a category listed more than once keeps its first placement
+        self.parent_of, self.bucket_of = {}, {}
+        for category, parent, bucket in rows:
+            self.parent_of.setdefault(category, parent)
+            self.bucket_of.setdefault(category, bucket)
+
+        # node colors, assigned from lowest to highest precedence
+        expense_colors, savings_colors, income_colors = (PARENT_COLORS[key] for key in (
+            c.EXPENSES_PARENT_CATEGORY_KEY, c.SAVINGS_PARENT_CATEGORY_KEY, c.INCOME_PARENT_CATEGORY_KEY
+        ))
+        self.colors = {category: expense_colors[2] for category in self.categories_of(c.EXPENSES_PARENT_CATEGORY_KEY)}
+        self.colors.update({bucket: expense_colors[1] for bucket in self.buckets})
+        self.colors.update({category: savings_colors[1] for category in self.categories_of(c.SAVINGS_PARENT_CATEGORY_KEY)})
+        self.colors.update({category: income_colors[1] for category in self.categories_of(c.INCOME_PARENT_CATEGORY_KEY)})
+        self.colors.update({parent: colors[0] for parent, colors in PARENT_COLORS.items()})
+
+        self.table = pd.DataFrame(rows, columns=["category", "parent", "bucket"])
+        self.table["color"] = [self.color(category) for category in self.categories]
+
+        primary = self.table[["parent", "category"]].rename(columns={"parent": "node"}).assign(level="primary")
+        buckets = self.table.loc[self.table["bucket"].notna(), ["bucket", "category"]].rename(columns={"bucket": "node"}).assign(level="bucket")
+        self.hierarchy = pd.concat([primary, buckets], ignore_index=True)[["level", "node", "category"]]
+
+    def categories_of(self, parent):
+        """Categories under a parent, e.g. c.INCOME_PARENT_CATEGORY_KEY; empty if the parent isn't defined."""
+        return self.parent_categories.get(parent, [])
+
+    def is_under(self, category, parent):
+        return category in self.parent_sets.get(parent, ())
+
+    def color(self, node):
+        """Color of a parent, bucket or category node."""
+        return self.colors.get(node, DEFAULT_COLOR)
@@ -0,0 +1,114 @@
+import config as c
+import streamlit as st
+
+# get_execution_history page size; a poll usually finds a handful of new events, which fit in its first page
+HISTORY_PAGE_SIZE = 20
+
+# poll cadence adapts between these delays
+# it resets to the minimum when new events arrive, and backs off while the execution is quiet
+MIN_POLL_DELAY = 0.5    # seconds
+MAX_POLL_DELAY = 4      # seconds
+POLL_BACKOFF_FACTOR = 1.5
+
+EXECUTION_TERMINAL_EVENTS = [
+    "ExecutionSucceeded",
+    "ExecutionFailed",
+    "ExecutionTimedOut",
+    "ExecutionAborted"
+]
+
+class ExecutionTracker:
+    """
+    Tracks the progress of a Step Functions execution incrementally.
+
+    get_execution_history can't start after a given event, and its last page has no nextToken to resume from,
+    so each poll() reads the history newest first, and stops at the first page reaching the last seen event id.
+    A poll makes a single call unless HISTORY_PAGE_SIZE or more events are new, no matter how long the history grows.
+    """
+
+    def __init__(self, execution_arn):
+        self.execution_arn = execution_arn
+
+        # id of the newest event applied
+        self.last_event_id = 0
+
+        # step state
+        self.current_step = None
+        self.last_completed_step = None
+        self.error = None
+        self.finished = False
+
+        self.delay = MIN_POLL_DELAY
+
+    def poll(self):
+        """
+        Fetch and apply history events newer than the last seen event.
+
+        Returns:
+            list[dict]: the new events, oldest first.
+        """
+
+        # newest first, until a page reaches an event seen by an earlier poll
+        new_events = []
+        kwargs = {}
+        while True:
+            response = c.sf.get_execution_history(
+                executionArn=self.execution_arn,
+                maxResults=HISTORY_PAGE_SIZE,
+                reverseOrder=True,
+                **kwargs
+            )
+
+            events = response["events"]
+            new_events.extend(e for e in events if e["id"] > self.last_event_id)
+
+            if "nextToken" not in response or any(e["id"] <= self.last_event_id for e in events):
+                break
+            kwargs = {"nextToken": response["nextToken"]}
+
+        new_events.reverse()
+
+        for event in new_events:
+            self.apply(event)
+
+        if new_events:
+            self.last_event_id = new_events[-1]["id"]
+            self.delay = MIN_POLL_DELAY
+        else:
+            self.delay = min(self.delay * POLL_BACKOFF_FACTOR, MAX_POLL_DELAY)
+
+        return new_events
+
+    def apply(self, event):
+        """Update step state from a single history event."""
+
+        if event["type"] == "TaskStateEntered":
+            self.current_step = event["stateEnteredEventDetails"]["name"]
+
+        elif event["type"] == "TaskStateExited":
+            self.last_completed_step = event["stateExitedEventDetails"]["name"]
+
+        elif event["type"] in ["TaskFailed", "ExecutionFailed"]:
+            details = event.get("taskFailedEventDetails") or event.get("executionFailedEventDetails") or {}
+            self.error = {
+                "error": details.get("error", "UnknownError"),
+                "cause": details.get("cause", "No cause provided"),
+                "failed_step": self.current_step
+            }
+
+        if event["type"] in EXECUTION_TERMINAL_EVENTS:
+            self.finished = True
+
+def get_tracker(execution_arn):
+    """
+    Returns the session's tracker for execution_arn, so step state survives Streamlit reruns.
+    """
+
+    if "execution_trackers" not in st.session_state:
+        st.session_state.execution_trackers = {}
+
+    trackers = st.session_state.execution_trackers
+    if execution_arn not in trackers:
+        trackers[execution_arn] = ExecutionTracker(execution_arn)
+
+    return trackers[execution_arn]
@@ -0,0 +1,166 @@
+import re
+import config as c
+import numpy as np
+import pandas as pd
+import utils.helpers as h
+import utils.master_schema as schema
+from collections import defaultdict
+
+# text filters match substrings, via an index of this n-gram length
+NGRAM_LENGTH = 3
+
+# queries with any of these are matched as regexes, e.g. uber|lyft or ^AMZN, as str.contains() did
+REGEX_METACHARACTERS = frozenset(".^$*+?{}[]\\|()")
+
+def ngrams(text):
+    return {text[i:i + NGRAM_LENGTH] for i in range(len(text) - NGRAM_LENGTH + 1)}
+
+class TextIndex:
+    """
+    Case-insensitive substring index over a text column.
+
+    Rows are factorized to their distinct lower-cased values, and an n-gram posting list is built over those values,
+    so a query only verifies the few values that contain all its n-grams, instead of scanning every row.
+    Regex queries are searched in every distinct value.
+    """
+
+    def __init__(self, values):
+        # NA values get code -1, and never match
+        self.codes, uniques = pd.factorize(values)
+        self.values = [str(value).lower() for value in uniques]
+        self.postings = None
+
+    def build_postings(self):
+        postings = defaultdict(list)
+        for i, value in enumerate(self.values):
+            for gram in ngrams(value):
+                postings[gram].append(i)
+
+        self.postings = {gram: np.array(ids) for gram, ids in postings.items()}
+
+    def contains(self, query):
+        """
+        Returns:
+            np.ndarray[bool]: True for rows containing query, case-insensitively; as a regex if it has any
+                REGEX_METACHARACTERS and compiles, literally otherwise.
+        """
+
+        # the trailing False is looked up by NA rows, whose code is -1
+        matches = np.zeros(len(self.values) + 1, dtype=bool)
+
+        if REGEX_METACHARACTERS.intersection(query):
+            try:
+                pattern = re.compile(query, re.IGNORECASE)
+            except re.error:
+                pattern = None
+
+            if pattern is not None:
+                matches[:-1] = [pattern.search(value) is not None for value in self.values]
+                return matches[self.codes]
+
+        query = query.lower()
+
+        if len(query) < NGRAM_LENGTH:
+            candidates = range(len(self.values))
+        else:
+            # built on first use, so text columns that are never filtered cost nothing
+            if self.postings is None:
+                self.build_postings()
+
+            empty = np.array([], dtype=int)
+            lists = sorted((self.postings.get(gram, empty) for gram in ngrams(query)), key=len)
+            candidates = lists[0]
+            for ids in lists[1:]:
+                candidates = np.intersect1d(candidates, ids, assume_unique=True)
+
+        matches[[i for i in candidates if query in self.values[i]]] = True
+
+        return matches[self.codes]
+
+class FilterIndex:
+    """
+    Precomputed indexes over a master, for the categorize view's filters.
+
+    - dates: sorted once, so a date range is two binary searches.
+    - issuers and categories: factorized to integer codes.
+    - descriptions and notes: n-gram indexes, see TextIndex.
+
+    filter() returns row positions in master order, so master.iloc[positions] matches the equivalent boolean mask.
+    """
+
+    def __init__(self, master):
+        self.size = len(master)
+
+        dates = master[c.DATE_COLUMN].to_numpy(dtype="datetime64[ns]")
+        self.date_order = np.argsort(dates, kind="stable")
+        self.sorted_dates = dates[self.date_order]
+
+        # in cents, as stored in master
+        self.amounts = master[c.AMOUNT_COLUMN].to_numpy(dtype=float, na_value=np.nan)
+
+        self.issuer_codes, self.issuers = pd.factorize(master[c.ISSUER_COLUMN])
+        self.category_codes, self.categories = pd.factorize(master[c.CATEGORY_COLUMN])
+
+        self.text = {
+            c.DESCRIPTION_COLUMN: TextIndex(master[c.DESCRIPTION_COLUMN]),
+            c.NOTES_COLUMN: TextIndex(master[c.NOTES_COLUMN]),
+        }
+
+    def codes_for(self, uniques, values):
+        codes = pd.Index(uniques).get_indexer(values)
+        return codes[codes >= 0]
+
+    def date_range(self, min_date, max_date):
+        """Boolean mask of rows dated within [min_date, max_date]."""
+
+        lo = np.searchsorted(self.sorted_dates, np.datetime64(min_date, "ns"), side="left")
+        hi = np.searchsorted(self.sorted_dates, np.datetime64(max_date, "ns"), side="right")
+
+        mask = np.zeros(self.size, dtype=bool)
+        mask[self.date_order[lo:hi]] = True
+        return mask
+
+    def num_uncategorized(self):
+        return int((self.category_codes == -1).sum())
+
+    def num_in_categories(self, categories):
+        return int(np.isin(self.category_codes, self.codes_for(self.categories, categories)).sum())
+
+    def filter(self, min_date, max_date, min_amount, max_amount, issuers=None, categories=None,
+               uncategorized=False, description=None, notes=None):
+        """
+        Apply the categorize view's filters. Empty filters don't filter.
+
+        Args:
+            min_date, max_date (pd.Timestamp): inclusive date range.
+            min_amount, max_amount (float): inclusive amount range, in dollars.
+            issuers (list, optional): statement issuers to keep.
+            categories (list, optional): categories to keep; ignored if uncategorized.
+            uncategorized (bool): keep uncategorized rows only.
+            description, notes (str, optional): case-insensitive substrings or regexes to match, see TextIndex.contains().
+
+        Returns:
+            np.ndarray: positions of matching rows, in master order.
+        """
+
+        mask = self.date_range(min_date, max_date)
+        mask &= (self.amounts >= min_amount * schema.CENTS) & (self.amounts <= max_amount * schema.CENTS)
+
+        if issuers:
+            mask &= np.isin(self.issuer_codes, self.codes_for(self.issuers, issuers))
+
+        if uncategorized:
+            mask &= self.category_codes == -1
+        elif categories:
+            mask &= np.isin(self.category_codes, self.codes_for(self.categories, categories))
+
+        if description:
+            mask &= self.text[c.DESCRIPTION_COLUMN].contains(description)
+        if notes:
+            mask &= self.text[c.NOTES_COLUMN].contains(notes)
+
+        return np.flatnonzero(mask)
+
+def get_filter_index():
+    """Returns the session's FilterIndex for the current master, see h.cached_for_master()."""
+    return h.cached_for_master("filter_index", FilterIndex)
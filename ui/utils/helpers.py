@@ -1,102 +1,141 @@
 import time
+import json
 import traceback
 import config as c
+import pandas as pd
 import streamlit as st
 from streamlit.components.v1 import html
+from botocore.exceptions import ClientError
 
 from datetime import date, timedelta
 
 LAMBDA_TIMEOUT = 30  # seconds
-POLL_INTERVAL = 1    # seconds
+UPLOAD_TIMEOUT = 300 # seconds
 
-# Lambda functions log these explicitly
+# status objects are polled with exponential backoff, between these delays
+STATUS_POLL_INITIAL_DELAY = 0.25  # seconds
+STATUS_POLL_MAX_DELAY = 2         # seconds
+
+# Lambda functions write these to the upload's status object
 SUCCESSFUL_CONFIRMATION_TEXT = "SUCCESS"
 ERROR_CONFIRMATION_TEXT = "FAILURE" 
 
 MISSING_ARGUMENTS_NOTICE = "Missing one or more required arguments."
 
-def check_lambda_completed(log_group, invocation_time):
+def read_status(status_key, s3=None):
     """
-    Polls recent log streams in the given log group to detect Lambda execution result.
+    Reads the status object written by the upload's Lambda functions.
 
     Args:
-        log_group (str): Name of the CloudWatch log group.
-        invocation_time (int): Epoch timestamp (in ms) of Lambda invocation to filter logs.
+        status_key (str): S3 key of the status object, passed to the Lambda functions on invocation.
+        s3 (optional): S3 client, defaults to c.s3; see read_upload_status() for worker threads.
 
     Returns:
-        True: if a successful confirmation message is found.
-        list[str]: log messages if an error confirmation is found.
-        False: if no confirmation is found before timeout.
+        dict: with step, status, and optionally error keys; None if no step has reported yet.
     """
 
-    for _ in range(LAMBDA_TIMEOUT // POLL_INTERVAL):
-        try:
-            streams = c.logs.describe_log_streams(
-                logGroupName=log_group,
-                orderBy="LastEventTime",
-                descending=True,
-                limit=3
-            )
-
-            for stream in streams.get("logStreams", []):
-                stream_name = stream["logStreamName"]
-                events = c.logs.get_log_events(
-                    logGroupName=log_group,
-                    logStreamName=stream_name,
-                    startFromHead=False
-                ).get("events", [])
-
-                valid_events = [e for e in events if e["timestamp"] >= invocation_time]
-                logged_messages = [e["message"] for e in valid_events]
-
-                if any(SUCCESSFUL_CONFIRMATION_TEXT in msg for msg in logged_messages):
-                    return True
-                
-                elif any(ERROR_CONFIRMATION_TEXT in msg for msg in logged_messages):
-                    return valid_events
-        
-        except Exception as e:
-            st.warning(f"Log check failed: {e}")
-            st.text("Detailed traceback:")
-            st.code(traceback.format_exc())
-            
-            break
+    try:
+        response = (s3 or c.s3).get_object(Bucket=c.S3_BUCKET, Key=status_key)
+        return json.loads(response["Body"].read().decode("utf-8"))
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchKey':
+            return None
+        raise
+
+def read_upload_status(status_key, execution_arn=None, s3=None, sf=None):
+    """
+    Reads the upload's status object, and falls back to its state machine execution's status.
 
-        time.sleep(POLL_INTERVAL)
-    
-    return False
+    Lambda functions that crash, time out or run out of memory never write their status object,
+    so once the execution has ended without a terminal status, a failure status is returned on their behalf.
 
-def get_step_status(execution_arn):
-    history = c.sf.get_execution_history(
-        executionArn=execution_arn,
-        maxResults=1000,
-        reverseOrder=True
-    )
+    Args:
+        status_key (str): S3 key of the status object, passed to the Lambda functions on invocation.
+        execution_arn (str, optional): the upload's state machine execution; without it, only the status object is read.
+        s3, sf (optional): S3 and Step Functions clients, default to c.s3 and c.sf.
+            Those resolve through st.cache_resource, so worker threads must pass clients resolved on the script thread.
 
-    current_step = None
-    last_completed_step = None
+    Returns:
+        dict: with step, status, and optionally error keys; None if no step has reported yet.
+    """
 
-    for event in history["events"]:
-        if not current_step and event["type"] == "TaskStateEntered":
-            current_step = event["stateEnteredEventDetails"]["name"]
+    status = read_status(status_key, s3)
+    if is_terminal_status(status) or execution_arn is None:
+        return status
 
-        if not last_completed_step and event["type"] in ["TaskStateExited", "TaskSucceeded"]:
-            last_completed_step = event["stateExitedEventDetails"]["name"]
+    execution = (sf or c.sf).describe_execution(executionArn=execution_arn)
+    if execution["status"] == "RUNNING":
+        return status
 
-        if event["type"] in ["TaskFailed", "ExecutionFailed"]:
-            details = event.get("taskFailedEventDetails") or event.get("executionFailedEventDetails") or {}
-            error_info = {
-                "error": details.get("error", "UnknownError"),
-                "cause": details.get("cause", "No cause provided"),
-                "failed_step": current_step
-            }
+    # the last step may have reported its result just before the execution ended
+    status = read_status(status_key, s3)
+    if is_terminal_status(status):
+        return status
 
-            st.error(f"Something went wrong at {current_step or 'unknown step'}: {error_info['error']} — {error_info['cause']}")
+    # the failed step is the one after the last step that reported, if any
+    steps = list(c.LAMBDAS.keys())
+    return {
+        "step": steps[steps.index(status["step"]) + 1] if status else steps[0],
+        "status": ERROR_CONFIRMATION_TEXT,
+        "error": execution.get("cause") or execution.get("error") or f"execution {execution['status'].lower()}",
+    }
 
-        if current_step and last_completed_step:
-            break  # found both, break loop
+def delete_status(status_key):
+    """Deletes the upload's status object, e.g. once its result is read; a failure to delete is ignored."""
 
-    return current_step, last_completed_step
+    try:
+        c.s3.delete_object(Bucket=c.S3_BUCKET, Key=status_key)
+    except Exception:
+        pass
+
+def is_terminal_status(status):
+    """Upload processing is finished once any step fails, or the last step succeeds."""
+
+    if status is None:
+        return False
+
+    last_step = list(c.LAMBDAS.keys())[-1]
+    return status["status"] == ERROR_CONFIRMATION_TEXT or status["step"] == last_step
+
+def check_lambda_completed(status_key, timeout=LAMBDA_TIMEOUT, execution_arn=None):
+    """
+    Polls the upload's status object, with exponential backoff, to detect Lambda execution result.
+    The status object is deleted once a terminal result is read, or on timeout.
+
+    Args:
+        status_key (str): S3 key of the status object, passed to the Lambda functions on invocation.
+        timeout (int): seconds to wait for a terminal result.
+        execution_arn (str, optional): the upload's state machine execution, see read_upload_status().
+
+    Returns:
+        True: if the last step reported success.
+        dict: the status object if a step reported failure.
+        False: if no terminal result is found before timeout.
+    """
+
+    deadline = time.time() + timeout
+    delay = STATUS_POLL_INITIAL_DELAY
+
+    while time.time() < deadline:
+        try:
+            status = read_upload_status(status_key, execution_arn)
+        except Exception as e:
+            st.warning(f"Status check failed: {e}")
+            st.text("Detailed traceback:")
+            st.code(traceback.format_exc())
+            
+            break
+
+        if is_terminal_status(status):
+            delete_status(status_key)
+            return True if status["status"] == SUCCESSFUL_CONFIRMATION_TEXT else status
+
+        time.sleep(min(delay, max(deadline - time.time(), 0)))
+        delay = min(delay * 2, STATUS_POLL_MAX_DELAY)
+
+    # a step may still report after the timeout, so its status object is cleaned up here
+    delete_status(status_key)
+    return False
 
 def get_time_range_dates(time_range):
     today = date.today()
@@ -196,6 +235,55 @@ def extract_categories(obj):
 
     return res
 
+def diff_edits(before, after):
+    """
+    Diff a st.data_editor input against its output, cell by cell.
+
+    Args:
+        before (pd.DataFrame): the DataFrame passed to st.data_editor.
+        after (pd.DataFrame): the edited DataFrame, with the same index and columns.
+
+    Returns:
+        pd.DataFrame: one row per changed cell, with transaction_id, column and value columns.
+    """
+
+    cells = []
+    for col in after.columns:
+        # compared as objects, so categoricals with different categories still compare
+        old, new = before[col].astype(object), after[col].astype(object)
+        changed = ~((old == new) | (old.isna() & new.isna()))
+
+        if changed.any():
+            cells.append(pd.DataFrame({
+                c.TRANSACTION_ID_COLUMN: after.loc[changed, c.TRANSACTION_ID_COLUMN],
+                "column": col,
+                "value": new[changed].where(new[changed].notna(), None)
+            }))
+
+    if not cells:
+        return pd.DataFrame(columns=[c.TRANSACTION_ID_COLUMN, "column", "value"])
+
+    return pd.concat(cells, ignore_index=True)
+
+def cached_for_master(name, build):
+    """
+    Returns build(master) for the session's current master, cached in st.session_state under name.
+    It is rebuilt only when master changes, as identified by its cache signature, see User.load_master().
+
+    Args:
+        name (str): session state key for the cached value.
+        build (callable): builds the value from master, e.g. an index or aggregate.
+    """
+
+    user = st.session_state.user
+    signature = getattr(user, "master_signature", None)
+    cached = st.session_state.get(name)
+
+    if cached is None or cached[0] != signature or cached[1] is not user.master:
+        st.session_state[name] = (signature, user.master, build(user.master))
+
+    return st.session_state[name][2]
+
 def get_index(lst, idx, default=None):
     """
     Safely get value at list index
@@ -0,0 +1 @@
+../../lambdas/update_master/master_schema.py
\ No newline at end of file
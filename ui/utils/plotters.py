@@ -1,11 +1,48 @@
 import random
 import config as c
+import pandas as pd
 import altair as alt
 import streamlit as st
-import utils.helpers as h
+import utils.master_schema as schema
 import plotly.graph_objects as go
 from utils.helpers import hex_to_rgba
 
+def sankey_totals(df, model):
+    """
+    Totals of the Sankey diagram's category, primary and expense bucket nodes, in integer cents.
+
+    A category's total is the abs of its net sum, a primary node's or bucket's the sum of its categories' totals.
+
+    Args:
+        df (pd.DataFrame): transactions, or per-category sums of them, with category and amount columns.
+        model (CategoryModel): the user's categories model.
+
+    Returns:
+        dict: node -> total, categories first, in categories.json order, then primary nodes, then buckets.
+    """
+
+    # net values for all categories, in a single pass over df
+    category_totals = df.groupby(c.CATEGORY_COLUMN, sort=False, observed=True)[c.AMOUNT_COLUMN].sum().abs()
+    category_totals = category_totals.reindex(pd.Index(model.categories).unique(), fill_value=0)
+    totals = category_totals.to_dict()
+
+    # roll category totals up to primary nodes and expense buckets, via the category hierarchy mapping table
+    # primary nodes are the top-level keys in the categories model
+    hierarchy = model.hierarchy
+    node_totals = (
+        hierarchy["category"].map(category_totals).fillna(0)
+        .groupby([hierarchy["level"], hierarchy["node"]], sort=False).sum()
+        .to_dict()
+    )
+
+    for primary_node in model.parents:
+        totals[primary_node] = node_totals.get(("primary", primary_node), 0)
+
+    for bucket in model.buckets:
+        totals[bucket] = node_totals.get(("bucket", bucket), 0)
+
+    return totals
+
 def sankey(df):
     """
         Generate Sankey diagram for user spending data
@@ -18,24 +55,10 @@ def sankey(df):
     OVERSPENT_CUSTOM_NODE_NAME = "From Cash Reserve"    # Node targeted when income-(savings+expenses) > 0
     UNDERSPENT_CUSTOM_NODE_NAME = "To Cash Reserve"     # Node sourced when income-(savings+expenses) < 0
 
+    model = st.session_state.user.category_model
     source, target, value = [], [], []
 
-    # net values for all categories
-    totals = {
-        category: abs(df[df[c.CATEGORY_COLUMN] == category][c.AMOUNT_COLUMN].sum())
-        for category in st.session_state.user.CATEGORIES
-    }
-
-    # add primary nodes to totals
-    # primary nodes are the top-level keys in the categories model
-    for primary_node in st.session_state.user.CATEGORIES_BODY.keys():
-        primary_node_categories = h.extract_categories(st.session_state.user.CATEGORIES_BODY.get(primary_node, []))
-        totals[primary_node] = sum(totals.get(category, 0) for category in primary_node_categories)
-
-    # add expense buckets to totals
-    for bucket in st.session_state.user.EXPENSES_BODY.keys():
-        bucket_categories = h.extract_categories(st.session_state.user.EXPENSES_BODY.get(bucket, []))
-        totals[bucket] = sum(totals.get(category, 0) for category in bucket_categories)
+    totals = sankey_totals(df, model)
 
     # add custom node values to totals
     total_outflows = totals[c.SAVINGS_PARENT_CATEGORY_KEY] + totals[c.EXPENSES_PARENT_CATEGORY_KEY]
@@ -44,6 +67,9 @@ def sankey(df):
     totals[UNDERSPENT_CUSTOM_NODE_NAME] = max(delta, 0)
     totals[OVERSPENT_CUSTOM_NODE_NAME] = abs(min(delta, 0))
 
+    totals = {node: total / schema.CENTS for node, total in totals.items()}
+    delta = delta / schema.CENTS
+
     # Build labeled nodes with currency (includes both config + dynamic)
     raw_nodes = totals.keys()
     nodes = []
@@ -59,7 +85,7 @@ def sankey(df):
     node_indices = {category: i for i, category in enumerate(raw_nodes)}
 
     # INCOME_CATEGORIES -> INCOME
-    for category in st.session_state.user.INCOME_CATEGORIES:
+    for category in model.categories_of(c.INCOME_PARENT_CATEGORY_KEY):
         if category != c.INCOME_PARENT_CATEGORY_KEY:
             source.append(node_indices[category])
             target.append(node_indices[c.INCOME_PARENT_CATEGORY_KEY])
@@ -76,20 +102,20 @@ def sankey(df):
     value.append(totals[c.SAVINGS_PARENT_CATEGORY_KEY])
 
     # EXPENSES → EXPENSES_BUCKETS → EXPENSES_CATEGORIES 
-    for bucket in st.session_state.user.EXPENSES_BUCKETS:
+    for bucket in model.buckets:
         if bucket != c.EXPENSES_PARENT_CATEGORY_KEY:
             source.append(node_indices[c.EXPENSES_PARENT_CATEGORY_KEY])
             target.append(node_indices[bucket])
             value.append(totals.get(bucket, 0))
 
-        for category in st.session_state.user.EXPENSES_BODY.get(bucket, []):
-            if category != bucket and category in totals.keys():
+        for category in model.bucket_categories[bucket]:
+            if category != bucket and category in totals:
                 source.append(node_indices[bucket])
                 target.append(node_indices[category])
                 value.append(totals.get(category, 0))       
 
     # SAVINGS → SAVINGS_CATEGORIES
-    for category in st.session_state.user.SAVINGS_CATEGORIES:
+    for category in model.categories_of(c.SAVINGS_PARENT_CATEGORY_KEY):
         if category != c.SAVINGS_PARENT_CATEGORY_KEY:
             source.append(node_indices[c.SAVINGS_PARENT_CATEGORY_KEY])
             target.append(node_indices[category])
@@ -105,35 +131,15 @@ def sankey(df):
         target.append(node_indices[c.INCOME_PARENT_CATEGORY_KEY])
         value.append(abs(delta))
 
-    # colors
-    colors_map = {
-        # tuple elements are ordered in hierarchy of categories.json keys
-        c.INCOME_PARENT_CATEGORY_KEY: ("#014400", "#158013"),
-        c.SAVINGS_PARENT_CATEGORY_KEY: ("#72b772", "#bae7ba"),
-        c.EXPENSES_PARENT_CATEGORY_KEY: ("#d62728", "#f75d5d", "#ffcccc"),
-        UNDERSPENT_CUSTOM_NODE_NAME: ("#17becf", "#7fdbff"),
-        OVERSPENT_CUSTOM_NODE_NAME: ("#ff7f0e", "#ffbb78")
+    # colors; the custom nodes aren't in the categories model
+    custom_colors = {
+        UNDERSPENT_CUSTOM_NODE_NAME: "#17becf",
+        OVERSPENT_CUSTOM_NODE_NAME: "#ff7f0e",
     }
 
     # assign node colors in the same order as nodes
-    node_colors = []
-    for cat in raw_nodes:
-        node_color = colors_map.get(cat, None)
-        if node_color:
-            node_colors.append(node_color[0])
-        else:
-            if cat in st.session_state.user.INCOME_CATEGORIES:
-                node_colors.append(colors_map[c.INCOME_PARENT_CATEGORY_KEY][1])
-            elif cat in st.session_state.user.SAVINGS_CATEGORIES:
-                node_colors.append(colors_map[c.SAVINGS_PARENT_CATEGORY_KEY][1])
-            elif cat in st.session_state.user.EXPENSES_BUCKETS:
-                node_colors.append(colors_map[c.EXPENSES_PARENT_CATEGORY_KEY][1])
-            elif cat in st.session_state.user.EXPENSES_CATEGORIES:
-                node_colors.append(colors_map[c.EXPENSES_PARENT_CATEGORY_KEY][2])
-            else:
-                # non-expenses colors; these are not rendered 
-                # but to avoid index out of range errors, we still add to node_colors 
-                node_colors.append("#000000")
+    # non-expenses nodes are not rendered, but still get a (default) color, to avoid index out of range errors
+    node_colors = [custom_colors.get(cat) or model.color(cat) for cat in raw_nodes]
 
     # color links by the target node
     link_colors = [hex_to_rgba(node_colors[t]) for t in target]
@@ -180,10 +186,11 @@ def sankey_json(data):
     if not isinstance(data, dict):
         raise TypeError("Input data must be of type dict.")
     
+    model = st.session_state.user.category_model
     source, target, value = [], [], []
 
     # INCOME_CATEGORIES -> INCOME
-    for category in st.session_state.user.INCOME_CATEGORIES:
+    for category in model.categories_of(c.INCOME_PARENT_CATEGORY_KEY):
         if category != c.INCOME_PARENT_CATEGORY_KEY:
             source.append(category)
             target.append(c.INCOME_PARENT_CATEGORY_KEY)
@@ -200,20 +207,20 @@ def sankey_json(data):
     value.append(1)
 
     # EXPENSES → EXPENSES_BUCKETS → EXPENSES_CATEGORIES 
-    for bucket in st.session_state.user.EXPENSES_BUCKETS:
+    for bucket in model.buckets:
         if bucket != c.EXPENSES_PARENT_CATEGORY_KEY:
             source.append(c.EXPENSES_PARENT_CATEGORY_KEY)
             target.append(bucket)
             value.append(1)
 
-        for category in st.session_state.user.EXPENSES_BODY.get(bucket, []):
-            if category != bucket and category in st.session_state.user.EXPENSES_CATEGORIES:
+        for category in model.bucket_categories[bucket]:
+            if category != bucket and model.is_under(category, c.EXPENSES_PARENT_CATEGORY_KEY):
                 source.append(bucket)
                 target.append(category)
                 value.append(1)      
 
     # SAVINGS → SAVINGS_CATEGORIES
-    for category in st.session_state.user.SAVINGS_CATEGORIES:
+    for category in model.categories_of(c.SAVINGS_PARENT_CATEGORY_KEY):
         if category != c.SAVINGS_PARENT_CATEGORY_KEY:
             source.append(c.SAVINGS_PARENT_CATEGORY_KEY)
             target.append(category)
@@ -279,10 +286,12 @@ def sankey_json(data):
 
 def line_chart(df, x_values):
     """
-    df: a DataFrame already grouped and filtered
+    df: a DataFrame already grouped and filtered, with amounts in cents
     x_values: list of Python datetime objects for your ticks
     """
 
+    df = df.assign(**{c.AMOUNT_COLUMN: schema.to_dollars(df[c.AMOUNT_COLUMN])})
+
     # Base line + point chart
     base = alt.Chart(df).mark_line(
         point=alt.OverlayMarkDef(filled=True, size=40),
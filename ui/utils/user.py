@@ -1,30 +1,23 @@
-import io
 import json
 import time
-import boto3
 import config as c
 import pandas as pd
 import utils.helpers as h
+import utils.master_schema as schema
 
-from io import BytesIO
+from utils.categories import CategoryModel
+from datetime import datetime, timezone
 from botocore.exceptions import ClientError
 
 USERS_TABLE = "users-budget-buddy"
 
-# initialize client
-ddb = boto3.resource(
-    "dynamodb",
-    aws_access_key_id = c.AWS_ACCESS_KEY_ID,
-    aws_secret_access_key = c.AWS_SECRET_ACCESS_KEY,
-    region_name = c.AWS_REGION
-)
-
 class User:
     """
     this User object is used to contain all user-related methods
     instantiated during auth using the auth response payload
 
-    the User class variable contains the src table for storing user data 
+    the table property contains the src table for storing user data
+    the DynamoDB resource is constructed lazily, so importing this module costs no AWS round trips
     
     for Streamlit apps, this object is loaded to st.session_state
     and used as the entry point for:
@@ -32,7 +25,9 @@ class User:
         - accessing user-specific variables
     """
 
-    table = ddb.Table(USERS_TABLE)
+    @property
+    def table(self):
+        return c.get_resource("dynamodb").Table(USERS_TABLE)
 
     def __init__(self, payload):
         self.user_id = payload.get("sub")
@@ -118,14 +113,14 @@ class User:
 
     # ---- project specific logic ----
 
-    def update_num_uploads(self):
+    def update_num_uploads(self, count=1):
         """Updates the number of statements uploaded."""
 
         self.table.update_item(
             Key={"user_id": self.user_id},
             UpdateExpression="ADD num_uploads :inc",
             ExpressionAttributeValues={
-                ":inc": 1
+                ":inc": count
             }
         )
 
@@ -137,62 +132,287 @@ class User:
         self.ROOT_FOLDER = self.email
 
         self.STATEMENTS_FOLDER = f"{self.ROOT_FOLDER}/statements"
+        self.STATUS_FOLDER = f"{self.ROOT_FOLDER}/status"
         self.MASTER_KEY = f"{self.ROOT_FOLDER}/categorized_expenses.parquet"
+        self.MASTER_SEGMENTS_FOLDER = f"{self.ROOT_FOLDER}/master_segments"
+        self.MASTER_EDITS_FOLDER = f"{self.ROOT_FOLDER}/master_edits"
         self.CATEGORIES_KEY = f"{self.ROOT_FOLDER}/categories.json"
 
+        # session-scoped cache of decoded master objects, key -> (ETag, pd.DataFrame), see read_parquet()
+        self.parquet_cache = {}
+
+        # edit logs are immutable, so they're cached by key alone, see read_edits()
+        self.edits_cache = {}
+
+        self.load_categories()
+
+    def load_categories(self):
+        """
+        Load categories.json into the user's CategoryModel.
+
+        The model is revalidated with a conditional GET, and only rebuilt when categories.json's ETag changes.
+        The category attributes below are views over the model, kept for the sections that read them directly.
+        """
+
+        model = getattr(self, "category_model", None)
+
         try:
-            response = c.s3.get_object(Bucket=c.S3_BUCKET, Key=self.CATEGORIES_KEY)
+            kwargs = {"IfNoneMatch": model.etag} if model and model.etag else {}
+            response = c.s3.get_object(Bucket=c.S3_BUCKET, Key=self.CATEGORIES_KEY, **kwargs)
+            body = json.loads(response['Body'].read().decode("utf-8"))
+            self.category_model = CategoryModel(body, etag=response["ETag"])
         except ClientError as e:
-            if e.response['Error']['Code'] == 'NoSuchKey':
+            if e.response['Error']['Code'] in ('304', 'NotModified'):
+                pass
+            elif e.response['Error']['Code'] == 'NoSuchKey':
                 # user has no defined categories
-                # initialize a default response object that will pass downstream commands
-                response = {"Body": io.BytesIO(b"{}")}
-
-        self.CATEGORIES_BODY = json.loads(response['Body'].read().decode("utf-8"))
-        self.CATEGORIES = h.extract_categories(self.CATEGORIES_BODY)
-        self.INCOME_CATEGORIES = h.extract_categories(self.CATEGORIES_BODY.get(c.INCOME_PARENT_CATEGORY_KEY, {}))
-        self.SAVINGS_CATEGORIES = h.extract_categories(self.CATEGORIES_BODY.get(c.SAVINGS_PARENT_CATEGORY_KEY, {}))
-        self.EXPENSES_CATEGORIES = h.extract_categories(self.CATEGORIES_BODY.get(c.EXPENSES_PARENT_CATEGORY_KEY, {}))
-        self.NON_EXPENSES_CATEGORIES = h.extract_categories(self.CATEGORIES_BODY.get(c.NON_EXPENSES_PARENT_CATEGORY_KEY, {}))
-        
+                self.category_model = CategoryModel({})
+            else:
+                raise
+
+        model = self.category_model
+        self.CATEGORIES_BODY = model.body
+        self.CATEGORIES = model.categories
+        self.INCOME_CATEGORIES = model.categories_of(c.INCOME_PARENT_CATEGORY_KEY)
+        self.SAVINGS_CATEGORIES = model.categories_of(c.SAVINGS_PARENT_CATEGORY_KEY)
+        self.EXPENSES_CATEGORIES = model.categories_of(c.EXPENSES_PARENT_CATEGORY_KEY)
+        self.NON_EXPENSES_CATEGORIES = model.categories_of(c.NON_EXPENSES_PARENT_CATEGORY_KEY)
+
         self.EXPENSES_BODY = self.CATEGORIES_BODY.get(c.EXPENSES_PARENT_CATEGORY_KEY, {})
-        self.EXPENSES_BUCKETS = self.EXPENSES_BODY.keys()
+        self.EXPENSES_BUCKETS = model.buckets
 
-    def load_master(self):
-        master = None
+    def read_parquet(self, key, revalidate=True):
+        """
+        Read a Parquet object from S3, through the session's ETag cache.
 
-        # load master data
-        try:
-            response = c.s3.get_object(Bucket=c.S3_BUCKET, Key=self.MASTER_KEY)
-            raw = response["Body"].read()
-            buffer = BytesIO(raw)
+        Cached objects are revalidated with a conditional GET, so an unchanged object costs a 304, with no download or decoding.
+        Cached DataFrames are shared, callers must not modify them in place.
 
-            master = pd.read_parquet(buffer)
-            master = master.sort_values(by=c.DATE_COLUMN, ascending=False)
+        Args:
+            key (str): S3 key of the Parquet object.
+            revalidate (bool): if False, a cached object is returned without a request; only safe for immutable objects.
 
+        Returns:
+            pd.DataFrame, conformed to the master schema; or None if the key does not exist.
+        """
+        cached = self.parquet_cache.get(key)
+        if cached and not revalidate:
+            return cached[1]
+
+        try:
+            kwargs = {"IfNoneMatch": cached[0]} if cached else {}
+            response = c.s3.get_object(Bucket=c.S3_BUCKET, Key=key, **kwargs)
         except ClientError as e:
+            if e.response['Error']['Code'] in ('304', 'NotModified'):
+                return cached[1]
             if e.response['Error']['Code'] == 'NoSuchKey':
-                # master doesn't exist, skip loading
-                pass
+                self.parquet_cache.pop(key, None)
+                return None
+            raise
+
+        df = schema.read(response["Body"].read())
+        self.parquet_cache[key] = (response["ETag"], df)
+
+        return df
+
+    def list_keys(self, folder):
+        """List keys in folder, oldest first."""
+        keys = []
+        paginator = c.s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=c.S3_BUCKET, Prefix=f"{folder}/"):
+            keys.extend(obj["Key"] for obj in page.get("Contents", []))
+
+        # keys are timestamped, so lexical order is chronological
+        return sorted(keys)
+
+    def list_master_segments(self):
+        """
+        List master segment keys, oldest first.
+        Segments hold rows appended by the update_master lambda that are not yet compacted into the base master.
+        """
+        return self.list_keys(self.MASTER_SEGMENTS_FOLDER)
+
+    def list_master_edits(self):
+        """
+        List edit log keys, oldest first.
+        Edit logs hold cells edited by the user that are not yet compacted into the base master.
+        """
+        return self.list_keys(self.MASTER_EDITS_FOLDER)
+
+    def read_edits(self, key):
+        """
+        Read an edit log from S3, see save_edits() for the format.
+
+        Returns:
+            pd.DataFrame: edited cells, with transaction_id, column and value columns.
+        """
+        if key not in self.edits_cache:
+            response = c.s3.get_object(Bucket=c.S3_BUCKET, Key=key)
+            records = json.loads(response["Body"].read().decode("utf-8"))
+            self.edits_cache[key] = pd.DataFrame(records, columns=schema.EDIT_COLUMNS)
+
+        return self.edits_cache[key]
+
+    def load_master(self):
+        """
+        Load master as the base master merged with all uncompacted segments, with the user's edit logs applied on top.
+        The base master wins on duplicate transaction_ids, since it holds the user's compacted edits.
+
+        Reloads are cheap when nothing changed: the base master is revalidated by ETag, segments and edit logs are
+        immutable so they're only downloaded once, and the merged, sorted master is reused as is.
+        """
+        master = None
+
+        segment_keys = self.list_master_segments()
+        edit_keys = self.list_master_edits()
+        frames = {
+            key: self.read_parquet(key, revalidate=key == self.MASTER_KEY)
+            for key in [self.MASTER_KEY, *segment_keys]
+        }
+
+        # the base master is only rewritten at this ETag, see update_master(); None if there's no base master yet
+        self.master_base_etag = self.parquet_cache[self.MASTER_KEY][0] if frames[self.MASTER_KEY] is not None else None
+
+        # segments and edit logs compacted into the base master no longer need to be cached
+        for key in set(self.parquet_cache) - set(frames):
+            del self.parquet_cache[key]
+        for key in set(self.edits_cache) - set(edit_keys):
+            del self.edits_cache[key]
+
+        # the merged master is identified by the ETags of the objects it was merged from
+        signature = tuple((key, self.parquet_cache[key][0]) for key, df in frames.items() if df is not None) + tuple(edit_keys)
+        if signature and signature == getattr(self, "master_signature", None):
+            self.master_segments = segment_keys
+            self.master_edits = edit_keys
+            return
+
+        frames = [df for df in frames.values() if df is not None]
+
+        if frames:
+            master = schema.concat(frames) if len(frames) > 1 else frames[0]
+            master = master.drop_duplicates(subset=[c.TRANSACTION_ID_COLUMN])
+            master = master.sort_values(by=c.DATE_COLUMN, ascending=False)
+
+            if edit_keys:
+                schema.apply_edits(master, pd.concat([self.read_edits(key) for key in edit_keys], ignore_index=True))
 
         self.master = master
+        self.master_signature = signature
 
-    def update_master(self, master):
+        # segments and edit logs merged into this session's master
+        # these are folded into the base master on the next update_master()
+        self.master_segments = segment_keys
+        self.master_edits = edit_keys
+
+    def save_edits(self, edits):
         """
-        Update master in S3 with the provided DataFrame.
-        
+        Save the user's edits as a small edit log, and apply them to this session's master.
+        Saves cost O(edited cells), the base master is only rewritten once MAX_MASTER_EDIT_LOGS edit logs accumulate.
+
+        Edit logs are stored at <MASTER_EDITS_FOLDER>/<timestamp>.json, as a list of
+        {"transaction_id": ..., "column": ..., "value": ...} records, see schema.edits_to_records().
+        Amount values are in dollars, as shown in the editor, dates are ISO 8601 strings and missing values are null.
+
         Args:
-            master (pd.DataFrame): The DataFrame to upload as the new master.
+            edits (pd.DataFrame): edited cells, see h.diff_edits().
         """
-        # Save to Parquet in memory
-        out_buffer = BytesIO()
-        master.to_parquet(out_buffer, index=False, compression='snappy')
+        timestamp = datetime.now(timezone.utc).strftime(c.BACKUP_TIMESTAMP_FORMAT)
+        key = f"{self.MASTER_EDITS_FOLDER}/{timestamp}.json"
 
-        # Upload updated master file
+        records = schema.edits_to_records(edits)
         c.s3.put_object(
             Bucket=c.S3_BUCKET,
-            Key=f"{self.MASTER_KEY}",
-            Body=out_buffer.getvalue()
+            Key=key,
+            Body=json.dumps(records),
+            ContentType='application/json'
+        )
+
+        # keep the session's master, and its cache signature, in step with S3
+        # edits are applied as logged, so this session's master matches one loaded from S3
+        edits = pd.DataFrame(records, columns=schema.EDIT_COLUMNS)
+        schema.apply_edits(self.master, edits)
+        self.edits_cache[key] = edits
+        self.master_edits = [*getattr(self, "master_edits", []), key]
+        self.master_signature = (*getattr(self, "master_signature", ()), key)
+
+        # the edit log is deleted once compacted, so the lambda must have copied it by then
+        compacting = len(self.master_edits) >= c.MAX_MASTER_EDIT_LOGS
+        self.record_edits_backup(key, wait=compacting)
+
+        if compacting:
+            self.update_master(self.master)
+
+    def update_master(self, master):
+        """
+        Update master in S3 with the provided DataFrame.
+        Segments and edit logs that were merged into master on load are deleted, as they are now in the base master.
+
+        The base master is only overwritten if it's unchanged since this session loaded it.
+        Otherwise, e.g. the update_master lambda compacted newer segments into it, nothing is written and the master is reloaded;
+        edit logs are only deleted once they're in the base master, so no edits are lost, and compaction is retried on a later save.
+
+        Args:
+            master (pd.DataFrame): The DataFrame to upload as the new master, merged from the base master this session loaded.
+
+        Returns:
+            bool: True if the master was written, False if the base master changed since it was loaded.
+        """
+        etag = getattr(self, "master_base_etag", None)
+        conditions = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+
+        # Upload updated master file, in the compact master schema
+        master = schema.conform(master)
+        try:
+            response = c.s3.put_object(
+                Bucket=c.S3_BUCKET,
+                Key=f"{self.MASTER_KEY}",
+                Body=schema.write(master),
+                **conditions
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] not in c.S3_WRITE_CONFLICT_CODES:
+                raise
+
+            self.load_master()
+            return False
+
+        merged_keys = getattr(self, "master_segments", []) + getattr(self, "master_edits", [])
+        if merged_keys:
+            c.s3.delete_objects(
+                Bucket=c.S3_BUCKET,
+                Delete={"Objects": [{"Key": key} for key in merged_keys]}
+            )
+
+        self.master_segments = []
+        self.master_edits = []
+        self.edits_cache = {}
+
+        # the uploaded master is now the whole master, cache it so the next load_master() is a 304
+        # the cache holds its own copy, since self.master is edited in place by save_edits()
+        if not master[c.DATE_COLUMN].is_monotonic_decreasing:
+            master = master.sort_values(by=c.DATE_COLUMN, ascending=False)
+
+        self.parquet_cache = {self.MASTER_KEY: (response["ETag"], master.copy())}
+        self.master = master
+        self.master_signature = ((self.MASTER_KEY, response["ETag"]),)
+        self.master_base_etag = response["ETag"]
+
+        return True
+
+    def record_edits_backup(self, edit_key, wait=False):
+        """
+        Have the update_master lambda record an edit log as a backup delta.
+        Backups are managed by the lambda alone, see lambdas/update_master/backups.py for the format.
+
+        Args:
+            edit_key (str): key of the edit log, see save_edits().
+            wait (bool): if True, wait for the delta to be recorded; otherwise the lambda is invoked asynchronously.
+        """
+
+        c.aws_lambda.invoke(
+            FunctionName=c.UPDATE_MASTER_LAMBDA,
+            InvocationType="RequestResponse" if wait else "Event",
+            Payload=json.dumps({"body": {"action": c.RECORD_EDITS_ACTION, "edit_log_key": edit_key}})
         )
 
     def update_categories(self, categories):